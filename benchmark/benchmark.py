@@ -0,0 +1,249 @@
+"""Food trucks benchmark: times each stage of the project on generated truck data,
+using a mocked s3 bucket and, optionally, a local MySQL database.
+Each stage's latency percentiles, throughput and peak memory are compared
+against a stored baseline to catch regressions."""
+# Standard library imports
+from argparse import ArgumentParser, Namespace
+from datetime import date, timedelta
+from hashlib import md5
+from json import dump, load as load_json
+from os import environ as ENV, path
+import sys
+from time import perf_counter
+import tracemalloc
+from unittest.mock import patch
+
+# Third-party imports
+from boto3 import client
+from dotenv import load_dotenv
+from moto import mock_aws
+import numpy as np
+import pandas as pd
+import pymysql
+from pymysql.constants import CLIENT
+
+# Local imports
+from generate_data import generate_truck_files
+
+# The services are each built from their own folder
+ROOT = path.join(path.dirname(path.abspath(__file__)), "..")
+for service in ("pipeline", "report", "dashboard"):
+    sys.path.append(path.join(ROOT, service))
+
+# pylint: disable=wrong-import-position
+from extract import list_s3_objects, stream_truck_data_files, ENV as EXTRACT_ENV
+from transform import combine_streamed_files, clean_transactions
+from load import load, LOAD_METHODS, LOAD_METHOD
+import report
+import dashboard
+
+
+BUCKET = "food-trucks-benchmark"
+START_DAY = date(2025, 1, 1)
+# As inserted by database/schema.sql
+PAYMENT_MAPPING = {"cash": 1, "card": 2}
+REPEAT = 5
+TOLERANCE = 0.2
+BASELINE = "baseline.json"
+# Compared against the baseline, a higher value is a regression
+COMPARED_METRICS = ("p50", "peak_memory")
+
+
+def initialise_args() -> Namespace:
+    """Gets the cli arguments"""
+    parser = ArgumentParser()
+    parser.add_argument("-d", "--days", type=int, default=7,
+        help="-d or --days the number of days of truck files to generate.")
+    parser.add_argument("-r", "--rows", type=int, default=200,
+        help="-r or --rows the number of transactions in each truck file.")
+    parser.add_argument("-n", "--repeat", type=int, default=REPEAT,
+        help="-n or --repeat the number of times to time each stage.")
+    parser.add_argument("-w", "--workers", type=int, default=8,
+        help="-w or --workers the number of files to download at the same time.")
+    parser.add_argument("-l", "--load_method", choices=LOAD_METHODS, default=LOAD_METHOD,
+        help="-l or --load_method the load method to benchmark.")
+    parser.add_argument("--database", action='store_true',
+        help="--database also benchmarks load, report and the dashboard queries against the "
+             "BENCHMARK_DB_* database. ALL of its tables are recreated.")
+    parser.add_argument("-b", "--baseline", default=BASELINE,
+        help="-b or --baseline the json file of results to compare against.")
+    parser.add_argument("--save_baseline", action='store_true',
+        help="--save_baseline saves the results as the baseline instead of comparing.")
+    parser.add_argument("-t", "--tolerance", type=float, default=TOLERANCE,
+        help="-t or --tolerance how much worse than the baseline is a regression, eg. 0.2")
+    return parser.parse_args()
+
+
+def summarise(latencies: list[float], rows: int, peak_memory: int) -> dict:
+    """Gets the latency percentiles, throughput and peak memory of a stage."""
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99),
+            "rows_per_second": rows / p50 if p50 else None, "peak_memory": peak_memory}
+
+
+def measure(run, rows: int, repeat: int) -> dict:
+    """Times a stage repeat times, then measures its peak memory on one more run,
+    as tracing allocations slows it down."""
+    latencies = []
+    for _ in range(repeat):
+        start = perf_counter()
+        run()
+        latencies.append(perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return summarise(latencies, rows, peak_memory)
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Gets a description of each metric that is worse than the baseline by more than tolerance."""
+    regressions = []
+    for stage, result in results["stages"].items():
+        if stage not in baseline["stages"]:
+            continue
+        for metric in COMPARED_METRICS:
+            expected = baseline["stages"][stage][metric]
+            if result[metric] > expected * (1 + tolerance):
+                regressions.append(f"{stage} {metric}: {result[metric]:.4g} "
+                                   f"(baseline {expected:.4g})")
+    return regressions
+
+
+def benchmark_extract(files: dict[str, bytes], rows: int, workers: int, repeat: int) -> dict:
+    """Lists and reads every file from a mocked s3 bucket."""
+    with patch.dict(ENV, {"AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing"}), \
+            patch.dict(EXTRACT_ENV, {"BUCKET": BUCKET}), mock_aws():
+        s3_client = client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+        for key, body in files.items():
+            s3_client.put_object(Bucket=BUCKET, Key=key, Body=body)
+
+        def run():
+            keys = [obj["Key"] for obj in list_s3_objects(s3_client)]
+            for _ in stream_truck_data_files(s3_client, keys, workers):
+                pass
+        return measure(run, rows, repeat)
+
+
+def transform_files(files: dict[str, bytes]) -> pd.DataFrame:
+    """Transforms the files as the pipeline does, without querying the payment methods."""
+    return clean_transactions(combine_streamed_files(files.items()), PAYMENT_MAPPING)
+
+
+def get_benchmark_connection(**kwargs) -> pymysql.Connection:
+    """Gets a connection to the benchmark database."""
+    return pymysql.connect(host=ENV["BENCHMARK_DB_HOST"],
+                           port=int(ENV.get("BENCHMARK_DB_PORT", 3306)),
+                           user=ENV["BENCHMARK_DB_USER"],
+                           password=ENV["BENCHMARK_DB_PASSWORD"],
+                           database=ENV["BENCHMARK_DB_NAME"],
+                           charset='utf8mb4',
+                           cursorclass=pymysql.cursors.DictCursor,
+                           **kwargs)
+
+
+def create_tables() -> None:
+    """Recreates every table in the benchmark database from database/schema.sql."""
+    with open(path.join(ROOT, "database", "schema.sql"), encoding="UTF-8") as file:
+        sql = file.read()
+    conn = get_benchmark_connection(client_flag=CLIENT.MULTI_STATEMENTS)
+    cur = conn.cursor()
+    cur.execute(sql)
+    while cur.nextset():
+        pass
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def benchmark_load(conn: pymysql.Connection, trucks_df: pd.DataFrame, files: dict[str, bytes],
+                   method: str, repeat: int) -> dict:
+    """Loads the transformed files. After the first run the files are replaced,
+    as when they are uploaded again."""
+    s3_objects = {key: {"Key": key, "ETag": f'"{md5(body).hexdigest()}"', "Size": len(body)}
+                  for key, body in files.items()}
+    return measure(lambda: load(conn, trucks_df.copy(), s3_objects, set(), method),
+                   len(trucks_df), repeat)
+
+
+def benchmark_report(days: int, rows: int, repeat: int) -> dict:
+    """Generates the report for every generated day, with report's own connection."""
+    database_env = {"DB_HOST": ENV["BENCHMARK_DB_HOST"], "DB_USER": ENV["BENCHMARK_DB_USER"],
+                    "DB_PASSWORD": ENV["BENCHMARK_DB_PASSWORD"],
+                    "DB_NAME": ENV["BENCHMARK_DB_NAME"]}
+    end = START_DAY + timedelta(days=days - 1)
+    with patch.dict(report.ENV, database_env), patch.object(report, "CONNECTION", None):
+        return measure(lambda: report.main(START_DAY, end), rows, repeat)
+
+
+def benchmark_dashboard(conn: pymysql.Connection, days: int, rows: int,
+                        repeat: int) -> dict[str, dict]:
+    """Runs each dashboard query, bypassing the dashboard's query cache."""
+    end = START_DAY + timedelta(days=days)
+    queries = {
+        "dashboard_sales_series": lambda: dashboard.get_sales_series(conn, START_DAY, end),
+        "dashboard_sales_per_truck": lambda: dashboard.get_sales_per_truck(conn, 7),
+        "dashboard_payment_proportions": lambda: dashboard.get_payment_proportions(conn),
+        "dashboard_popular_times": lambda: dashboard.get_popular_times(conn),
+        "dashboard_metrics": lambda: dashboard.get_metrics(conn)
+    }
+    with patch.object(dashboard, "query", dashboard.run_query):
+        return {name: measure(run, rows, repeat) for name, run in queries.items()}
+
+
+def run_benchmarks(args: Namespace) -> dict:
+    """Generates the truck files and benchmarks each stage."""
+    files = generate_truck_files(args.days, args.rows, START_DAY)
+    rows = len(files) * args.rows
+    stages = {"extract": benchmark_extract(files, rows, args.workers, args.repeat),
+              "transform": measure(lambda: transform_files(files), rows, args.repeat)}
+
+    if args.database:
+        create_tables()
+        trucks_df = transform_files(files)
+        conn = get_benchmark_connection(local_infile=args.load_method == "infile")
+        try:
+            stages["load"] = benchmark_load(conn, trucks_df, files, args.load_method, args.repeat)
+            stages["report"] = benchmark_report(args.days, len(trucks_df), args.repeat)
+            stages.update(benchmark_dashboard(conn, args.days, len(trucks_df), args.repeat))
+        finally:
+            conn.close()
+
+    return {"scale": {"days": args.days, "rows": args.rows, "files": len(files)},
+            "stages": stages}
+
+
+def print_results(results: dict) -> None:
+    """Prints a table of the results."""
+    print(f"{'stage':<30} {'p50':>9} {'p95':>9} {'p99':>9} {'rows/s':>12} {'peak MB':>9}")
+    for stage, result in results["stages"].items():
+        print(f"{stage:<30} {result['p50']:8.4f}s {result['p95']:8.4f}s {result['p99']:8.4f}s "
+              f"{result['rows_per_second'] or 0:12,.0f} {result['peak_memory'] / 1e6:9.2f}")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    arguments = initialise_args()
+    benchmark_results = run_benchmarks(arguments)
+    print_results(benchmark_results)
+
+    if arguments.save_baseline:
+        with open(arguments.baseline, "w", encoding="UTF-8") as baseline_file:
+            dump(benchmark_results, baseline_file, indent=4)
+        print(f"Saved the baseline to {arguments.baseline}")
+    elif path.exists(arguments.baseline):
+        with open(arguments.baseline, encoding="UTF-8") as baseline_file:
+            baseline_results = load_json(baseline_file)
+        if baseline_results["scale"] != benchmark_results["scale"]:
+            print("The baseline was run at a different scale, so it isn't compared.")
+        else:
+            found_regressions = compare_to_baseline(
+                benchmark_results, baseline_results, arguments.tolerance)
+            for regression in found_regressions:
+                print(f"REGRESSION {regression}")
+            if found_regressions:
+                sys.exit(1)
+            print("No regressions against the baseline.")
@@ -0,0 +1,61 @@
+"""Food trucks benchmark: generates truck csvs like the ones uploaded to s3,
+including the messy totals and payment types the pipeline has to clean."""
+# Standard library imports
+from datetime import date, timedelta
+
+# Third-party imports
+import numpy as np
+import pandas as pd
+
+
+TRUCK_IDS = range(1, 7)
+OPENING_HOURS = range(9, 18)
+# Payment types as they appear in the csvs, and how often
+PAYMENT_TYPES = {"card": 0.45, "Card": 0.1, "cash": 0.3, "CASH": 0.1, "crypto": 0.04, "": 0.01}
+# How often a total is recorded in pence, negative, VOID or missing
+PENCE_RATE = 0.05
+NEGATIVE_RATE = 0.02
+VOID_RATE = 0.01
+MISSING_RATE = 0.01
+
+
+def get_key(day: date, hour: int, truck_id: int) -> str:
+    """Gets the s3 key of a truck's file for an hour, eg. trucks/.../truck_T3_2025010109.csv"""
+    return f"trucks/{day:%Y-%m-%d}/{hour:02d}/truck_T{truck_id}_{day:%Y%m%d}{hour:02d}.csv"
+
+
+def generate_truck_csv(day: date, hour: int, rows: int, rng: np.random.Generator) -> bytes:
+    """Generates an hour of one truck's transactions as csv."""
+    seconds = np.sort(rng.integers(0, 3600, rows))
+    timestamps = pd.Timestamp(day) + pd.Timedelta(hours=hour) + pd.to_timedelta(seconds, unit="s")
+    totals = np.round(rng.uniform(2, 20, rows), 2)
+
+    messiness = rng.random(rows)
+    total_text = totals.astype(str).astype(object)
+    pence = messiness < PENCE_RATE
+    total_text[pence] = (totals[pence] * 100).astype(int).astype(str)
+    negative = (messiness >= PENCE_RATE) & (messiness < PENCE_RATE + NEGATIVE_RATE)
+    total_text[negative] = (-totals[negative]).astype(str)
+    void_start = PENCE_RATE + NEGATIVE_RATE
+    total_text[(messiness >= void_start) & (messiness < void_start + VOID_RATE)] = "VOID"
+    missing_start = void_start + VOID_RATE
+    total_text[(messiness >= missing_start) & (messiness < missing_start + MISSING_RATE)] = ""
+
+    payment_types = rng.choice(list(PAYMENT_TYPES), rows, p=list(PAYMENT_TYPES.values()))
+    df = pd.DataFrame({"timestamp": timestamps.strftime("%Y-%m-%d %H:%M:%S"),
+                       "type": payment_types, "total": total_text})
+    return df.to_csv(index=False).encode()
+
+
+def generate_truck_files(days: int, rows_per_file: int, start: date = date(2025, 1, 1),
+                         seed: int = 0) -> dict[str, bytes]:
+    """Generates a file for every truck for every opening hour of each day, keyed by s3 key."""
+    rng = np.random.default_rng(seed)
+    files = {}
+    for n in range(days):
+        day = start + timedelta(days=n)
+        for hour in OPENING_HOURS:
+            for truck_id in TRUCK_IDS:
+                files[get_key(day, hour, truck_id)] = generate_truck_csv(
+                    day, hour, rows_per_file, rng)
+    return files
@@ -0,0 +1,21 @@
+"""Testing benchmark.py functions"""
+# Local imports
+from benchmark import summarise, compare_to_baseline
+
+
+def test_summarise():
+    result = summarise([1.0, 2.0, 3.0, 4.0, 5.0], rows=300, peak_memory=1000)
+    assert result["p50"] == 3.0
+    assert result["p95"] == 4.8
+    assert result["rows_per_second"] == 100
+    assert result["peak_memory"] == 1000
+
+
+def test_compare_to_baseline_finds_regressions():
+    baseline = {"stages": {"extract": {"p50": 1.0, "peak_memory": 100},
+                           "transform": {"p50": 1.0, "peak_memory": 100}}}
+    results = {"stages": {"extract": {"p50": 1.1, "peak_memory": 150},
+                          "transform": {"p50": 2.0, "peak_memory": 100},
+                          "load": {"p50": 5.0, "peak_memory": 100}}}
+    assert compare_to_baseline(results, baseline, tolerance=0.2) == [
+        "extract peak_memory: 150 (baseline 100)", "transform p50: 2 (baseline 1)"]
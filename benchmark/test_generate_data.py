@@ -0,0 +1,17 @@
+"""Testing generate_data.py functions"""
+# Local imports
+from benchmark import transform_files
+from generate_data import generate_truck_files
+from transform import get_truck_id
+
+
+def test_generated_files_are_cleaned_like_truck_files():
+    files = generate_truck_files(days=1, rows_per_file=50)
+    assert len(files) == 6 * 9
+    assert {get_truck_id(key) for key in files} == {1, 2, 3, 4, 5, 6}
+
+    trucks_df = transform_files(files)
+    # Some rows are VOID, missing or crypto and are removed
+    assert 0 < len(trucks_df) < 6 * 9 * 50
+    assert trucks_df["total"].between(0, 100).all()
+    assert set(trucks_df["payment_method_id"]) == {1, 2}
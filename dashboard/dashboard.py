@@ -1,14 +1,27 @@
 """Streamlit app for the project."""
 # Native imports
+from collections import OrderedDict
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
 from os import environ as ENV
+from queue import Queue, Empty
+from threading import Lock, current_thread
+from time import monotonic
 
 # Third-party imports
 from dotenv import load_dotenv
 import pymysql
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import altair as alt
 import pandas as pd
 
+# Local imports
+from snapshot import TransactionSnapshot
+from timeseries import choose_resolution, BUCKET_SQL, MAX_POINTS
+
 
 # Get database connection
 def initialise_connection():
@@ -19,19 +32,177 @@ def initialise_connection():
                            database=ENV["DB_NAME"],
                            charset='utf8mb4',
                            port=int(ENV["DB_PORT"]),
+                           autocommit=True,
                            cursorclass=pymysql.cursors.DictCursor)
 
 
+DEFAULT_RANGE_DAYS = 365
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+POOL_TIMEOUT = 30
+
+
+# Connection pool
+class ConnectionPool:
+    """A pool of database connections shared by every session.
+    Connections are opened as they are needed, up to max_size,
+    and are checked with a ping before they are handed out."""
+
+    def __init__(self, min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE,
+                 timeout: float = POOL_TIMEOUT):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle = Queue()
+        self.size = 0
+        self.lock = Lock()
+        for _ in range(min_size):
+            self.idle.put(self.open())
+
+    def open(self) -> pymysql.Connection:
+        """Opens a new connection, counting it towards the pool size."""
+        with self.lock:
+            if self.size >= self.max_size:
+                return None
+            self.size += 1
+        try:
+            return initialise_connection()
+        except Exception:
+            with self.lock:
+                self.size -= 1
+            raise
+
+    def discard(self, conn: pymysql.Connection) -> None:
+        """Closes a connection and removes it from the pool."""
+        try:
+            conn.close()
+        except pymysql.Error:
+            pass
+        with self.lock:
+            self.size -= 1
+
+    def acquire(self) -> pymysql.Connection:
+        """Gets a healthy connection, waiting up to timeout seconds if every
+        connection is in use."""
+        try:
+            conn = self.idle.get_nowait()
+        except Empty:
+            conn = self.open()
+            if conn is not None:
+                return conn
+            try:
+                conn = self.idle.get(timeout=self.timeout)
+            except Empty as e:
+                raise TimeoutError("No database connection available") from e
+        try:
+            # Reconnects if the server has closed a stale connection
+            conn.ping(reconnect=True)
+        except pymysql.Error:
+            self.discard(conn)
+            return self.acquire()
+        return conn
+
+    def release(self, conn: pymysql.Connection) -> None:
+        """Returns a connection to the pool."""
+        if conn.open:
+            self.idle.put(conn)
+        else:
+            self.discard(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[pymysql.Connection]:
+        """Borrows a connection for the duration of the with block."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+
+@st.cache_resource
+def get_connection_pool() -> ConnectionPool:
+    """Gets the connection pool for this process."""
+    return ConnectionPool()
+
+
+QUERY_CACHE_SIZE = 256
+VERSION_CHECK_SECONDS = 5
+# The pipeline moves the load version on in every transaction that changes the data.
+# The highest transaction_id isn't enough, as loads running at the same time can
+# commit their ids out of order.
+VERSION_SQL = "select load_version as version from transaction_deletes where delete_id = 1;"
+
+
+# Query cache
+class QueryCache:
+    """A size bounded cache of query results, shared by every session.
+    The results are cleared whenever the version of the data changes."""
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE):
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.version = None
+        self.checked_at = None
+        self.lock = Lock()
+
+    def check_version(self, conn: pymysql.Connection) -> None:
+        """Clears the results if the data has changed since they were cached.
+        The version is only checked every VERSION_CHECK_SECONDS."""
+        with self.lock:
+            now = monotonic()
+            if self.checked_at is not None and now - self.checked_at < VERSION_CHECK_SECONDS:
+                return
+            version = run_query(VERSION_SQL, conn)[0]["version"]
+            if version != self.version:
+                self.results.clear()
+                self.version = version
+            self.checked_at = now
+
+    def get(self, key: tuple):
+        """Gets a cached result, or None if it isn't cached."""
+        with self.lock:
+            if key not in self.results:
+                return None
+            self.results.move_to_end(key)
+            return self.results[key]
+
+    def set(self, key: tuple, output) -> None:
+        """Caches a result, evicting the least recently used if the cache is full."""
+        with self.lock:
+            self.results[key] = output
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+
+@st.cache_resource
+def get_query_cache() -> QueryCache:
+    """Gets the query cache for this process."""
+    return QueryCache()
+
+
 # Query function
-def query(sql_query: str, conn: pymysql.Connection):
-    """A function for querying to the database."""
+def run_query(sql_query: str, conn: pymysql.Connection, params: tuple = None):
+    """Runs a query on the database."""
     cur = conn.cursor()
-    cur.execute(sql_query)
+    cur.execute(sql_query, params)
     output = cur.fetchall()
     cur.close()
     return output
 
 
+def query(sql_query: str, conn: pymysql.Connection, params: tuple = None):
+    """A function for querying to the database.
+    Results are cached until the data changes."""
+    cache = get_query_cache()
+    cache.check_version(conn)
+    key = (sql_query, params)
+    output = cache.get(key)
+    if output is None:
+        output = run_query(sql_query, conn, params)
+        cache.set(key, output)
+    return output
+
+
 # Get maps
 def get_payment_method_map(conn: pymysql.Connection) -> dict:
     """Gets the payment method type and the payment method id"""
@@ -45,6 +216,13 @@ def get_truck_name_map(conn: pymysql.Connection) -> dict:
     return {str(row["truck_id"]): str(row["truck_name"]) for row in output}
 
 
+@st.cache_resource
+def get_dimensions(_conn: pymysql.Connection) -> dict:
+    """Gets the truck names and payment methods, loaded once for this process."""
+    return {"truck_names": get_truck_name_map(_conn),
+            "payment_methods": get_payment_method_map(_conn)}
+
+
 # Dashboard setup
 def initialise_dashboard() -> None:
     """Set up the dashboard."""
@@ -65,36 +243,21 @@ def padding(n: int, col) -> None:
             st.write(" ")
 
 
-# Create graphs
-def total_sales_graph(conn: pymysql.Connection, col) -> None:
-    """Creates a graph of total sales over the last day, week, month or year."""
+# Select timeframes
+def select_total_sales_range(col) -> tuple[date, date]:
+    """Gets the range of days to show the total sales for,
+    as the first day and the day after the last."""
     _, _, _, d = col.columns(4)
-    timeframe = d.selectbox("Select a timeframe",
-                                 ["day", "week", "month", "year"], key="total_sales")
-    timeframe_map = {
-        'day': 'DATE',
-        'week': 'WEEK',
-        'month': 'MONTH',
-        'year': 'YEAR'
-    }
-    timeframe = timeframe_map[timeframe]
-    if timeframe not in ["DATE", "WEEK", "MONTH", "YEAR"]:
-        raise ValueError("Invalid timeframe provided")
-    cur = conn.cursor()
-    cur.execute(f"""
-        select sum(total) as total, {timeframe}(at) as time
-        from Transaction
-        group by {timeframe}(at);
-        """)
-    output = cur.fetchall()
-    cur.close()
-    df = pd.DataFrame(output)
-    col.line_chart(df, x="time", y="total", use_container_width=True, x_label="Time",
-                  y_label="Total Sales £")
+    today = date.today()
+    default_range = (today - timedelta(days=DEFAULT_RANGE_DAYS), today)
+    selected = d.date_input("Select a date range", value=default_range, key="total_sales")
+    # Only the first day is returned while the user is still picking the range
+    start, end = selected if len(selected) == 2 else (selected[0], today)
+    return start, end + timedelta(days=1)
 
 
-def sales_per_truck_graph(conn: pymysql.Connection, col) -> None:
-    """Sales per truck over the last day, week, month or year."""
+def select_sales_per_truck_timeframe(col) -> int:
+    """Gets the number of days to total the sales per truck over."""
     timeframe = col.selectbox("Select a timeframe", ["day", "week", "month", "year"],
                              key="best_performing_truck")
     timeframe_map = {
@@ -106,21 +269,65 @@ def sales_per_truck_graph(conn: pymysql.Connection, col) -> None:
     timeframe = timeframe_map[timeframe]
     if timeframe not in [1, 7, 31, 365]:
         raise ValueError("Invalid timeframe provided")
-
-    cur = conn.cursor()
-    cur.execute(f"""
+    return timeframe
+
+
+# Get graph data
+def get_sales_series(conn: pymysql.Connection, start: date, end: date,
+                     max_points: int = MAX_POINTS) -> dict:
+    """Gets the total sales from start up to end, in at most max_points buckets.
+    Each point's time is the first day of its bucket."""
+    resolution = choose_resolution(start, end, max_points)
+    output = query(f"""
+        select {BUCKET_SQL[resolution]} as time, sum(total) as total
+        from Transaction_Daily
+        where day >= %s and day < %s
+        group by time
+        order by time;
+        """, conn, (start, end))
+    return {"resolution": resolution, "points": output}
+
+
+def get_sales_per_truck(conn: pymysql.Connection, timeframe: int) -> list[dict]:
+    """Gets the sales per truck over the last timeframe days."""
+    return query("""
         SELECT SUM(total) AS total, truck_id
-        FROM Transaction
-        WHERE at > DATE_SUB(NOW(), INTERVAL {timeframe} DAY)
+        FROM Transaction_Hourly
+        WHERE hour_start >= DATE_SUB(NOW(), INTERVAL %s DAY)
         GROUP BY truck_id;
-        """)
-    output = cur.fetchall()
-    cur.close()
+        """, conn, (timeframe,))
+
+
+def get_payment_proportions(conn: pymysql.Connection) -> list[dict]:
+    """Gets the number of transactions with each payment method."""
+    sql = """select sum(transaction_count) as count, payment_method_id
+    from Transaction_Daily
+    group by payment_method_id;"""
+    return query(sql, conn)
+
+
+def get_popular_times(conn: pymysql.Connection) -> list[dict]:
+    """Gets the number of transactions in each hour of the day."""
+    sql = """select hour(hour_start) as hour, sum(transaction_count) as count
+        from Transaction_Hourly
+        group by HOUR(hour_start);"""
+    return query(sql, conn)
+
+
+# Create graphs
+def total_sales_graph(series: dict, col) -> None:
+    """Creates a graph of total sales over the selected range."""
+    df = pd.DataFrame(series["points"], columns=["time", "total"])
+    col.line_chart(df, x="time", y="total", use_container_width=True,
+                   x_label=f"Time (by {series['resolution']})", y_label="Total Sales £")
+
+
+def sales_per_truck_graph(output: list[dict], truck_names: dict, col) -> None:
+    """Sales per truck over the last day, week, month or year."""
     df = pd.DataFrame(output)
     if len(df.columns) > 1:
-        mapping = get_truck_name_map(conn)
         mapped_output = [{'total': row["total"],
-                    'truck_name': mapping[str(row['truck_id'])]} for row in output]
+                    'truck_name': truck_names[str(row['truck_id'])]} for row in output]
         mapped_df = pd.DataFrame(mapped_output)
         chart = alt.Chart(mapped_df).mark_bar().encode(
             alt.X("total", title="Truck sales"),
@@ -130,15 +337,11 @@ def sales_per_truck_graph(conn: pymysql.Connection, col) -> None:
         col.altair_chart(chart, use_container_width=True)
 
 
-def payment_proportions_graph(conn: pymysql.Connection, col) -> None:
+def payment_proportions_graph(output: list[dict], payment_methods: dict, col) -> None:
     """Proportions of payment types."""
-    sql = """select count(*) as count, payment_method_id
-    from Transaction
-    group by payment_method_id;"""
-    output = query(sql, conn)
-    mapping = get_payment_method_map(conn)
     mapped_output = [{'count': row['count'],
-                    'payment_method': mapping[str(row['payment_method_id'])]} for row in output]
+                    'payment_method': payment_methods[str(row['payment_method_id'])]}
+                     for row in output]
     df = pd.DataFrame(mapped_output)
     proportions = alt.Chart(df,
         title=alt.Title("Proportions of payment types", anchor="middle")).mark_arc().encode(
@@ -148,12 +351,8 @@ def payment_proportions_graph(conn: pymysql.Connection, col) -> None:
     col.altair_chart(proportions, use_container_width=True)
 
 
-def popular_times_graph(conn: pymysql.Connection, col) -> None:
+def popular_times_graph(output: list[dict], col) -> None:
     """Popular times graph"""
-    sql = """select hour(at) as hour, count(truck_id) as count
-        from Transaction
-        group by HOUR(at);"""
-    output = query(sql, conn)
     df = pd.DataFrame(output)
     popular_times = alt.Chart(df).mark_bar(size=20).encode(
         alt.X("hour",title="Hour of day"),
@@ -163,92 +362,171 @@ def popular_times_graph(conn: pymysql.Connection, col) -> None:
 
 
 # Create metrics
-def total_sales_metric(conn: pymysql.Connection, col) -> None:
-    """Gets the total sales."""
-    sql = """select round(sum(total), 2) as total_sales from Transaction;"""
-    total_sales_value = query(sql, conn)[0]['total_sales']
-    col.metric(label="Total Sales", value=f'£{total_sales_value}', border =True)
-
-
-def best_performing_truck_metric(conn: pymysql.Connection, col) -> None:
-    """Gets the best performing truck on the day."""
-    sql = """select round(sum(total), 2) as total, truck_id
-    from Transaction
-    where date(at) = (select(max(date(at))) from Transaction) 
-    group by truck_id
-    order by total desc
-    limit 1
-    """
-    output = query(sql, conn)[0]
-    mapping = get_truck_name_map(conn)
-    mapped_output = {'total': output["total"], 'truck_name': mapping[str(output['truck_id'])]}
-    col.metric(label = f'Truck {mapped_output['truck_name']} is doing best today',
-              value=f'£{mapped_output['total']}', border =True)
-
-
-def todays_sale_metric(conn: pymysql.Connection, col) -> None:
-    """"Gets todays total sales."""
-    sql = """select round(sum(total), 2) as total from Transaction
-    where date(at) = ( select max(date(at)) from Transaction ) ;
-    """
-    output = query(sql, conn)[0]
-    col.metric(label="Total Sales Today", value=f'£{output['total']}', border =True)
-
-
-def percentage_increase_metric(conn: pymysql.Connection, col) -> None:
-    """"Gets the sales percentage change from the previous day."""
-    sql = """select sum(total) as total, date(at) as date
-    from Transaction 
-    group by date(at)
-    order by date desc
-    limit 2;"""
-    output = query(sql, conn)
-    today, yesterday = output[0]['total'], output[1]['total']
-    percentage_increase = ((today - yesterday) / yesterday) * 100
-    col.metric(label="Percentage increase from previous day", value=f'{round(percentage_increase)}%', border =True)
+# The total of every day, and the total per truck on the latest two days, in one query
+METRICS_SQL = """select day, truck_id, sum(total) as total
+    from Transaction_Daily
+    where day >= coalesce(
+        (select max(day) from Transaction_Daily
+         where day < (select max(day) from Transaction_Daily)),
+        (select max(day) from Transaction_Daily))
+    group by day, truck_id
+    union all
+    select null, null, sum(total) from Transaction_Daily;"""
+
+
+def calculate_metrics(rows: list[dict]) -> dict:
+    """Calculates the headline numbers from the rows of the metrics query."""
+    totals = {}
+    truck_totals = {}
+    total_sales = 0
+    for row in rows:
+        if row["day"] is None:
+            total_sales = row["total"] or 0
+        else:
+            totals[row["day"]] = totals.get(row["day"], 0) + row["total"]
+            truck_totals.setdefault(row["day"], {})[row["truck_id"]] = row["total"]
+    days = sorted(totals, reverse=True)
+
+    metrics = {"total_sales": round(total_sales, 2), "today": None,
+               "best_truck_id": None, "best_truck_total": None, "percentage_increase": None}
+    if days:
+        today = days[0]
+        best_truck_id = max(truck_totals[today], key=truck_totals[today].get)
+        metrics.update({"today": round(totals[today], 2), "best_truck_id": best_truck_id,
+                        "best_truck_total": round(truck_totals[today][best_truck_id], 2)})
+    if len(days) > 1 and totals[days[1]]:
+        metrics["percentage_increase"] = (
+            (totals[days[0]] - totals[days[1]]) / totals[days[1]]) * 100
+    return metrics
+
+
+def get_metrics(conn: pymysql.Connection) -> dict:
+    """Gets the headline numbers for the metrics."""
+    return calculate_metrics(query(METRICS_SQL, conn))
+
+
+def total_sales_metric(metrics: dict, col) -> None:
+    """Shows the total sales."""
+    col.metric(label="Total Sales", value=f'£{metrics["total_sales"]}', border =True)
+
+
+def best_performing_truck_metric(metrics: dict, truck_names: dict, col) -> None:
+    """Shows the best performing truck on the day."""
+    if metrics["best_truck_id"] is None:
+        return
+    truck_name = truck_names[str(metrics["best_truck_id"])]
+    col.metric(label = f'Truck {truck_name} is doing best today',
+              value=f'£{metrics["best_truck_total"]}', border =True)
+
+
+def todays_sale_metric(metrics: dict, col) -> None:
+    """"Shows todays total sales."""
+    col.metric(label="Total Sales Today", value=f'£{metrics["today"]}', border =True)
+
+
+def percentage_increase_metric(metrics: dict, col) -> None:
+    """"Shows the sales percentage change from the previous day."""
+    percentage_increase = metrics["percentage_increase"]
+    value = f'{round(percentage_increase)}%' if percentage_increase is not None else "-"
+    col.metric(label="Percentage increase from previous day", value=value, border =True)
+
+
+def fetch_panels(pool: ConnectionPool, fetches: dict[str, tuple]) -> dict:
+    """Runs each fetch at the same time, on its own connection from the pool.
+    fetches maps a name to the fetch function and its arguments after the connection."""
+    def run(fetch, args: tuple):
+        with pool.connection() as conn:
+            return fetch(conn, *args)
+
+    # Lets the cached functions used by the fetches know which session they are running for
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=min(len(fetches), pool.max_size),
+                            initializer=lambda: add_script_run_ctx(current_thread(), ctx)
+                            ) as executor:
+        futures = {name: executor.submit(run, fetch, args)
+                   for name, (fetch, args) in fetches.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+@st.cache_resource
+def get_snapshot() -> TransactionSnapshot:
+    """Gets the in-memory copy of the transactions for this process."""
+    return TransactionSnapshot()
+
+
+def fetch_snapshot_panels(pool: ConnectionPool, snapshot: TransactionSnapshot,
+                          total_sales_range: tuple[date, date],
+                          sales_per_truck_timeframe: int) -> dict:
+    """Refreshes the snapshot with any new transactions, then calculates the data
+    for every panel from it instead of querying the database."""
+    with pool.connection() as conn:
+        snapshot.refresh(conn)
+        dimensions = get_dimensions(conn)
+    return {
+        "total_sales": snapshot.sales_series(*total_sales_range),
+        "sales_per_truck": snapshot.sales_per_truck(sales_per_truck_timeframe),
+        "payment_proportions": snapshot.payment_proportions(),
+        "popular_times": snapshot.popular_times(),
+        "metrics": calculate_metrics(snapshot.metrics_rows()),
+        "dimensions": dimensions
+    }
 
 
-def homepage(conn: pymysql.Connection):
+def homepage(pool: ConnectionPool):
     """Creates the dashboard homepage, see: food_truck_wireframe.png
     columns are in the form: position_row_subcolumn,
     subcolumn a is left b is right. 
     Eg. right_col_3_a is the right hand side column on the third row,
     on the left hand side of the subcolumn
+    The layout and options are created first, then the data for every panel
+    is fetched at the same time before the panels are drawn.
     """
     # Initalise dashboard
     initialise_dashboard()
 
     # Row 1: Total sales vs time graph
     middle_col_1 = st.columns(1)[0]
-    total_sales_graph(conn, middle_col_1)
+    total_sales_range = select_total_sales_range(middle_col_1)
 
     # Row 2: Total sales for each truck and payment proportions
     left_col_2, right_col_2 = st.columns(2, border=True)
-
-    # Left column
-    sales_per_truck_graph(conn, left_col_2)
-
-    # Right column
+    sales_per_truck_timeframe = select_sales_per_truck_timeframe(left_col_2)
     padding(3, right_col_2)
-    payment_proportions_graph(conn, right_col_2)
 
     # Row 3: Popular times graph and metrics
     left_col_3, right_col_3 = st.columns(2, border=True)
-
-    # Left column
-    popular_times_graph(conn, left_col_3)
-
-    # Right column
     padding(3, right_col_3)
     right_col_3_a, right_col_3_b = right_col_3.columns(2)
-    total_sales_metric(conn, right_col_3_a)
-    best_performing_truck_metric(conn, right_col_3_a)
-    todays_sale_metric(conn, right_col_3_b)
-    percentage_increase_metric(conn, right_col_3_b)
+
+    # Fetch the data for every panel
+    if ENV.get("DATA_MODE") == "snapshot":
+        data = fetch_snapshot_panels(pool, get_snapshot(),
+                                     total_sales_range, sales_per_truck_timeframe)
+    else:
+        data = fetch_panels(pool, {
+            "total_sales": (get_sales_series, total_sales_range),
+            "sales_per_truck": (get_sales_per_truck, (sales_per_truck_timeframe,)),
+            "payment_proportions": (get_payment_proportions, ()),
+            "popular_times": (get_popular_times, ()),
+            "metrics": (get_metrics, ()),
+            "dimensions": (get_dimensions, ())
+        })
+    truck_names = data["dimensions"]["truck_names"]
+
+    # Draw the panels
+    total_sales_graph(data["total_sales"], middle_col_1)
+    sales_per_truck_graph(data["sales_per_truck"], truck_names, left_col_2)
+    payment_proportions_graph(data["payment_proportions"],
+                              data["dimensions"]["payment_methods"], right_col_2)
+    popular_times_graph(data["popular_times"], left_col_3)
+
+    metrics = data["metrics"]
+    total_sales_metric(metrics, right_col_3_a)
+    best_performing_truck_metric(metrics, truck_names, right_col_3_a)
+    todays_sale_metric(metrics, right_col_3_b)
+    percentage_increase_metric(metrics, right_col_3_b)
 
 
 if __name__ == '__main__':
     load_dotenv()
-    connection = initialise_connection()
-    homepage(connection)
-    connection.close()
+    homepage(get_connection_pool())
@@ -0,0 +1,149 @@
+"""An in-memory copy of the Transaction table for the dashboard.
+Only new transactions are fetched on each refresh, and the panels are
+calculated from the copy instead of querying the database."""
+# Native imports
+from datetime import date, datetime, timedelta
+from threading import Lock
+from time import monotonic
+
+# Third-party imports
+import numpy as np
+import pandas as pd
+import pymysql
+
+# Local imports
+from db import read_frame
+from timeseries import choose_resolution, bucket_start, MAX_POINTS
+
+
+SNAPSHOT_BATCH_SIZE = 100_000
+REFRESH_SECONDS = 5
+SNAPSHOT_DTYPES = {
+    "transaction_id": "int64",
+    "truck_id": "int16",
+    "payment_method_id": "int8",
+    # FLOAT in the table, so float32 is enough to hold it, but it is summed as float64
+    "total": "float32",
+    "at": "datetime64[s]"
+}
+SNAPSHOT_COLUMNS = list(SNAPSHOT_DTYPES)
+
+def fetch_transactions(conn: pymysql.Connection, after_id: int,
+                       batch_size: int = SNAPSHOT_BATCH_SIZE) -> pd.DataFrame:
+    """Fetches the transactions with an id above after_id."""
+    return read_frame(conn, f"""SELECT {", ".join(SNAPSHOT_COLUMNS)} FROM Transaction
+        WHERE transaction_id > %s ORDER BY transaction_id;""", (after_id,),
+                      SNAPSHOT_DTYPES, batch_size)
+
+
+def get_versions(conn: pymysql.Connection) -> tuple[int | None, int | None]:
+    """Gets the number of times the pipeline has deleted transactions, and its load version."""
+    cur = conn.cursor()
+    cur.execute("SELECT deletes, load_version FROM transaction_deletes WHERE delete_id = 1;")
+    row = cur.fetchone()
+    cur.close()
+    return (row["deletes"], row["load_version"]) if row else (None, None)
+
+
+def get_first_loaded_id(conn: pymysql.Connection, load_version: int) -> int | None:
+    """Gets the first transaction_id inserted by the loads after load_version."""
+    cur = conn.cursor()
+    cur.execute("""SELECT MIN(first_transaction_id) AS first_id FROM transaction_load
+        WHERE load_version > %s;""", (load_version,))
+    row = cur.fetchone()
+    cur.close()
+    return row["first_id"] if row else None
+
+
+def add_time_columns(transactions: pd.DataFrame) -> pd.DataFrame:
+    """Adds the day and hour of each transaction, used by most of the panels."""
+    transactions["day"] = transactions["at"].dt.normalize()
+    transactions["hour"] = transactions["at"].dt.hour.astype("int8")
+    return transactions
+
+
+class TransactionSnapshot:
+    """A compact copy of the Transaction table, shared by every session."""
+
+    def __init__(self):
+        self.transactions = add_time_columns(
+            pd.DataFrame({column: pd.Series(dtype=dtype)
+                          for column, dtype in SNAPSHOT_DTYPES.items()}))
+        self.deletes = None
+        self.load_version = None
+        self.refreshed_at = None
+        self.lock = Lock()
+
+    def refresh(self, conn: pymysql.Connection) -> None:
+        """Adds any new transactions to the snapshot, at most every REFRESH_SECONDS.
+        Nothing is fetched unless the pipeline's load version has moved on, then the
+        transactions are fetched again from the first id of the loads since, as
+        loads running at the same time can commit their ids out of order.
+        Transactions are deleted when a file is loaded again, which the pipeline
+        counts, so when the count has changed the snapshot is fetched from the start."""
+        with self.lock:
+            now = monotonic()
+            if self.refreshed_at is not None and now - self.refreshed_at < REFRESH_SECONDS:
+                return
+            deletes, load_version = get_versions(conn)
+            if deletes != self.deletes or load_version is None or self.load_version is None:
+                self.transactions = add_time_columns(fetch_transactions(conn, 0))
+            elif load_version != self.load_version:
+                first_id = get_first_loaded_id(conn, self.load_version)
+                if first_id is not None:
+                    transactions = self.transactions
+                    self.transactions = pd.concat(
+                        [transactions[transactions["transaction_id"] < first_id],
+                         add_time_columns(fetch_transactions(conn, first_id - 1))],
+                        ignore_index=True)
+            self.deletes, self.load_version = deletes, load_version
+            self.refreshed_at = now
+
+    def sales_series(self, start: date, end: date, max_points: int = MAX_POINTS) -> dict:
+        """Gets the total sales from start up to end, in at most max_points buckets."""
+        resolution = choose_resolution(start, end, max_points)
+        transactions = self.transactions
+        in_range = transactions[(transactions["day"] >= pd.Timestamp(start))
+                                & (transactions["day"] < pd.Timestamp(end))]
+        daily = in_range["total"].astype("float64").groupby(in_range["day"]).sum()
+        buckets = bucket_start(daily.index.to_series(), resolution)
+        totals = daily.groupby(buckets.values).sum()
+        return {"resolution": resolution,
+                "points": [{"time": time.date(), "total": float(total)}
+                           for time, total in totals.items()]}
+
+    def sales_per_truck(self, timeframe: int) -> list[dict]:
+        """Gets the sales per truck over the last timeframe days."""
+        transactions = self.transactions
+        start = datetime.now() - timedelta(days=timeframe)
+        recent = transactions[transactions["at"].dt.floor("h") >= start]
+        totals = recent["total"].astype("float64").groupby(recent["truck_id"]).sum()
+        return [{"total": float(total), "truck_id": int(truck_id)}
+                for truck_id, total in totals.items()]
+
+    def payment_proportions(self) -> list[dict]:
+        """Gets the number of transactions with each payment method."""
+        counts = self.transactions["payment_method_id"].value_counts(sort=False).sort_index()
+        return [{"count": int(count), "payment_method_id": int(payment_method_id)}
+                for payment_method_id, count in counts.items()]
+
+    def popular_times(self) -> list[dict]:
+        """Gets the number of transactions in each hour of the day."""
+        counts = np.bincount(self.transactions["hour"], minlength=24)
+        return [{"hour": hour, "count": int(count)}
+                for hour, count in enumerate(counts) if count]
+
+    def metrics_rows(self) -> list[dict]:
+        """Gets the same rows as the metrics query: each truck's total on the
+        latest two days, and the total of every day."""
+        transactions = self.transactions
+        days = np.sort(transactions["day"].unique())[-2:]
+        latest = transactions[transactions["day"].isin(days)]
+        totals = latest["total"].astype("float64").groupby(
+            [latest["day"], latest["truck_id"]]).sum()
+        rows = [{"day": day.date(), "truck_id": int(truck_id), "total": float(total)}
+                for (day, truck_id), total in totals.items()]
+        grand_total = (float(transactions["total"].astype("float64").sum())
+                       if len(transactions) else None)
+        rows.append({"day": None, "truck_id": None, "total": grand_total})
+        return rows
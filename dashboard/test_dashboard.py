@@ -1,9 +1,16 @@
 """Testing dashboard.py functions"""
+# Native imports
+from datetime import date
+from threading import Barrier
+
 # Third-party imports
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
+import pymysql
+import pytest
 
 # Local imports
-from dashboard import get_payment_method_map, get_truck_name_map
+from dashboard import (get_payment_method_map, get_truck_name_map, QueryCache, ConnectionPool,
+                       calculate_metrics, fetch_panels)
 
 # Test the function using patching
 @patch('dashboard.query')
@@ -28,3 +35,99 @@ def test_get_truck_name_map(mock_query):
     ]
     expected = {"1": "a truck", "2": "another truck"}
     assert get_truck_name_map(None) == expected
+
+
+@patch('dashboard.run_query')
+def test_query_cache_cleared_when_version_changes(mock_run_query):
+    cache = QueryCache()
+    mock_run_query.return_value = [{"version": 1}]
+    cache.check_version(None)
+    cache.set(("select 1;", None), [{"1": 1}])
+    assert cache.get(("select 1;", None)) == [{"1": 1}]
+
+    # The version is only checked again after VERSION_CHECK_SECONDS
+    mock_run_query.return_value = [{"version": 2}]
+    cache.check_version(None)
+    assert cache.get(("select 1;", None)) == [{"1": 1}]
+
+    cache.checked_at = None
+    cache.check_version(None)
+    assert cache.get(("select 1;", None)) is None
+
+
+def test_query_cache_evicts_least_recently_used():
+    cache = QueryCache(max_size=2)
+    cache.set(("a", None), [1])
+    cache.set(("b", None), [2])
+    cache.get(("a", None))
+    cache.set(("c", None), [3])
+    assert cache.get(("b", None)) is None
+    assert cache.get(("a", None)) == [1]
+    assert cache.get(("c", None)) == [3]
+
+
+@patch('dashboard.initialise_connection')
+def test_connection_pool_reuses_connections(mock_initialise_connection):
+    pool = ConnectionPool(min_size=1, max_size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert mock_initialise_connection.call_count == 1
+    first.ping.assert_called_with(reconnect=True)
+
+
+@patch('dashboard.initialise_connection')
+def test_connection_pool_replaces_broken_connections(mock_initialise_connection):
+    broken, healthy = MagicMock(), MagicMock()
+    broken.ping.side_effect = pymysql.OperationalError
+    mock_initialise_connection.side_effect = [broken, healthy]
+    pool = ConnectionPool(min_size=1, max_size=1)
+    assert pool.acquire() is healthy
+    broken.close.assert_called_once()
+    assert pool.size == 1
+
+
+@patch('dashboard.initialise_connection')
+def test_connection_pool_waits_when_full(mock_initialise_connection):
+    pool = ConnectionPool(min_size=0, max_size=1, timeout=0.01)
+    pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+
+
+def test_calculate_metrics():
+    rows = [
+        {"day": date(2025, 1, 1), "truck_id": 1, "total": 50.0},
+        {"day": date(2025, 1, 1), "truck_id": 2, "total": 50.0},
+        {"day": date(2025, 1, 2), "truck_id": 1, "total": 40.0},
+        {"day": date(2025, 1, 2), "truck_id": 2, "total": 110.123},
+        {"day": None, "truck_id": None, "total": 1000.0}
+    ]
+    assert calculate_metrics(rows) == {
+        "total_sales": 1000.0, "today": 150.12, "best_truck_id": 2,
+        "best_truck_total": 110.12, "percentage_increase": 50.123}
+
+
+def test_calculate_metrics_without_data():
+    metrics = calculate_metrics([{"day": None, "truck_id": None, "total": None}])
+    assert metrics["total_sales"] == 0
+    assert metrics["best_truck_id"] is None
+    assert metrics["percentage_increase"] is None
+
+
+@patch('dashboard.initialise_connection')
+def test_fetch_panels_uses_a_connection_each(mock_initialise_connection):
+    mock_initialise_connection.side_effect = lambda: MagicMock()
+    pool = ConnectionPool(min_size=0, max_size=3)
+    barrier = Barrier(3, timeout=5)
+
+    def fetch(conn, value):
+        # Every fetch has to be running at once to get past the barrier
+        barrier.wait()
+        return conn, value
+
+    data = fetch_panels(pool, {"a": (fetch, (1,)), "b": (fetch, (2,)), "c": (fetch, (3,))})
+
+    assert [data[name][1] for name in "abc"] == [1, 2, 3]
+    assert len({id(data[name][0]) for name in "abc"}) == 3
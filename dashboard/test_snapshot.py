@@ -0,0 +1,112 @@
+"""Testing snapshot.py functions"""
+# Native imports
+from datetime import datetime, date
+from unittest.mock import MagicMock
+
+# Local imports
+from snapshot import TransactionSnapshot, SNAPSHOT_COLUMNS
+
+
+ROWS = [
+    (1, 1, 1, 10.0, datetime(2025, 1, 1, 9, 15)),
+    (2, 2, 2, 20.0, datetime(2025, 1, 1, 12, 30)),
+    (3, 1, 2, 5.5, datetime(2025, 1, 2, 9, 45)),
+    (4, 2, 1, 4.5, datetime(2025, 1, 2, 13, 0))
+]
+
+
+def make_connection(rows: list[tuple], deletes: int = 0, load_version: int = 0,
+                    first_id: int | None = None) -> MagicMock:
+    """Creates a mock connection that streams the rows after the given id,
+    where the pipeline has deleted transactions deletes times, and has loaded
+    load_version times, the loads since the snapshot starting at first_id."""
+    conn = MagicMock()
+    conn.fetched_from = []
+
+    def cursor(cursor_class=None):
+        cur = MagicMock()
+        if cursor_class is None:
+            def execute_counter(sql, args=None):
+                cur.fetchone.return_value = (
+                    {"first_id": first_id} if "transaction_load" in sql
+                    else {"deletes": deletes, "load_version": load_version})
+            cur.execute.side_effect = execute_counter
+            return cur
+
+        def execute(sql, args):
+            conn.fetched_from.append(args[0])
+            cur.fetchmany.side_effect = [[row for row in rows if row[0] > args[0]], []]
+        cur.execute.side_effect = execute
+        cur.description = [(column,) for column in SNAPSHOT_COLUMNS]
+        return cur
+    conn.cursor.side_effect = cursor
+    return conn
+
+
+def test_refresh_only_fetches_after_a_load():
+    snapshot = TransactionSnapshot()
+    snapshot.refresh(make_connection(ROWS[:2]))
+
+    snapshot.refreshed_at = None
+    conn = make_connection(ROWS)
+    snapshot.refresh(conn)
+    assert conn.fetched_from == []
+
+    snapshot.refreshed_at = None
+    conn = make_connection(ROWS, load_version=1, first_id=3)
+    snapshot.refresh(conn)
+    assert conn.fetched_from == [2]
+    assert list(snapshot.transactions["transaction_id"]) == [1, 2, 3, 4]
+    assert str(snapshot.transactions["truck_id"].dtype) == "int16"
+
+
+def test_refresh_fetches_ids_committed_out_of_order():
+    # A load holding ids 2 and 3 commits after another load's id 4 was fetched
+    snapshot = TransactionSnapshot()
+    snapshot.refresh(make_connection([ROWS[0], ROWS[3]]))
+    snapshot.refreshed_at = None
+
+    conn = make_connection(ROWS, load_version=1, first_id=2)
+    snapshot.refresh(conn)
+
+    assert conn.fetched_from == [1]
+    assert list(snapshot.transactions["transaction_id"]) == [1, 2, 3, 4]
+
+
+def test_refresh_fetches_everything_after_deletes():
+    snapshot = TransactionSnapshot()
+    snapshot.refresh(make_connection(ROWS))
+    snapshot.refreshed_at = None
+    conn = make_connection(ROWS[1:] + [(5, 1, 1, 1.0, datetime(2025, 1, 3, 9, 0))], 1, 1, 5)
+    snapshot.refresh(conn)
+    assert conn.fetched_from == [0]
+    assert list(snapshot.transactions["transaction_id"]) == [2, 3, 4, 5]
+
+
+def test_totals_are_summed_as_float64():
+    # float32 can't hold 16,777,227, so summing as float32 loses a pound
+    rows = [(1, 1, 1, 16_777_216.0, datetime(2025, 1, 1, 9, 0))] + [
+        (i, 1, 1, 1.0, datetime(2025, 1, 1, 9, 0)) for i in range(2, 13)]
+    snapshot = TransactionSnapshot()
+    snapshot.refresh(make_connection(rows))
+    assert snapshot.metrics_rows()[-1]["total"] == 16_777_227.0
+    assert snapshot.metrics_rows()[0]["total"] == 16_777_227.0
+    assert snapshot.sales_series(date(2025, 1, 1), date(2025, 1, 2))["points"][0][
+        "total"] == 16_777_227.0
+
+
+def test_panels_match_the_rollup_queries():
+    snapshot = TransactionSnapshot()
+    snapshot.refresh(make_connection(ROWS))
+
+    assert snapshot.sales_series(date(2025, 1, 1), date(2025, 1, 3)) == {
+        "resolution": "day", "points": [{"time": date(2025, 1, 1), "total": 30.0},
+                                        {"time": date(2025, 1, 2), "total": 10.0}]}
+    assert snapshot.sales_series(date(2024, 1, 1), date(2026, 1, 1), max_points=3) == {
+        "resolution": "year", "points": [{"time": date(2025, 1, 1), "total": 40.0}]}
+    assert snapshot.payment_proportions() == [{"count": 2, "payment_method_id": 1},
+                                              {"count": 2, "payment_method_id": 2}]
+    assert snapshot.popular_times() == [{"hour": 9, "count": 2}, {"hour": 12, "count": 1},
+                                        {"hour": 13, "count": 1}]
+    assert snapshot.metrics_rows()[-1] == {"day": None, "truck_id": None, "total": 40.0}
+    assert len(snapshot.metrics_rows()) == 5
@@ -0,0 +1,27 @@
+"""Testing timeseries.py functions"""
+# Native imports
+from datetime import date
+
+# Third-party imports
+import pandas as pd
+
+# Local imports
+from timeseries import choose_resolution, bucket_start
+
+
+def test_choose_resolution_keeps_within_max_points():
+    assert choose_resolution(date(2025, 1, 1), date(2025, 2, 1), max_points=100) == "day"
+    assert choose_resolution(date(2025, 1, 1), date(2026, 1, 1), max_points=100) == "week"
+    assert choose_resolution(date(2020, 1, 1), date(2025, 1, 1), max_points=100) == "month"
+    assert choose_resolution(date(2000, 1, 1), date(2025, 1, 1), max_points=100) == "year"
+
+
+def test_bucket_start_keeps_years_apart():
+    days = pd.Series(pd.to_datetime(["2024-01-10", "2025-01-10", "2025-01-12", "2025-12-31"]))
+    assert list(bucket_start(days, "month")) == list(pd.to_datetime(
+        ["2024-01-01", "2025-01-01", "2025-01-01", "2025-12-01"]))
+    # 2025-01-12 is a Sunday, so it is in the week starting Monday 2025-01-06
+    assert list(bucket_start(days, "week")) == list(pd.to_datetime(
+        ["2024-01-08", "2025-01-06", "2025-01-06", "2025-12-29"]))
+    assert list(bucket_start(days, "year")) == list(pd.to_datetime(
+        ["2024-01-01", "2025-01-01", "2025-01-01", "2025-01-01"]))
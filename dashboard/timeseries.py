@@ -0,0 +1,47 @@
+"""Bucketing for the dashboard's time series.
+A series covers an explicit date range and has at most max_points points,
+using the finest resolution that fits."""
+# Native imports
+from datetime import date
+
+# Third-party imports
+import pandas as pd
+
+
+MAX_POINTS = 200
+# Resolutions from finest to coarsest, with the average number of days in each bucket
+RESOLUTION_DAYS = {
+    "day": 1,
+    "week": 7,
+    "month": 365.25 / 12,
+    "year": 365.25
+}
+# SQL for the first day of the bucket each day is in, so buckets in different years never merge
+BUCKET_SQL = {
+    "day": "day",
+    "week": "day - INTERVAL WEEKDAY(day) DAY",
+    "month": "MAKEDATE(YEAR(day), 1) + INTERVAL MONTH(day) - 1 MONTH",
+    "year": "MAKEDATE(YEAR(day), 1)"
+}
+
+
+def choose_resolution(start: date, end: date, max_points: int = MAX_POINTS) -> str:
+    """Gets the finest resolution with at most max_points buckets from start up to end.
+    Ranges too long for even a yearly series are given by year."""
+    days = (end - start).days
+    for resolution, bucket_days in RESOLUTION_DAYS.items():
+        # A range that isn't aligned to the buckets can touch one more bucket
+        if days / bucket_days + 1 <= max_points:
+            return resolution
+    return "year"
+
+
+def bucket_start(days: pd.Series, resolution: str) -> pd.Series:
+    """Gets the first day of the bucket each day is in, matching BUCKET_SQL."""
+    if resolution == "day":
+        return days
+    if resolution == "week":
+        return days - pd.to_timedelta(days.dt.weekday, unit="D")
+    if resolution == "month":
+        return days.dt.to_period("M").dt.start_time
+    return days.dt.to_period("Y").dt.start_time
@@ -1,3 +1,3 @@
 source .env
 
-mysql -u $DB_USER -p$DB_PASSWORD -h $DB_HOST $DB_NAME -P $DB_PORT -D $DB_NAME -e "DELETE FROM Transaction;"
\ No newline at end of file
+mysql -u $DB_USER -p$DB_PASSWORD -h $DB_HOST $DB_NAME -P $DB_PORT -D $DB_NAME -e "DELETE FROM Transaction; DELETE FROM Transaction_Hourly; DELETE FROM Transaction_Daily; UPDATE transaction_deletes SET deletes = deletes + 1, load_version = load_version + 1 WHERE delete_id = 1;"
\ No newline at end of file
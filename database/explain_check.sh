@@ -0,0 +1,23 @@
+source .env
+
+# Runs EXPLAIN on each query in hot_queries.sql and fails if any of them
+# does a full table scan (an access type of ALL).
+# Run it against a database with production-sized data, on a tiny table
+# MySQL may choose a full scan even when an index could be used.
+# The lookup tables only have a row per truck or payment method, so are read whole.
+LOOKUP_TABLES="^(Payment_Method|Truck)$"
+status=0
+grep -v '^--' hot_queries.sql | while IFS= read -r query; do
+    [ -z "$query" ] && continue
+    full_scans=$(mysql -u $DB_USER -p$DB_PASSWORD -h $DB_HOST -P $DB_PORT -D $DB_NAME -N \
+        -e "EXPLAIN $query" | awk -F'\t' -v lookup="$LOOKUP_TABLES" '$5 == "ALL" && $3 !~ lookup { print $3 }')
+    if [ -n "$full_scans" ]; then
+        echo "FULL SCAN of $full_scans: $query"
+        exit 1
+    fi
+done || status=1
+
+if [ $status -eq 0 ]; then
+    echo "No hot query does a full table scan."
+fi
+exit $status
@@ -0,0 +1,40 @@
+-- The queries run by the dashboard, the report and the pipeline, one per line,
+-- with example values for their parameters. Keep them the same as the code.
+-- explain_check.sh fails if any of them would scan a whole table.
+-- dashboard: snapshot.py
+SELECT transaction_id, truck_id, payment_method_id, total, at FROM Transaction WHERE transaction_id > 1000000 ORDER BY transaction_id;
+SELECT deletes, load_version FROM transaction_deletes WHERE delete_id = 1;
+SELECT MIN(first_transaction_id) AS first_id FROM transaction_load WHERE load_version > 1000;
+-- dashboard: dashboard.py
+select load_version as version from transaction_deletes where delete_id = 1;
+select * from Payment_Method;
+select truck_id, truck_name from Truck;
+select day as time, sum(total) as total from Transaction_Daily where day >= '2025-01-01' and day < '2025-02-01' group by time order by time;
+select day - INTERVAL WEEKDAY(day) DAY as time, sum(total) as total from Transaction_Daily where day >= '2025-01-01' and day < '2025-07-01' group by time order by time;
+select MAKEDATE(YEAR(day), 1) + INTERVAL MONTH(day) - 1 MONTH as time, sum(total) as total from Transaction_Daily where day >= '2024-01-01' and day < '2026-01-01' group by time order by time;
+select MAKEDATE(YEAR(day), 1) as time, sum(total) as total from Transaction_Daily where day >= '2015-01-01' and day < '2026-01-01' group by time order by time;
+SELECT SUM(total) AS total, truck_id FROM Transaction_Hourly WHERE hour_start >= DATE_SUB(NOW(), INTERVAL 7 DAY) GROUP BY truck_id;
+select sum(transaction_count) as count, payment_method_id from Transaction_Daily group by payment_method_id;
+select hour(hour_start) as hour, sum(transaction_count) as count from Transaction_Hourly group by HOUR(hour_start);
+select day, truck_id, sum(total) as total from Transaction_Daily where day >= coalesce((select max(day) from Transaction_Daily where day < (select max(day) from Transaction_Daily)), (select max(day) from Transaction_Daily)) group by day, truck_id union all select null, null, sum(total) from Transaction_Daily;
+-- report: report.py
+SELECT day, truck_id, SUM(total) AS total, SUM(transaction_count) AS transactions FROM Transaction_Daily WHERE day >= '2025-01-01' AND day < '2025-01-02' GROUP BY day, truck_id ORDER BY day, truck_id;
+-- pipeline: extract.py, transform.py and lease.py
+SELECT filename, etag, size FROM uploaded_files WHERE filename IN ('trucks/2025-1/1/12/a_T1_1.csv', 'trucks/2025-1/1/12/a_T2_1.csv');
+SELECT last_key, last_modified FROM extract_watermark WHERE watermark_id = 1;
+SELECT payment_method, payment_method_id FROM Payment_Method;
+SELECT filename FROM file_lease WHERE worker_id = 'host-1-abcdef12';
+UPDATE file_lease SET expires_at = NOW() + INTERVAL 600 SECOND WHERE worker_id = 'host-1-abcdef12';
+DELETE FROM file_lease WHERE worker_id = 'host-1-abcdef12';
+-- pipeline: load.py and rollup.py, when files are loaded again
+SELECT filename, filename_id FROM uploaded_files WHERE filename IN ('trucks/2025-1/1/12/a_T1_1.csv', 'trucks/2025-1/1/12/a_T2_1.csv');
+SELECT MIN(at) AS first_at, MAX(at) AS last_at FROM Transaction WHERE filename_id IN (1, 2, 3);
+INSERT INTO Transaction_Hourly (hour_start, truck_id, payment_method_id, total, transaction_count) SELECT TIMESTAMP(DATE(at), MAKETIME(HOUR(at), 0, 0)) AS bucket, truck_id, payment_method_id, -SUM(total), -COUNT(*) FROM Transaction WHERE filename_id IN (1, 2, 3) GROUP BY bucket, truck_id, payment_method_id ON DUPLICATE KEY UPDATE total = total + VALUES(total), transaction_count = transaction_count + VALUES(transaction_count);
+INSERT INTO Transaction_Daily (day, truck_id, payment_method_id, total, transaction_count) SELECT DATE(at) AS bucket, truck_id, payment_method_id, -SUM(total), -COUNT(*) FROM Transaction WHERE filename_id IN (1, 2, 3) GROUP BY bucket, truck_id, payment_method_id ON DUPLICATE KEY UPDATE total = total + VALUES(total), transaction_count = transaction_count + VALUES(transaction_count);
+DELETE FROM Transaction_Hourly WHERE hour_start >= '2025-01-01' AND hour_start <= '2025-01-02 09:15:00' AND transaction_count = 0;
+DELETE FROM Transaction_Daily WHERE day >= '2025-01-01' AND day <= '2025-01-02 09:15:00' AND transaction_count = 0;
+DELETE FROM Transaction WHERE filename_id IN (1, 2, 3);
+UPDATE transaction_deletes SET deletes = deletes + 1 WHERE delete_id = 1;
+UPDATE transaction_deletes SET load_version = load_version + 1 WHERE delete_id = 1;
+SELECT MIN(transaction_id) AS first_id FROM Transaction WHERE filename_id IN (1, 2, 3);
+INSERT INTO transaction_load (load_version, first_transaction_id) SELECT load_version, 1000000 FROM transaction_deletes WHERE delete_id = 1;
@@ -0,0 +1,21 @@
+source .env
+
+# Applies each migration in migrations/ that has not been applied yet, in order.
+# Applied migrations are recorded in the schema_migrations table.
+mysql -u $DB_USER -p$DB_PASSWORD -h $DB_HOST -P $DB_PORT -D $DB_NAME -e "
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR(255) PRIMARY KEY,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );"
+
+for migration in $(ls migrations/*.sql | sort); do
+    version=$(basename $migration .sql)
+    applied=$(mysql -u $DB_USER -p$DB_PASSWORD -h $DB_HOST -P $DB_PORT -D $DB_NAME -N -e "
+        SELECT COUNT(*) FROM schema_migrations WHERE version = '$version';")
+    if [ "$applied" = "0" ]; then
+        echo "Applying $version"
+        mysql -u $DB_USER -p$DB_PASSWORD -h $DB_HOST -P $DB_PORT -D $DB_NAME < $migration || exit 1
+        mysql -u $DB_USER -p$DB_PASSWORD -h $DB_HOST -P $DB_PORT -D $DB_NAME -e "
+            INSERT INTO schema_migrations (version) VALUES ('$version');"
+    fi
+done
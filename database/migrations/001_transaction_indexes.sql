@@ -0,0 +1,8 @@
+-- Covering indexes for time range queries on Transaction.
+-- at first for the report and any range over every truck,
+-- truck_id first for a single truck's transactions over a range.
+CREATE INDEX transaction_at
+    ON Transaction (at, truck_id, payment_method_id, total);
+
+CREATE INDEX transaction_truck_id_at
+    ON Transaction (truck_id, at, total);
@@ -0,0 +1,10 @@
+-- Leases on the files a pipeline worker has claimed, so workers running at
+-- the same time never load the same file. A lease past expires_at belongs
+-- to a worker that stopped, and can be claimed by another.
+CREATE TABLE file_lease (
+    filename VARCHAR(255) PRIMARY KEY,
+    worker_id VARCHAR(64) NOT NULL,
+    expires_at DATETIME NOT NULL,
+
+    INDEX file_lease_worker_id (worker_id)
+);
@@ -0,0 +1,7 @@
+-- The last key and modified time listed by the last successful pipeline run,
+-- so the next run only lists the objects after it.
+CREATE TABLE IF NOT EXISTS extract_watermark (
+    watermark_id TINYINT PRIMARY KEY,
+    last_key VARCHAR(255) NOT NULL,
+    last_modified DATETIME NOT NULL
+);
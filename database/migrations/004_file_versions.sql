@@ -0,0 +1,52 @@
+-- Tracks each uploaded file by key, etag and size, and the file each transaction
+-- came from, so a file uploaded again replaces the transactions loaded from it.
+-- Every transaction already loaded is kept. The files loaded before this have no
+-- etag, so they are marked as legacy, which the pipeline doesn't load again.
+ALTER TABLE uploaded_files
+    MODIFY filename_id BIGINT NOT NULL AUTO_INCREMENT,
+    MODIFY filename VARCHAR(255) NOT NULL,
+    ADD COLUMN etag VARCHAR(64),
+    ADD COLUMN size BIGINT,
+    ADD COLUMN loaded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+-- A file could be recorded more than once, keep the first so filename can be unique
+DELETE newer FROM uploaded_files AS newer
+JOIN uploaded_files AS older
+    ON older.filename = newer.filename AND older.filename_id < newer.filename_id;
+
+UPDATE uploaded_files SET etag = 'legacy';
+
+ALTER TABLE uploaded_files
+    ADD UNIQUE INDEX uploaded_files_filename (filename);
+
+ALTER TABLE Transaction
+    ADD COLUMN filename_id BIGINT NULL,
+    ADD INDEX transaction_filename_id (filename_id);
+
+-- Transactions didn't record their file, but each file in the
+-- trucks/<day>/<hour>/..._T<truck id>_... layout has one truck's transactions
+-- for that hour, so those are traced back to it. Hours with more than one file
+-- for a truck can't be told apart, and are left without a filename_id.
+-- Transactions without a filename_id are never replaced when a file is loaded again.
+CREATE TEMPORARY TABLE legacy_file_hour AS
+SELECT MIN(filename_id) AS filename_id, hour_start, truck_id
+FROM (
+    SELECT filename_id,
+        STR_TO_DATE(SUBSTRING_INDEX(SUBSTRING_INDEX(filename, '/', 3), '/', -2),
+                    '%Y-%m-%d/%H') AS hour_start,
+        CAST(SUBSTRING_INDEX(SUBSTRING_INDEX(filename, '_T', -1), '_', 1) AS UNSIGNED)
+            AS truck_id
+    FROM uploaded_files
+    WHERE filename REGEXP '^trucks/[0-9]{4}-[0-9]{2}-[0-9]{2}/[0-9]{2}/.*_T[0-9]+_[^/]*$'
+) AS legacy_file
+GROUP BY hour_start, truck_id
+HAVING COUNT(*) = 1;
+
+UPDATE Transaction
+JOIN legacy_file_hour
+    ON legacy_file_hour.truck_id = Transaction.truck_id
+    AND Transaction.at >= legacy_file_hour.hour_start
+    AND Transaction.at < legacy_file_hour.hour_start + INTERVAL 1 HOUR
+SET Transaction.filename_id = legacy_file_hour.filename_id;
+
+DROP TEMPORARY TABLE legacy_file_hour;
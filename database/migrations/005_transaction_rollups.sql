@@ -0,0 +1,38 @@
+-- Totals per truck and payment method by hour and by day, kept up to date by
+-- the pipeline. They are built from every transaction already loaded, the same
+-- as python rollup.py --rebuild (in the pipeline folder).
+CREATE TABLE IF NOT EXISTS Transaction_Hourly (
+    hour_start DATETIME NOT NULL,
+    truck_id SMALLINT NOT NULL,
+    payment_method_id SMALLINT NOT NULL,
+    total DOUBLE NOT NULL,
+    transaction_count INT NOT NULL,
+
+    PRIMARY KEY (hour_start, truck_id, payment_method_id)
+);
+
+CREATE TABLE IF NOT EXISTS Transaction_Daily (
+    day DATE NOT NULL,
+    truck_id SMALLINT NOT NULL,
+    payment_method_id SMALLINT NOT NULL,
+    total DOUBLE NOT NULL,
+    transaction_count INT NOT NULL,
+
+    PRIMARY KEY (day, truck_id, payment_method_id)
+);
+
+DELETE FROM Transaction_Hourly;
+INSERT INTO Transaction_Hourly
+    (hour_start, truck_id, payment_method_id, total, transaction_count)
+SELECT TIMESTAMP(DATE(at), MAKETIME(HOUR(at), 0, 0)) AS bucket, truck_id, payment_method_id,
+    SUM(total), COUNT(*)
+FROM Transaction
+GROUP BY bucket, truck_id, payment_method_id;
+
+DELETE FROM Transaction_Daily;
+INSERT INTO Transaction_Daily
+    (day, truck_id, payment_method_id, total, transaction_count)
+SELECT DATE(at) AS bucket, truck_id, payment_method_id,
+    SUM(total), COUNT(*)
+FROM Transaction
+GROUP BY bucket, truck_id, payment_method_id;
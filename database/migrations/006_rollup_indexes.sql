@@ -0,0 +1,9 @@
+-- Covering indexes for the dashboard queries over every day or hour of the rollups.
+-- payment_method_id first for the transactions per payment method, which also
+-- covers the total of every day. hour_start with transaction_count for the
+-- transactions in each hour of the day, so neither reads the whole table.
+CREATE INDEX transaction_daily_payment_method
+    ON Transaction_Daily (payment_method_id, transaction_count, total);
+
+CREATE INDEX transaction_hourly_count
+    ON Transaction_Hourly (hour_start, transaction_count);
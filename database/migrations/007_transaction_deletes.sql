@@ -0,0 +1,9 @@
+-- Counts the times the pipeline has deleted transactions, when a file is loaded
+-- again, so the dashboard can tell its copy of the table is out of date
+-- without counting every transaction.
+CREATE TABLE transaction_deletes (
+    delete_id TINYINT PRIMARY KEY,
+    deletes BIGINT NOT NULL
+);
+
+INSERT INTO transaction_deletes (delete_id, deletes) VALUES (1, 0);
@@ -0,0 +1,11 @@
+-- A load version the pipeline moves on in every transaction that changes the
+-- data, and the first transaction_id inserted by each load. Loads running at
+-- the same time can commit their ids out of order, so the dashboard can't tell
+-- what changed from the highest transaction_id.
+ALTER TABLE transaction_deletes
+    ADD COLUMN load_version BIGINT NOT NULL DEFAULT 0;
+
+CREATE TABLE transaction_load (
+    load_version BIGINT PRIMARY KEY,
+    first_transaction_id BIGINT NOT NULL
+);
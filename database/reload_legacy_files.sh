@@ -0,0 +1,18 @@
+source .env
+
+# Marks the files loaded before etags were recorded (see migrations/004_file_versions.sql)
+# to be loaded again by the next pipeline.py -r, replacing their transactions.
+# Only files whose transactions were all traced back to them are marked, the
+# others would be loaded a second time alongside their untraced transactions.
+read -p "Download and load again every legacy file with traced transactions? [y/N] " answer
+if [ "$answer" != "y" ]; then
+    echo "Nothing changed."
+    exit 1
+fi
+
+mysql -u $DB_USER -p$DB_PASSWORD -h $DB_HOST -P $DB_PORT -D $DB_NAME -e "
+    UPDATE uploaded_files SET etag = NULL, size = NULL
+    WHERE etag = 'legacy'
+    AND filename_id IN (SELECT filename_id FROM (
+        SELECT DISTINCT filename_id FROM Transaction WHERE filename_id IS NOT NULL) AS traced);"
+echo "Run python pipeline.py -r in the pipeline folder to load them again."
@@ -1,8 +1,15 @@
 -- Delete the tables if they exist
 DROP TABLE IF EXISTS Transaction;
+DROP TABLE IF EXISTS Transaction_Hourly;
+DROP TABLE IF EXISTS Transaction_Daily;
 DROP TABLE IF EXISTS Payment_Method;
 DROP TABLE IF EXISTS Truck;
 DROP TABLE IF EXISTS uploaded_files;
+DROP TABLE IF EXISTS extract_watermark;
+DROP TABLE IF EXISTS file_lease;
+DROP TABLE IF EXISTS transaction_deletes;
+DROP TABLE IF EXISTS transaction_load;
+DROP TABLE IF EXISTS schema_migrations;
 
 
 -- Create the tables
@@ -25,18 +32,103 @@ CREATE TABLE Transaction (
     payment_method_id SMALLINT NOT NULL,
     total FLOAT NOT NULL,
     at TIMESTAMP NOT NULL,
+    filename_id BIGINT,
 
     FOREIGN KEY (truck_id) REFERENCES Truck(truck_id),
-    FOREIGN KEY (payment_method_id) REFERENCES Payment_Method(payment_method_id)
+    FOREIGN KEY (payment_method_id) REFERENCES Payment_Method(payment_method_id),
+    INDEX transaction_filename_id (filename_id),
+    INDEX transaction_at (at, truck_id, payment_method_id, total),
+    INDEX transaction_truck_id_at (truck_id, at, total)
 ) AUTO_INCREMENT = 1;
 
 
+-- Totals per truck and payment method, kept up to date by the pipeline.
+-- Rebuild them with: python rollup.py --rebuild (in the pipeline folder)
+CREATE TABLE Transaction_Hourly (
+    hour_start DATETIME NOT NULL,
+    truck_id SMALLINT NOT NULL,
+    payment_method_id SMALLINT NOT NULL,
+    total DOUBLE NOT NULL,
+    transaction_count INT NOT NULL,
+
+    PRIMARY KEY (hour_start, truck_id, payment_method_id),
+    INDEX transaction_hourly_count (hour_start, transaction_count)
+);
+
+
+CREATE TABLE Transaction_Daily (
+    day DATE NOT NULL,
+    truck_id SMALLINT NOT NULL,
+    payment_method_id SMALLINT NOT NULL,
+    total DOUBLE NOT NULL,
+    transaction_count INT NOT NULL,
+
+    PRIMARY KEY (day, truck_id, payment_method_id),
+    INDEX transaction_daily_payment_method (payment_method_id, transaction_count, total)
+);
+
+
 CREATE TABLE uploaded_files (
-    filename_id SMALLINT PRIMARY KEY NOT NULL AUTO_INCREMENT,
-    filename VARCHAR(100) NOT NULL
+    filename_id BIGINT PRIMARY KEY NOT NULL AUTO_INCREMENT,
+    filename VARCHAR(255) NOT NULL,
+    etag VARCHAR(64),
+    size BIGINT,
+    loaded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    UNIQUE INDEX uploaded_files_filename (filename)
+);
+
+
+CREATE TABLE extract_watermark (
+    watermark_id TINYINT PRIMARY KEY,
+    last_key VARCHAR(255) NOT NULL,
+    last_modified DATETIME NOT NULL
 );
 
 
+CREATE TABLE file_lease (
+    filename VARCHAR(255) PRIMARY KEY,
+    worker_id VARCHAR(64) NOT NULL,
+    expires_at DATETIME NOT NULL,
+
+    INDEX file_lease_worker_id (worker_id)
+);
+
+
+-- Counts the times transactions have been deleted and loaded, for the dashboard
+CREATE TABLE transaction_deletes (
+    delete_id TINYINT PRIMARY KEY,
+    deletes BIGINT NOT NULL,
+    load_version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO transaction_deletes (delete_id, deletes) VALUES (1, 0);
+
+
+-- The first transaction_id inserted by each load, by load version
+CREATE TABLE transaction_load (
+    load_version BIGINT PRIMARY KEY,
+    first_transaction_id BIGINT NOT NULL
+);
+
+
+-- Migrations already included above, so migrate.sh doesn't apply them again
+CREATE TABLE schema_migrations (
+    version VARCHAR(255) PRIMARY KEY,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO schema_migrations (version) VALUES
+('001_transaction_indexes'),
+('002_file_leases'),
+('003_extract_watermark'),
+('004_file_versions'),
+('005_transaction_rollups'),
+('006_rollup_indexes'),
+('007_transaction_deletes'),
+('008_transaction_loads');
+
+
 -- Insert data into the tables
 INSERT INTO Payment_Method (payment_method_id, payment_method) VALUES
 (1, 'cash'),
@@ -0,0 +1,192 @@
+"""Food trucks data pipeline: archive.
+Keeps a copy of the cleaned transactions as compressed parquet, partitioned by
+date and truck, so the database can be rebuilt without reading s3 again.
+Each batch is written to one parquet file in each partition, and a manifest maps
+each source file to the parquet files it is in, so a file that is loaded again
+replaces every archived transaction of it."""
+# Standard library imports
+from datetime import date, timedelta
+from fcntl import flock, LOCK_EX
+from json import dumps, loads
+from os import makedirs, path, remove, replace
+from uuid import uuid4
+
+# Third-party imports
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+import pymysql
+
+# Local imports
+from extract import get_object_version
+from load import load, record_uploaded_files, LOAD_METHOD, LOAD_BATCH_SIZE
+from metrics import timed
+
+
+ARCHIVE_FOLDER = "truck_data/archive"
+ARCHIVE_COMPRESSION = "zstd"
+ARCHIVE_SCHEMA = pa.schema([
+    ("at", pa.timestamp("s")),
+    ("payment_method_id", pa.int8()),
+    ("total", pa.float64()),
+    ("filename", pa.dictionary(pa.int32(), pa.string()))
+])
+PARTITION_SCHEMA = pa.schema([("date", pa.date32()), ("truck_id", pa.int16())])
+# The columns and types transform gives, so archived transactions can be loaded
+TRANSFORM_COLUMNS = ["at", "payment_method_id", "total", "truck_id", "filename"]
+# Files starting with _ aren't read as part of the dataset
+MANIFEST = "_manifest.json"
+MANIFEST_LOCK = "_manifest.lock"
+
+
+def get_part_path(folder: str, day: date, truck_id: int) -> str:
+    """Gets a new parquet file path in a date and truck partition."""
+    return path.join(folder, f"date={day:%Y-%m-%d}", f"truck_id={truck_id}",
+                     f"part-{uuid4().hex}.parquet")
+
+
+def read_manifest(folder: str = ARCHIVE_FOLDER) -> dict[str, dict]:
+    """Reads the etag, size and parquet files of each archived source file."""
+    manifest_path = path.join(folder, MANIFEST)
+    if not path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="UTF-8") as file:
+        return loads(file.read())
+
+
+def write_manifest(folder: str, manifest: dict[str, dict]) -> None:
+    """Writes the manifest, replacing the old one in one step."""
+    manifest_path = path.join(folder, MANIFEST)
+    with open(f"{manifest_path}.tmp", "w", encoding="UTF-8") as file:
+        file.write(dumps(manifest))
+    replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def remove_archived_files(folder: str, manifest: dict[str, dict], files: list[str]) -> None:
+    """Removes every archived transaction of the source files, on whichever days
+    they were, rewriting the parquet files they share with other source files."""
+    parts = {part for file in files for part in manifest.get(file, {}).get("parts", [])}
+    for part in parts:
+        part_path = path.join(folder, part)
+        table = ds.dataset(part_path, format="parquet").to_table(
+            filter=~ds.field("filename").isin(files))
+        if table.num_rows:
+            pq.write_table(table.cast(ARCHIVE_SCHEMA), part_path,
+                           compression=ARCHIVE_COMPRESSION)
+        else:
+            remove(part_path)
+    for file in files:
+        manifest.pop(file, None)
+
+
+@timed("archive")
+def write_archive(trucks_df: pd.DataFrame, s3_objects: dict[str, dict],
+                  folder: str = ARCHIVE_FOLDER, written: set[str] | None = None) -> None:
+    """Writes the cleaned transactions to the archive, one parquet file in each
+    date and truck partition, and records the etag, size and parquet files of each
+    source file in the manifest. Any archived copy of a source file is removed
+    first, unless it is in written (an earlier chunk of this run wrote it), in
+    which case the transactions are added to it."""
+    files = [str(file) for file in trucks_df["filename"].unique()]
+    makedirs(folder, exist_ok=True)
+    # Only one worker changes the archive at a time
+    with open(path.join(folder, MANIFEST_LOCK), "w", encoding="UTF-8") as lock:
+        flock(lock, LOCK_EX)
+        manifest = read_manifest(folder)
+        remove_archived_files(folder, manifest,
+                              [file for file in files if written is None or file not in written])
+
+        groups = trucks_df.groupby([trucks_df["at"].dt.normalize(), "truck_id"], observed=True)
+        for (day, truck_id), df in groups:
+            df = df[ARCHIVE_SCHEMA.names].assign(
+                filename=df["filename"].cat.remove_unused_categories())
+            table = pa.Table.from_pandas(df, preserve_index=False).cast(ARCHIVE_SCHEMA)
+            part_path = get_part_path(folder, day, truck_id)
+            makedirs(path.dirname(part_path), exist_ok=True)
+            pq.write_table(table, part_path, compression=ARCHIVE_COMPRESSION)
+
+            for file in df["filename"].cat.categories:
+                etag, size = get_object_version(s3_objects[file])
+                archived = manifest.setdefault(file, {"parts": []})
+                archived.update(etag=etag, size=size)
+                archived["parts"].append(path.relpath(part_path, folder))
+        write_manifest(folder, manifest)
+    if written is not None:
+        written.update(files)
+
+
+def get_archive_dataset(folder: str = ARCHIVE_FOLDER) -> ds.Dataset:
+    """Opens the archive as a dataset, memory mapping the parquet files."""
+    return ds.dataset(folder, format="parquet",
+                      filesystem=pafs.LocalFileSystem(use_mmap=True),
+                      partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"))
+
+
+def read_archive(folder: str = ARCHIVE_FOLDER, start: date | None = None,
+                 end: date | None = None, truck_ids: list[int] | None = None,
+                 files: list[str] | None = None) -> pd.DataFrame:
+    """Reads the archived transactions from start up to end, only reading the
+    partitions of the given trucks and the given source files when given.
+    Gives the same columns and types as transform."""
+    conditions = []
+    if start:
+        conditions.append(ds.field("date") >= start)
+    if end:
+        conditions.append(ds.field("date") < end)
+    if truck_ids:
+        conditions.append(ds.field("truck_id").isin(truck_ids))
+    if files is not None:
+        conditions.append(ds.field("filename").isin(files))
+    condition = None
+    for part in conditions:
+        condition = part if condition is None else condition & part
+
+    table = get_archive_dataset(folder).to_table(columns=TRANSFORM_COLUMNS, filter=condition)
+    trucks_df = table.to_pandas()
+    trucks_df["payment_method_id"] = trucks_df["payment_method_id"].astype("int64")
+    trucks_df["filename"] = trucks_df["filename"].astype("category")
+    return trucks_df
+
+
+def list_archive(folder: str = ARCHIVE_FOLDER) -> list[dict]:
+    """Lists the archived source files, with each day and truck they have transactions on."""
+    archived = []
+    for file, source in read_manifest(folder).items():
+        for part in source["parts"]:
+            partition = dict(name.split("=", 1) for name in path.dirname(part).split(path.sep))
+            archived.append({"day": date.fromisoformat(partition["date"]),
+                             "truck_id": int(partition["truck_id"]),
+                             "Key": file,
+                             "ETag": source["etag"],
+                             "Size": source["size"]})
+    return archived
+
+
+def backfill(conn: pymysql.Connection, folder: str = ARCHIVE_FOLDER,
+             start: date | None = None, end: date | None = None,
+             method: str = LOAD_METHOD, batch_size: int = LOAD_BATCH_SIZE) -> int:
+    """Loads the archived transactions into the database a day at a time,
+    replacing any already loaded from the same files. Every file with
+    transactions from start up to end is loaded in full. Returns the rows loaded."""
+    archived = list_archive(folder)
+    files = {obj["Key"] for obj in archived
+             if (not start or obj["day"] >= start) and (not end or obj["day"] < end)}
+    s3_objects = {obj["Key"]: obj for obj in archived if obj["Key"] in files}
+    days = sorted({obj["day"] for obj in archived if obj["Key"] in files})
+
+    replaced_ids = set()
+    rows = 0
+    for day in days:
+        trucks_df = read_archive(folder, day, day + timedelta(days=1), files=list(files))
+        if len(trucks_df):
+            rows += len(trucks_df)
+            load(conn, trucks_df, s3_objects, replaced_ids, method, batch_size, confirmed=False)
+
+    # Confirms the files once all of their days have loaded
+    cur = conn.cursor()
+    record_uploaded_files(cur, list(s3_objects.values()))
+    conn.commit()
+    cur.close()
+    return rows
@@ -0,0 +1,85 @@
+"""Food trucks data pipeline: compares reading and combining the truck csvs with
+pandas' defaults against the explicit truck file schema used by transform."""
+# Standard library imports
+from argparse import ArgumentParser, Namespace
+from time import perf_counter
+
+# Third-party imports
+import pandas as pd
+
+# Local imports
+from transform import get_files, get_truck_id, read_truck_csv, combine_truck_csvs, CSV_ENGINES
+
+
+REPEAT = 3
+
+
+def initialise_args() -> Namespace:
+    """Gets the cli arguments"""
+    parser = ArgumentParser()
+    parser.add_argument("-f", "--folder", default="truck_data/data",
+        help="-f or --folder the folder of extracted truck csvs to read.")
+    parser.add_argument("-n", "--repeat", type=int, default=REPEAT,
+        help="-n or --repeat the number of times to read the files, the fastest is kept.")
+    return parser.parse_args()
+
+
+def read_default(folder: str, files: list[str]) -> pd.DataFrame:
+    """Reads the truck csvs the way transform used to, letting pandas infer the types,
+    then makes total numeric as the cleaning used to."""
+    trucks_dfs = []
+    for file in files:
+        df = pd.read_csv(f'{folder}/{file}')
+        df["truck_id"] = get_truck_id(file)
+        df["filename"] = file
+        trucks_dfs.append(df)
+    trucks_df = pd.concat(trucks_dfs)
+    trucks_df["total"] = pd.to_numeric(trucks_df["total"], errors="coerce")
+    return trucks_df
+
+
+def read_schema(folder: str, files: list[str], engine: str) -> pd.DataFrame:
+    """Reads the truck csvs as transform does."""
+    return combine_truck_csvs([read_truck_csv(f'{folder}/{file}', engine) for file in files],
+                              files)
+
+
+def measure(read, folder: str, files: list[str], repeat: int) -> tuple[float, int]:
+    """Reads and combines every file repeat times, returning the fastest seconds
+    taken and the bytes held in memory by the combined DataFrame."""
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        trucks_df = read(folder, files)
+        timings.append(perf_counter() - start)
+    return min(timings), int(trucks_df.memory_usage(deep=True).sum())
+
+
+def compare_ingest(folder: str, repeat: int = REPEAT) -> list[dict]:
+    """Measures the default read against the schema with each engine."""
+    files = get_files(folder)
+    readers = {"default": read_default}
+    for engine in CSV_ENGINES:
+        readers[f"schema ({engine})"] = (
+            lambda folder, files, engine=engine: read_schema(folder, files, engine))
+
+    results = []
+    for name, read in readers.items():
+        try:
+            seconds, memory = measure(read, folder, files, repeat)
+        except ImportError:
+            print(f"Skipping {name}, the engine is not installed.")
+            continue
+        results.append({"reader": name, "seconds": seconds, "memory": memory})
+    return results
+
+
+if __name__ == "__main__":
+    arguments = initialise_args()
+    comparison = compare_ingest(arguments.folder, arguments.repeat)
+    baseline = comparison[0]
+    for result in comparison:
+        print(f"{result['reader']:<18} {result['seconds']:8.3f}s "
+              f"({result['seconds'] / baseline['seconds']:.2f}x) "
+              f"{result['memory'] / 1e6:10.2f}MB "
+              f"({result['memory'] / baseline['memory']:.2f}x)")
@@ -0,0 +1,89 @@
+"""Food trucks data pipeline: daemon.
+Runs the pipeline continuously, loading new files in small batches as they land.
+The trucks/ prefix is polled on an interval that shortens while files are
+arriving and backs off while they aren't. Every rescan_seconds a batch rescans
+the whole prefix, picking up files that landed too late for the watermark. SIGTERM or SIGINT stops the daemon
+once the current batch has loaded."""
+# Standard library imports
+from collections.abc import Callable
+from signal import signal, SIGINT, SIGTERM
+from threading import Event
+from time import perf_counter
+
+# Third-party imports
+from botocore.exceptions import BotoCoreError, ClientError
+import pymysql
+
+# Local imports
+from metrics import reset_metrics, get_metrics_record, emit_metrics
+
+
+BATCH_FILES = 500
+MIN_POLL_SECONDS = 5.0
+MAX_POLL_SECONDS = 300.0
+# Files that land more than the lookback before the watermark are found by the next rescan
+RESCAN_HOURS = 24.0
+
+STOP = Event()
+
+
+def request_stop(signum: int, _frame) -> None:
+    """Asks the daemon to stop once the current batch has loaded."""
+    print(f"Received signal {signum}, stopping after the current batch")
+    STOP.set()
+
+
+def get_poll_interval(interval: float, files: int, batch_files: int,
+                      min_seconds: float = MIN_POLL_SECONDS,
+                      max_seconds: float = MAX_POLL_SECONDS) -> float:
+    """Gets the seconds to wait before polling again. A full batch means more files
+    are waiting, so polls again straight away. Otherwise goes back to the shortest
+    interval when files arrived, and doubles the interval when none did."""
+    if files >= batch_files:
+        return 0
+    if files:
+        return min_seconds
+    return min(max(interval, min_seconds) * 2, max_seconds)
+
+
+def run_daemon(run_batch: Callable[..., int], conn: pymysql.Connection,
+               batch_files: int = BATCH_FILES, min_seconds: float = MIN_POLL_SECONDS,
+               max_seconds: float = MAX_POLL_SECONDS, metrics_file: str | None = None,
+               rescan_seconds: float = RESCAN_HOURS * 3600, **fields) -> int:
+    """Runs a batch, which returns the number of files it loaded, until asked to stop.
+    The first batch, and the first every rescan_seconds after, is run with rescan=True,
+    carrying on until a rescan batch isn't full. A rescan_seconds of 0 never rescans.
+    The connection is checked before each batch and reconnected if it was dropped.
+    A metrics record is emitted for each batch that loaded files.
+    Returns the number of batches that loaded files."""
+    handlers = {signum: signal(signum, request_stop) for signum in (SIGTERM, SIGINT)}
+    STOP.clear()
+    interval = min_seconds
+    batches = 0
+    next_rescan = perf_counter()
+    try:
+        while not STOP.is_set():
+            reset_metrics()
+            start = perf_counter()
+            rescan = bool(rescan_seconds) and start >= next_rescan
+            try:
+                conn.ping(reconnect=True)
+                files = run_batch(rescan=rescan)
+                if rescan and files < batch_files:
+                    next_rescan = start + rescan_seconds
+            except (pymysql.err.OperationalError, BotoCoreError, ClientError) as error:
+                # Nothing was confirmed, so the files are picked up again by a later batch
+                print(f"Batch failed, retrying later: {error}")
+                files = 0
+            if files:
+                batches += 1
+                emit_metrics(get_metrics_record(
+                    total_seconds=round(perf_counter() - start, 4), files=files,
+                    rescan=rescan, **fields),
+                    metrics_file)
+            interval = get_poll_interval(interval, files, batch_files, min_seconds, max_seconds)
+            STOP.wait(interval)
+    finally:
+        for signum, handler in handlers.items():
+            signal(signum, handler)
+    return batches
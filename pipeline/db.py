@@ -0,0 +1,53 @@
+"""Food trucks: streaming reads from the database.
+Rows are read on an unbuffered server side cursor as tuples, a batch at a time,
+rather than fetching every row as a dict. The same module is copied into each
+service folder, as each one is built on its own.
+pandas is only imported by read_frame, so stream_rows can be used without it."""
+# Standard library imports
+from __future__ import annotations
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
+
+# Third-party imports
+import pymysql
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+DB_BATCH_SIZE = 50_000
+
+
+def stream_rows(conn: pymysql.Connection, sql: str, params: tuple | list = None,
+                batch_size: int = DB_BATCH_SIZE) -> Iterator[list[tuple]]:
+    """Runs a query, yielding its rows as tuples a batch at a time.
+    Every batch must be read before the connection is used again."""
+    cur = conn.cursor(pymysql.cursors.SSCursor)
+    try:
+        cur.execute(sql, params)
+        while rows := cur.fetchmany(batch_size):
+            yield rows
+    finally:
+        cur.close()
+
+
+def read_frame(conn: pymysql.Connection, sql: str, params: tuple | list = None,
+               dtypes: dict = None, batch_size: int = DB_BATCH_SIZE) -> pd.DataFrame:
+    """Reads a query into a DataFrame, converting each batch of rows to columns
+    with the given dtypes as it arrives."""
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    cur = conn.cursor(pymysql.cursors.SSCursor)
+    try:
+        cur.execute(sql, params)
+        columns = [column[0] for column in cur.description]
+        frames = []
+        while rows := cur.fetchmany(batch_size):
+            frame = pd.DataFrame.from_records(rows, columns=columns)
+            frames.append(frame.astype(dtypes) if dtypes else frame)
+    finally:
+        cur.close()
+    if not frames:
+        frame = pd.DataFrame(columns=columns)
+        return frame.astype(dtypes) if dtypes else frame
+    return pd.concat(frames, ignore_index=True)
@@ -3,13 +3,34 @@
 from os import environ as ENV, path, makedirs
 from shutil import rmtree
 from argparse import ArgumentParser
-from datetime import datetime
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from time import sleep
 
 # Third-party imports
 from boto3 import client
+from botocore.exceptions import BotoCoreError, ClientError
 from dotenv import load_dotenv
 import pymysql
 
+# Local imports
+from db import stream_rows
+from metrics import timed, add_count
+
+
+TRUCKS_PREFIX = "trucks/"
+DATA_FOLDER = "truck_data/data"
+# Files can land after a later hour's files, so each listing starts this far before the watermark
+WATERMARK_LOOKBACK = timedelta(hours=1)
+REGISTRY_BATCH_SIZE = 1000
+# The etag of the files loaded before etags were recorded, which aren't loaded again
+LEGACY_ETAG = "legacy"
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF = 0.5
+
 
 def initialise_argsparse() -> bool:
     """Initialise CLI arguments"""
@@ -18,87 +39,297 @@ def initialise_argsparse() -> bool:
         help="-s or --single run the file on it's own or part of pipeline script.")
     parser.add_argument("-a", "--all_files",  action='store_true',
         help="-a or --all is called to get all truck data from the s3 bucket not just the latest.")
+    parser.add_argument("-w", "--workers", type=int, default=DOWNLOAD_WORKERS,
+        help="-w or --workers the number of files to download at the same time.")
+    parser.add_argument("-r", "--rescan", action='store_true',
+        help="-r or --rescan lists every file to find any that have been uploaded again.")
     args = parser.parse_args()
-    return args.single, args.all_files
+    return args.single, args.all_files, args.workers, args.rescan
 
 
-def initialise_folders(all_files: bool, conn: pymysql.Connection):
-    """Creates a data/ folder if it does not exist. Resets the database downloaded files."""
-    if all_files:
+def get_data_folder(worker_id: str | None = None) -> str:
+    """Gets the folder the files are downloaded to. Each leasing worker has a
+    folder of its own, so it never reads or deletes another worker's files."""
+    return path.join("truck_data", worker_id) if worker_id else DATA_FOLDER
+
 
-        if path.isdir('truck_data/data'):
-            rmtree('truck_data/data')
-        makedirs('truck_data/data')
+def initialise_folders(all_files: bool, data_folder: str = DATA_FOLDER):
+    """Creates a data/ folder if it does not exist, emptying it when getting all the files."""
+    if all_files:
 
-        cur = conn.cursor()
-        cur.execute("DELETE FROM uploaded_files;")
-        conn.commit()
-        cur.close()
+        if path.isdir(data_folder):
+            rmtree(data_folder)
+        makedirs(data_folder)
 
     else:
-        if not path.isdir('truck_data'):
-            makedirs('truck_data')
-        if not path.isdir('truck_data/data'):
-            makedirs('truck_data/data')
+        if not path.isdir(data_folder):
+            makedirs(data_folder)
 
 
-def get_uploaded_files(conn: pymysql.Connection) -> list[str]:
-    """Gets a list of the uploaded files."""
-    sql = """SELECT * FROM uploaded_files;"""
+def get_uploaded_files(conn: pymysql.Connection, files: list[str]) -> dict[str, tuple]:
+    """Gets the etag and size of the given files that have already been uploaded.
+    Only the candidate files are looked up, using the unique index on filename."""
+    uploaded_files = {}
+    for start in range(0, len(files), REGISTRY_BATCH_SIZE):
+        batch = files[start:start + REGISTRY_BATCH_SIZE]
+        placeholders = ", ".join(["%s"] * len(batch))
+        for rows in stream_rows(conn, f"""SELECT filename, etag, size FROM uploaded_files
+                WHERE filename IN ({placeholders});""", batch):
+            for filename, etag, size in rows:
+                uploaded_files[filename] = (etag, size)
+    return uploaded_files
+
+
+def get_watermark(conn: pymysql.Connection) -> dict | None:
+    """Gets the last key and modified time from the last successful run."""
+    sql = """SELECT last_key, last_modified FROM extract_watermark
+        WHERE watermark_id = 1;"""
     cur = conn.cursor()
     cur.execute(sql)
-    result = cur.fetchall()
+    result = cur.fetchone()
+    cur.close()
+    return result
+
+
+def update_watermark(conn: pymysql.Connection, s3_objects: list[dict]) -> None:
+    """Moves the watermark on to the newest of the processed objects."""
+    if not s3_objects:
+        return
+    last_key = max(obj["Key"] for obj in s3_objects)
+    last_modified = max(obj["LastModified"] for obj in s3_objects)
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO extract_watermark (watermark_id, last_key, last_modified)
+        VALUES (1, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            last_key = GREATEST(last_key, VALUES(last_key)),
+            last_modified = GREATEST(last_modified, VALUES(last_modified));
+        """, (last_key, last_modified))
+    conn.commit()
     cur.close()
-    return [file["filename"] for file in result]
 
 
-def get_s3_files(s3_client) -> list[str]:
-    """Gets all the truck files in the s3 bucket."""
-    objs = s3_client.list_objects(Bucket=ENV["BUCKET"])
-    contents = objs["Contents"]
-    return [obj["Key"] for obj in contents if 'trucks/' in obj["Key"]]
+def get_lookback_key(last_key: str, lookback: timedelta = WATERMARK_LOOKBACK) -> str:
+    """Gets the key to list after, the prefix of the hour lookback before the
+    watermark's hour, eg. trucks/2025-01-01/08/ for trucks/2025-01-01/09/truck_T3_...
+    Keys that aren't in the trucks/<day>/<hour>/ layout are listed after themselves."""
+    parts = last_key.split("/")
+    try:
+        hour = datetime.strptime(f"{parts[1]} {parts[2]}", "%Y-%m-%d %H")
+    except (IndexError, ValueError):
+        return last_key
+    return f"{TRUCKS_PREFIX}{hour - lookback:%Y-%m-%d/%H}/"
 
 
-def get_files_for_transform(uploaded_files: datetime, s3_files: list[str]) -> list[str]:
-    """Finds the files that have not been uploaded."""
-    return [file for file in s3_files if file not in uploaded_files]
+def is_after_watermark(s3_object: dict, watermark: dict) -> bool:
+    """Checks if an object sorts after the watermark's key, or was modified since
+    its time, eg. a T1 file that landed after the same hour's T3 file was loaded."""
+    last_modified = watermark["last_modified"]
+    if last_modified.tzinfo is None:
+        # Stored as UTC in a DATETIME column
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return s3_object["Key"] > watermark["last_key"] or s3_object["LastModified"] >= last_modified
 
 
-def download_truck_data_files(s3_client, files: list, conn: pymysql.Connection) -> list[str]:
-    """Downloads relevant files from S3 to a data/ folder."""
-    try:
-        for file in files:
-            s3_client.download_file(ENV["BUCKET"], file,
-                    f'truck_data/data/{file.replace("/", "_")}')
-
-        cur = conn.cursor()
-        cur.executemany("""
-            INSERT INTO uploaded_files (filename)
-            VALUES (%s)
-            """, files)
-        conn.commit()
-        cur.close()
-    except:
-        print("Error downloading S3 files.")
-
-
-def extract(all_files: bool, conn: pymysql.Connection):
-    """Main function for the extract module."""
-    s3 = client('s3', aws_access_key_id=ENV["ACCESS_KEY"],
-                aws_secret_access_key = ENV["SECRET_KEY"])
-    initialise_folders(all_files, conn)
-    s3_files = get_s3_files(s3)
-    files_uploaded = get_uploaded_files(conn)
-    if not all_files:
-        files_for_transform = get_files_for_transform(files_uploaded, s3_files)
-    else:
+def list_s3_objects(s3_client, watermark: dict | None = None,
+                    lookback: timedelta = WATERMARK_LOOKBACK) -> list[dict]:
+    """Lists the truck objects under the trucks/ prefix, a page at a time.
+    When a watermark is given the listing starts lookback before its key, as the
+    truck files are named by date, keeping only the objects after the watermark.
+    Objects seen again are dropped by the uploaded_files check."""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    params = {"Bucket": ENV["BUCKET"], "Prefix": TRUCKS_PREFIX}
+    if watermark:
+        params["StartAfter"] = get_lookback_key(watermark["last_key"], lookback)
+
+    s3_objects = []
+    with timed("list"):
+        for page in paginator.paginate(**params):
+            s3_objects.extend(page.get("Contents", []))
+    if watermark:
+        s3_objects = [obj for obj in s3_objects if is_after_watermark(obj, watermark)]
+    add_count("files_listed", len(s3_objects))
+    return s3_objects
+
+
+def get_s3_files(s3_client, watermark: dict | None = None) -> list[str]:
+    """Gets the truck files in the s3 bucket newer than the watermark."""
+    return [obj["Key"] for obj in list_s3_objects(s3_client, watermark)]
+
+
+def get_object_version(s3_object: dict) -> tuple:
+    """Gets the etag and size used to tell if an object has changed."""
+    return s3_object["ETag"].strip('"'), s3_object["Size"]
+
+
+def get_files_for_transform(uploaded_files: dict[str, tuple],
+                            s3_objects: list[dict]) -> list[str]:
+    """Finds the files that have not been uploaded, or that have been
+    uploaded again with different content since they were. Legacy files can't be
+    told apart from a new version, and their transactions may not be traced back
+    to them to be replaced, so they are left as they are."""
+    return [obj["Key"] for obj in s3_objects
+            if uploaded_files.get(obj["Key"]) != get_object_version(obj)
+            and uploaded_files.get(obj["Key"], (None,))[0] != LEGACY_ETAG]
+
+
+def get_s3_client():
+    """Gets the s3 client."""
+    return client('s3', aws_access_key_id=ENV["ACCESS_KEY"],
+                  aws_secret_access_key = ENV["SECRET_KEY"])
+
+
+def find_new_files(s3_client, all_files: bool, conn: pymysql.Connection,
+                   rescan: bool = False, max_files: int | None = None,
+                   lookback: timedelta = WATERMARK_LOOKBACK) -> tuple[list[dict], list[str]]:
+    """Lists the s3 objects after the watermark and finds the files to be transformed.
+    A rescan lists the whole prefix to pick up files that have been uploaded again,
+    or that landed more than lookback before the watermark.
+    With max_files only the first max_files files are taken, and only the objects up
+    to the last of them are returned, so the watermark stops there."""
+    watermark = None if all_files or rescan else get_watermark(conn)
+    s3_objects = list_s3_objects(s3_client, watermark, lookback)
+    s3_files = [obj["Key"] for obj in s3_objects]
+    if all_files:
         files_for_transform = s3_files
-    download_truck_data_files(s3, files_for_transform, conn)
+    else:
+        files_uploaded = get_uploaded_files(conn, s3_files)
+        files_for_transform = get_files_for_transform(files_uploaded, s3_objects)
+    if max_files and len(files_for_transform) > max_files:
+        files_for_transform = files_for_transform[:max_files]
+        last_file = files_for_transform[-1]
+        s3_objects = [obj for obj in s3_objects if obj["Key"] <= last_file]
+    return s3_objects, files_for_transform
+
+
+def get_watermark_objects(s3_objects: list[dict], files: list[str],
+                          extracted: list[str]) -> list[dict]:
+    """Gets the listed objects the watermark can move past.
+    Stops before the first failed file so it is listed again on the next run."""
+    extracted = set(extracted)
+    failed = [file for file in files if file not in extracted]
+    if failed:
+        first_failed = min(failed)
+        return [obj for obj in s3_objects if obj["Key"] < first_failed]
+    return s3_objects
+
+
+def download_file(s3_client, file: str, retries: int = DOWNLOAD_RETRIES,
+                  data_folder: str = DATA_FOLDER) -> bool:
+    """Downloads a single file, retrying with exponential backoff.
+    Returns whether the file was downloaded."""
+    for attempt in range(retries + 1):
+        try:
+            makedirs(path.dirname(f'{data_folder}/{file}'), exist_ok=True)
+            s3_client.download_file(ENV["BUCKET"], file, f'{data_folder}/{file}')
+            add_count("files_downloaded")
+            return True
+        except (BotoCoreError, ClientError) as error:
+            if attempt == retries:
+                print(f"Error downloading {file}: {error}")
+                return False
+            sleep(DOWNLOAD_BACKOFF * 2 ** attempt)
+    return False
+
+
+def fetch_file(s3_client, file: str, retries: int = DOWNLOAD_RETRIES) -> bytes | None:
+    """Reads the body of a single file into memory, retrying with exponential backoff.
+    Returns None if the file could not be read."""
+    for attempt in range(retries + 1):
+        try:
+            body = s3_client.get_object(Bucket=ENV["BUCKET"], Key=file)["Body"].read()
+            add_count("files_downloaded")
+            add_count("bytes_downloaded", len(body))
+            return body
+        except (BotoCoreError, ClientError) as error:
+            if attempt == retries:
+                print(f"Error streaming {file}: {error}")
+                return None
+            sleep(DOWNLOAD_BACKOFF * 2 ** attempt)
+    return None
+
+
+def download_truck_data_files(s3_client, files: list[str], workers: int = DOWNLOAD_WORKERS,
+                              data_folder: str = DATA_FOLDER) -> list[str]:
+    """Downloads relevant files from S3 to a data/ folder using a pool of workers.
+    Returns the files that downloaded."""
+    with timed("download"), ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda file: download_file(s3_client, file, data_folder=data_folder), files)
+        downloaded = [file for file, success in zip(files, results) if success]
+
+    if len(downloaded) != len(files):
+        print(f"Failed to download {len(files) - len(downloaded)} of {len(files)} files.")
+    return downloaded
+
+
+def stream_truck_data_files(s3_client, files: list[str],
+                            workers: int = DOWNLOAD_WORKERS) -> Iterator[tuple[str, bytes]]:
+    """Yields (key, body) for each file in the order they finish downloading,
+    without writing them to disk. Files that fail to download are skipped.
+    At most twice as many files as workers are held at once, so memory stays
+    bounded however many files there are."""
+    pending_files = iter(files)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_file, s3_client, file): file
+                   for file in islice(pending_files, 2 * workers)}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                file = futures.pop(future)
+                next_file = next(pending_files, None)
+                if next_file is not None:
+                    futures[executor.submit(fetch_file, s3_client, next_file)] = next_file
+                body = future.result()
+                if body is not None:
+                    yield file, body
+
+
+def extract(all_files: bool, conn: pymysql.Connection, workers: int = DOWNLOAD_WORKERS,
+            rescan: bool = False, s3_client=None, max_files: int | None = None,
+            claim: Callable[[list[dict], list[str]], list[str]] | None = None,
+            data_folder: str = DATA_FOLDER,
+            lookback: timedelta = WATERMARK_LOOKBACK) -> tuple[list[dict], list[dict]]:
+    """Main function for the extract module.
+    Returns the downloaded s3 objects, to be recorded as uploaded when they are loaded,
+    and the listed s3 objects to be passed to update_watermark once loaded.
+    Pass an s3_client to reuse one, eg. between the batches of the daemon.
+    When given, claim is passed the listed objects and new files and returns the
+    files this worker should download. The watermark stops before the first of the
+    others, so it never moves past a file another worker hasn't loaded.
+    The listing starts lookback before the watermark's key, see find_new_files."""
+    s3 = s3_client or get_s3_client()
+    initialise_folders(all_files, data_folder)
+    s3_objects, files_for_transform = find_new_files(s3, all_files, conn, rescan, max_files,
+                                                   lookback)
+    claimed = claim(s3_objects, files_for_transform) if claim else files_for_transform
+    downloaded = download_truck_data_files(s3, claimed, workers, data_folder)
+    downloaded_set = set(downloaded)
+    downloaded_objects = [obj for obj in s3_objects if obj["Key"] in downloaded_set]
+    add_count("bytes_downloaded", sum(obj["Size"] for obj in downloaded_objects))
+    return (downloaded_objects,
+            get_watermark_objects(s3_objects, files_for_transform, downloaded))
+
+
+def extract_stream(all_files: bool, conn: pymysql.Connection, workers: int = DOWNLOAD_WORKERS,
+                   rescan: bool = False, s3_client=None, max_files: int | None = None,
+                   claim: Callable[[list[dict], list[str]], list[str]] | None = None,
+                   lookback: timedelta = WATERMARK_LOOKBACK
+                   ) -> tuple[list[dict], list[str], Iterator]:
+    """Streaming version of extract, nothing is written to truck_data/data.
+    Returns the listed s3 objects, the files to be transformed and a stream of
+    (key, body) to pass to transform. Once loaded, the streamed keys should be
+    passed to get_watermark_objects. claim is used as in extract."""
+    s3 = s3_client or get_s3_client()
+    s3_objects, files_for_transform = find_new_files(s3, all_files, conn, rescan, max_files,
+                                                   lookback)
+    claimed = claim(s3_objects, files_for_transform) if claim else files_for_transform
+    return s3_objects, files_for_transform, stream_truck_data_files(s3, claimed, workers)
 
 
 if __name__ == "__main__":
     # Initialise
-    single, download_all = initialise_argsparse()
+    single, download_all, download_workers, rescan_all = initialise_argsparse()
     if single:
         load_dotenv()
     connection = pymysql.connect(host=ENV["DB_HOST"],
@@ -108,6 +339,6 @@ if __name__ == "__main__":
         charset='utf8mb4',
         cursorclass=pymysql.cursors.DictCursor)
     
-    # Extract
-    extract(download_all, connection)
+    # Extract, the files are not marked as uploaded until they are loaded by pipeline.py
+    extract(download_all, connection, download_workers, rescan_all)
     connection.close()
@@ -0,0 +1,91 @@
+"""Food trucks data pipeline: lease.
+Lets several pipeline workers run at the same time without loading the same file.
+Each worker claims the files it is going to load with a lease in the file_lease
+table, and releases them once they are loaded. A lease that has expired belongs
+to a worker that stopped, so its files can be claimed by another worker.
+Workers can also each take a shard of the trucks, so they rarely compete."""
+# Standard library imports
+from os import getpid
+from socket import gethostname
+from uuid import uuid4
+
+# Third-party imports
+import pymysql
+
+# Local imports
+from db import stream_rows
+from extract import get_uploaded_files, get_files_for_transform, REGISTRY_BATCH_SIZE
+from transform import get_truck_id
+
+
+LEASE_SECONDS = 600
+
+
+def get_worker_id() -> str:
+    """Gets an id for this worker, unique across hosts and restarts."""
+    return f"{gethostname()[:40]}-{getpid()}-{uuid4().hex[:8]}"
+
+
+def parse_shard(shard: str) -> tuple[int, int]:
+    """Parses a shard given as index/count, eg. 0/4 is the first of four shards."""
+    index, count = (int(part) for part in shard.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Shard {shard} is not between 0/{count} and {count - 1}/{count}")
+    return index, count
+
+
+def filter_shard(files: list[str], shard: tuple[int, int]) -> list[str]:
+    """Keeps the files of the trucks in the shard."""
+    index, count = shard
+    return [file for file in files if get_truck_id(file) % count == index]
+
+
+def claim_files(conn: pymysql.Connection, worker_id: str, s3_objects: list[dict],
+                files: list[str], lease_seconds: int = LEASE_SECONDS,
+                shard: tuple[int, int] | None = None) -> list[str]:
+    """Claims the files, in the shard when given, that aren't leased by another worker.
+    Each file is claimed in one statement, taking it over if its lease has expired.
+    The claimed files are checked against uploaded_files again, as another worker
+    may have loaded them since they were listed. Returns the files claimed."""
+    if shard:
+        files = filter_shard(files, shard)
+    cur = conn.cursor()
+    for start in range(0, len(files), REGISTRY_BATCH_SIZE):
+        # worker_id is updated first, so expires_at is only moved on when it was claimed
+        cur.executemany("""
+            INSERT INTO file_lease (filename, worker_id, expires_at)
+            VALUES (%s, %s, NOW() + INTERVAL %s SECOND)
+            ON DUPLICATE KEY UPDATE
+                worker_id = IF(expires_at < NOW(), VALUES(worker_id), worker_id),
+                expires_at = IF(worker_id = VALUES(worker_id), VALUES(expires_at), expires_at);
+            """, [(file, worker_id, lease_seconds)
+                  for file in files[start:start + REGISTRY_BATCH_SIZE]])
+    conn.commit()
+    cur.close()
+
+    leased = set()
+    for rows in stream_rows(conn, "SELECT filename FROM file_lease WHERE worker_id = %s;",
+                            (worker_id,)):
+        leased.update(filename for filename, in rows)
+    claimed = [file for file in files if file in leased]
+    claimed_set = set(claimed)
+    return get_files_for_transform(get_uploaded_files(conn, claimed),
+                                   [obj for obj in s3_objects if obj["Key"] in claimed_set])
+
+
+def renew_leases(conn: pymysql.Connection, worker_id: str,
+                 lease_seconds: int = LEASE_SECONDS) -> None:
+    """Extends the leases of the worker's files, eg. before loading a large batch."""
+    cur = conn.cursor()
+    cur.execute("""UPDATE file_lease SET expires_at = NOW() + INTERVAL %s SECOND
+        WHERE worker_id = %s;""", (lease_seconds, worker_id))
+    conn.commit()
+    cur.close()
+
+
+def release_files(conn: pymysql.Connection, worker_id: str) -> None:
+    """Releases every file claimed by the worker, once they have been loaded."""
+    cur = conn.cursor()
+    cur.execute("DELETE FROM file_lease WHERE worker_id = %s;", (worker_id,))
+    conn.commit()
+    cur.close()
@@ -0,0 +1,170 @@
+"""Food trucks data pipeline: load"""
+# Standard library imports
+from os import remove
+from tempfile import NamedTemporaryFile
+
+# Third-party imports
+import pandas as pd
+import pymysql
+
+# Local imports
+from extract import get_object_version, REGISTRY_BATCH_SIZE
+from metrics import timed, add_count
+from rollup import upsert_rollups, subtract_file_rollups
+
+
+LOAD_METHODS = ("batch", "infile")
+LOAD_METHOD = "batch"
+LOAD_BATCH_SIZE = 5000
+TRANSACTION_COLUMNS = ["truck_id", "payment_method_id", "total", "at", "filename_id"]
+
+
+def record_uploaded_files(cur: pymysql.cursors.Cursor, s3_objects: list[dict],
+                          confirmed: bool = True) -> None:
+    """Records the objects as uploaded, along with their etag and size.
+    Unconfirmed files are recorded without an etag, so if the run stops before
+    they are confirmed they are seen as changed and loaded again."""
+    if not s3_objects:
+        return
+    cur.executemany("""
+        INSERT INTO uploaded_files (filename, etag, size)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            etag = VALUES(etag), size = VALUES(size), loaded_at = CURRENT_TIMESTAMP;
+        """, [(obj["Key"], *(get_object_version(obj) if confirmed else (None, None)))
+              for obj in s3_objects])
+
+
+def get_filename_ids(cur: pymysql.cursors.Cursor, files: list[str]) -> dict[str, int]:
+    """Gets the filename_id of each of the given uploaded files."""
+    filename_ids = {}
+    for start in range(0, len(files), REGISTRY_BATCH_SIZE):
+        batch = files[start:start + REGISTRY_BATCH_SIZE]
+        placeholders = ", ".join(["%s"] * len(batch))
+        cur.execute(f"""SELECT filename, filename_id FROM uploaded_files
+            WHERE filename IN ({placeholders});""", batch)
+        for file in cur.fetchall():
+            filename_ids[file["filename"]] = file["filename_id"]
+    return filename_ids
+
+
+def delete_file_transactions(cur: pymysql.cursors.Cursor, filename_ids: list[int]) -> None:
+    """Deletes the transactions previously loaded from the given files.
+    The deletes counter is moved on, so the dashboard knows to fetch them again."""
+    for start in range(0, len(filename_ids), REGISTRY_BATCH_SIZE):
+        batch = filename_ids[start:start + REGISTRY_BATCH_SIZE]
+        placeholders = ", ".join(["%s"] * len(batch))
+        cur.execute(f"DELETE FROM Transaction WHERE filename_id IN ({placeholders});", batch)
+    if filename_ids:
+        cur.execute("UPDATE transaction_deletes SET deletes = deletes + 1 WHERE delete_id = 1;")
+
+
+def record_load(cur: pymysql.cursors.Cursor, filename_ids: list[int]) -> None:
+    """Moves on the load version, which the dashboard checks to see if the data has
+    changed, and logs the first transaction_id loaded from the files. Loads running
+    at the same time can commit their ids out of order, so the dashboard fetches
+    from the first id of each load it hasn't seen. The counter row stays locked
+    until the commit, so run it just before, and loads get versions in commit order."""
+    cur.execute("""UPDATE transaction_deletes SET load_version = load_version + 1
+        WHERE delete_id = 1;""")
+    first_ids = []
+    for start in range(0, len(filename_ids), REGISTRY_BATCH_SIZE):
+        batch = filename_ids[start:start + REGISTRY_BATCH_SIZE]
+        placeholders = ", ".join(["%s"] * len(batch))
+        cur.execute(f"""SELECT MIN(transaction_id) AS first_id FROM Transaction
+            WHERE filename_id IN ({placeholders});""", batch)
+        first_id = cur.fetchone()["first_id"]
+        if first_id is not None:
+            first_ids.append(first_id)
+    if first_ids:
+        cur.execute("""INSERT INTO transaction_load (load_version, first_transaction_id)
+            SELECT load_version, %s FROM transaction_deletes WHERE delete_id = 1;""",
+                    (min(first_ids),))
+
+
+def replace_file_transactions(cur: pymysql.cursors.Cursor, filename_ids: list[int]) -> None:
+    """Takes the transactions previously loaded from the given files off the
+    rollup tables, then deletes them."""
+    subtract_file_rollups(cur, filename_ids)
+    delete_file_transactions(cur, filename_ids)
+
+
+def replace_unloaded_files(cur: pymysql.cursors.Cursor, files: list[str],
+                           replaced_ids: set[int]) -> None:
+    """Replaces the transactions of files that were read but had no clean rows, so
+    never reached load, eg. a file uploaded again with only VOID totals. Files whose
+    filename_id is in replaced_ids were loaded, and already replaced."""
+    ids = [file_id for file_id in get_filename_ids(cur, files).values()
+           if file_id not in replaced_ids]
+    with timed("replace"):
+        replace_file_transactions(cur, ids)
+    if ids:
+        record_load(cur, [])
+    replaced_ids.update(ids)
+
+
+def insert_batches(cur: pymysql.cursors.Cursor, trucks_df: pd.DataFrame,
+                   batch_size: int = LOAD_BATCH_SIZE) -> None:
+    """Inserts the transactions batch_size rows at a time.
+    pymysql sends each batch as multi-row INSERT statements."""
+    sql = f"""INSERT INTO Transaction ({", ".join(TRANSACTION_COLUMNS)})
+        VALUES ({", ".join(["%s"] * len(TRANSACTION_COLUMNS))})"""
+    rows = list(zip(*(trucks_df[column].tolist() for column in TRANSACTION_COLUMNS)))
+    for start in range(0, len(rows), batch_size):
+        cur.executemany(sql, rows[start:start + batch_size])
+
+
+def insert_infile(cur: pymysql.cursors.Cursor, trucks_df: pd.DataFrame) -> None:
+    """Inserts the transactions with LOAD DATA LOCAL INFILE from a temporary csv.
+    The connection must be opened with local_infile=True."""
+    with NamedTemporaryFile("w", suffix=".csv", delete=False) as file:
+        trucks_df[TRANSACTION_COLUMNS].to_csv(file, index=False, header=False,
+                                              date_format="%Y-%m-%d %H:%M:%S")
+    try:
+        cur.execute(f"""
+            LOAD DATA LOCAL INFILE %s INTO TABLE Transaction
+            FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n'
+            ({", ".join(TRANSACTION_COLUMNS)});
+            """, (file.name,))
+    finally:
+        remove(file.name)
+
+
+def load(conn: pymysql.Connection, trucks_df: pd.DataFrame, s3_objects: dict[str, dict],
+         replaced_ids: set[int], method: str = LOAD_METHOD,
+         batch_size: int = LOAD_BATCH_SIZE, confirmed: bool = True) -> None:
+    """Loads the transactions into the database in a single transaction,
+    along with the files they came from and the rollup totals. Any transactions
+    already loaded from those files are replaced, unless their filename_id is in
+    replaced_ids (they were cleared by an earlier chunk of this run).
+    When loading in chunks pass confirmed=False, and confirm the files with
+    record_uploaded_files once every chunk has loaded."""
+    cur = conn.cursor()
+    try:
+        files = list(trucks_df["filename"].unique())
+        with timed("register_files"):
+            record_uploaded_files(cur, [s3_objects[file] for file in files], confirmed)
+            filename_ids = get_filename_ids(cur, files)
+        trucks_df["filename_id"] = trucks_df.pop("filename").map(filename_ids).astype("int64")
+
+        ids = [file_id for file_id in filename_ids.values() if file_id not in replaced_ids]
+        with timed("replace"):
+            replace_file_transactions(cur, ids)
+
+        with timed("insert"):
+            if method == "infile":
+                insert_infile(cur, trucks_df)
+            else:
+                insert_batches(cur, trucks_df, batch_size)
+        with timed("rollup"):
+            upsert_rollups(cur, trucks_df)
+        with timed("commit"):
+            record_load(cur, list(filename_ids.values()))
+            conn.commit()
+        add_count("rows_loaded", len(trucks_df))
+        replaced_ids.update(ids)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
@@ -0,0 +1,103 @@
+"""Food trucks data pipeline: metrics.
+Records the time spent in each stage of a run and counts of the files, rows and
+bytes it handled, to be emitted as one json record at the end of the run."""
+# Standard library imports
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from cProfile import Profile
+from datetime import datetime, timezone
+from json import dumps
+from pstats import Stats
+from resource import getrusage, RUSAGE_SELF
+from threading import Lock
+from time import perf_counter
+
+
+# The functions shown when profiling, as a regex for pstats
+HOT_FUNCTIONS = ("list_s3_objects|download_file|fetch_file|read_truck_file|concat_truck_files"
+                 "|clean_transactions|insert_batches|insert_infile|upsert_rollups"
+                 "|subtract_file_rollups|delete_file_transactions")
+PROFILE_LINES = 25
+
+METRICS_LOCK = Lock()
+STAGE_SECONDS = defaultdict(float)
+COUNTS = defaultdict(int)
+
+
+def reset_metrics() -> None:
+    """Clears the metrics recorded so far."""
+    with METRICS_LOCK:
+        STAGE_SECONDS.clear()
+        COUNTS.clear()
+
+
+def add_count(name: str, value: int = 1) -> None:
+    """Adds to a count, eg. of files downloaded. Safe to call from the download threads."""
+    with METRICS_LOCK:
+        COUNTS[name] += value
+
+
+def get_stage_metrics() -> tuple[dict, dict]:
+    """Gets copies of the seconds spent in each stage and the counts recorded so far."""
+    with METRICS_LOCK:
+        return dict(STAGE_SECONDS), dict(COUNTS)
+
+
+def merge_metrics(seconds: dict, counts: dict) -> None:
+    """Adds seconds and counts recorded somewhere else, eg. in a worker process."""
+    with METRICS_LOCK:
+        for stage, stage_seconds in seconds.items():
+            STAGE_SECONDS[stage] += stage_seconds
+        for name, value in counts.items():
+            COUNTS[name] += value
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Adds the time spent in the with block to the stage."""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        seconds = perf_counter() - start
+        with METRICS_LOCK:
+            STAGE_SECONDS[stage] += seconds
+
+
+def get_peak_rss() -> int:
+    """Gets the peak resident memory of the process in bytes (ru_maxrss is in KB on Linux)."""
+    return getrusage(RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_metrics_record(**fields) -> dict:
+    """Gets the metrics of the run as one record, along with any extra fields."""
+    with METRICS_LOCK:
+        return {"finished_at": datetime.now(timezone.utc).isoformat(),
+                **fields,
+                "seconds": {stage: round(seconds, 4) for stage, seconds in STAGE_SECONDS.items()},
+                "counts": dict(COUNTS),
+                "peak_rss_bytes": get_peak_rss()}
+
+
+def emit_metrics(record: dict, filename: str | None = None) -> None:
+    """Prints the record as a line of json, and appends it to filename when given."""
+    line = dumps(record, default=str)
+    print(line)
+    if filename:
+        with open(filename, "a", encoding="UTF-8") as file:
+            file.write(line + "\n")
+
+
+def start_profiler() -> Profile:
+    """Starts profiling the main thread."""
+    profiler = Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiler(profiler: Profile, filename: str) -> None:
+    """Stops profiling, saves the stats to filename and prints the hot functions."""
+    profiler.disable()
+    profiler.dump_stats(filename)
+    Stats(profiler).sort_stats("cumulative").print_stats(HOT_FUNCTIONS, PROFILE_LINES)
@@ -1,58 +1,241 @@
-"""Food trucks data pipeline: pipeline. 
+"""Food trucks data pipeline: pipeline.
 This is a combination of the extract, transform, and load modules."""
 # Native imports
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import date, timedelta
+from functools import partial
 from os import environ as ENV, path, mkdir
 from shutil import rmtree
+from time import perf_counter
 
-# Third library imports
+# Third library imports
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
 import pymysql
 
 # Local imports
-from extract import extract as extract_main
-from transform import transform as transform_main
+from extract import (extract as extract_main, extract_stream, update_watermark,
+                     get_watermark_objects, get_s3_client, get_data_folder, DOWNLOAD_WORKERS,
+                     WATERMARK_LOOKBACK)
+from transform import (transform as transform_main, transform_chunks, transform_parallel,
+                       get_payment_mapping, get_process_pool, CSV_ENGINES, CSV_ENGINE)
+from load import (load, record_uploaded_files, replace_unloaded_files, LOAD_METHODS, LOAD_METHOD,
+                  LOAD_BATCH_SIZE)
+from archive import write_archive, backfill
+from daemon import run_daemon, BATCH_FILES, MIN_POLL_SECONDS, MAX_POLL_SECONDS, RESCAN_HOURS
+from lease import (claim_files, renew_leases, release_files, get_worker_id, parse_shard,
+                   LEASE_SECONDS)
+from metrics import get_metrics_record, emit_metrics, start_profiler, stop_profiler
 
 
-def initialise_args():
+def initialise_args() -> Namespace:
     """Gets the cli arguments"""
     parser = ArgumentParser()
     parser.add_argument("-a", "--all_files",  action='store_true',
         help="-a or --all is called to get all truck data from the s3 bucket not just the latest.")
+    parser.add_argument("-w", "--workers", type=int, default=DOWNLOAD_WORKERS,
+        help="-w or --workers the number of files to download at the same time.")
+    parser.add_argument("--stream", action='store_true',
+        help="--stream reads the files from s3 straight into memory instead of truck_data/data.")
+    parser.add_argument("-r", "--rescan", action='store_true',
+        help="-r or --rescan lists every file to find any that have been uploaded again.")
+    parser.add_argument("--lookback_hours", type=float,
+        default=WATERMARK_LOOKBACK / timedelta(hours=1),
+        help="--lookback_hours how many hours before the watermark's key to list from.")
+    parser.add_argument("-c", "--chunk_size", type=int, default=None,
+        help="-c or --chunk_size transforms and loads this many rows at a time.")
+    parser.add_argument("-e", "--engine", choices=CSV_ENGINES, default=CSV_ENGINE,
+        help="-e or --engine the csv parser to use, pyarrow is faster on large backfills.")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+        help="-p or --processes transforms the files in this many processes at the same time.")
+    parser.add_argument("-l", "--load_method", choices=LOAD_METHODS, default=LOAD_METHOD,
+        help="-l or --load_method batch for multi-row inserts, infile for LOAD DATA LOCAL INFILE.")
+    parser.add_argument("-b", "--batch_size", type=int, default=LOAD_BATCH_SIZE,
+        help="-b or --batch_size the number of rows in each batch of inserts.")
+    parser.add_argument("--archive", default=None,
+        help="--archive also writes the cleaned transactions to a parquet archive in this folder.")
+    parser.add_argument("--from_archive", default=None,
+        help="--from_archive loads the transactions from this parquet archive instead of s3.")
+    parser.add_argument("--start", type=date.fromisoformat, default=None,
+        help="--start with --from_archive, the first day to load, eg. 2025-01-01.")
+    parser.add_argument("--end", type=date.fromisoformat, default=None,
+        help="--end with --from_archive, the day after the last day to load.")
+    parser.add_argument("-d", "--daemon", action='store_true',
+        help="-d or --daemon keeps running, loading new files in batches as they land.")
+    parser.add_argument("-f", "--batch_files", type=int, default=None,
+        help=f"-f or --batch_files loads at most this many files per run, "
+             f"with --daemon defaults to {BATCH_FILES}.")
+    parser.add_argument("--min_poll", type=float, default=MIN_POLL_SECONDS,
+        help="--min_poll with --daemon, the seconds between polls while files are arriving.")
+    parser.add_argument("--max_poll", type=float, default=MAX_POLL_SECONDS,
+        help="--max_poll with --daemon, the most seconds between polls while none are.")
+    parser.add_argument("--rescan_hours", type=float, default=RESCAN_HOURS,
+        help="--rescan_hours with --daemon, the hours between rescans of every file, "
+             "0 never rescans.")
+    parser.add_argument("--lease", action='store_true',
+        help="--lease claims each file before loading it, so several workers can run at once.")
+    parser.add_argument("--lease_seconds", type=int, default=LEASE_SECONDS,
+        help="--lease_seconds with --lease, how long a claim lasts if the worker stops.")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+        help="--shard with --lease, only loads the trucks in this shard, eg. 0/4.")
+    parser.add_argument("-m", "--metrics", default=None,
+        help="-m or --metrics appends the run's json metrics record to this file.")
+    parser.add_argument("--profile", default=None,
+        help="--profile profiles the run, saving the stats to this file.")
     args = parser.parse_args()
-    return args.all_files
+    if args.chunk_size and args.engine != "c":
+        parser.error("--chunk_size can only be used with the c engine.")
+    if args.chunk_size and args.processes:
+        parser.error("--chunk_size and --processes can't be used together.")
+    if (args.start or args.end) and not args.from_archive:
+        parser.error("--start and --end can only be used with --from_archive.")
+    if args.daemon and (args.all_files or args.from_archive):
+        parser.error("--daemon can't be used with --all_files or --from_archive.")
+    if args.daemon and not args.batch_files:
+        args.batch_files = BATCH_FILES
+    if args.shard and not args.lease:
+        parser.error("--shard can only be used with --lease.")
+    if args.lease and (args.all_files or args.from_archive):
+        parser.error("--lease can't be used with --all_files or --from_archive, "
+                     "use --rescan to backfill with several workers.")
+    if args.lookback_hours < 0 or args.rescan_hours < 0:
+        parser.error("--lookback_hours and --rescan_hours can't be negative.")
+    args.lookback = timedelta(hours=args.lookback_hours)
+    args.worker_id = get_worker_id() if args.lease else None
+    return args
+
+
+def run(args: Namespace, connection: pymysql.Connection, s3_client=None,
+        payment_mapping: dict | None = None, executor: ProcessPoolExecutor | None = None,
+        rescan: bool = False) -> int:
+    """Extracts the new files from s3, transforms them and loads them into the database.
+    The s3 client, payment mapping and -p process pool are created for the run unless given.
+    rescan lists every file as --rescan does, eg. for the daemon's periodic rescan.
+    With --lease only the files this worker claims are loaded, downloaded to a
+    folder of the worker's own. Returns the number of files extracted."""
+    data_folder = get_data_folder(args.worker_id)
+    rescan = args.rescan or rescan
+    claim = partial(claim_files, connection, args.worker_id, lease_seconds=args.lease_seconds,
+                    shard=args.shard) if args.lease else None
+
+    # Extract
+    if args.stream:
+        # Files are only read as transform asks for them, so extract and transform overlap
+        s3_objects, files_for_transform, file_stream = extract_stream(
+            args.all_files, connection, args.workers, rescan, s3_client, args.batch_files,
+            claim, args.lookback)
+        source = file_stream
+    else:
+        extracted_objects, listed_objects = extract_main(
+            args.all_files, connection, args.workers, rescan, s3_client, args.batch_files,
+            claim, data_folder, args.lookback)
+        s3_objects = extracted_objects
+        files_for_transform = [obj["Key"] for obj in extracted_objects]
+        source = None
+        print("Extracted")
+
+    # Transform
+    read_files = []
+    if args.chunk_size:
+        trucks_dfs = transform_chunks(args.chunk_size, source, payment_mapping, read_files,
+                                      data_folder)
+    else:
+        if args.processes:
+            trucks_df = transform_parallel(args.processes, source, args.engine, payment_mapping,
+                                           read_files, executor, data_folder)
+        else:
+            trucks_df = transform_main(source, args.engine, payment_mapping, read_files,
+                                       data_folder)
+        trucks_dfs = [trucks_df] if trucks_df is not None else []
+
+    # Load, each DataFrame is loaded in one transaction along with the files it came from
+    objects_by_key = {obj["Key"]: obj for obj in s3_objects}
+    loaded = False
+    loaded_ids = set()
+    archived_files = set()
+    for trucks_df in trucks_dfs:
+        if not loaded:
+            print("Transformed")
+            loaded = True
+        if args.lease:
+            renew_leases(connection, args.worker_id, args.lease_seconds)
+        if args.archive:
+            # Archived before loading, as load replaces the filename column with its id
+            write_archive(trucks_df, objects_by_key, args.archive, archived_files)
+        load(connection, trucks_df, objects_by_key, loaded_ids, args.load_method,
+             args.batch_size, confirmed=not args.chunk_size)
+
+    # Only the files transform read are confirmed, and the watermark stops before any that
+    # weren't, eg. a file missing from the data folder is extracted again by the next run
+    read_set = set(read_files)
+    extracted_objects = [obj for obj in s3_objects if obj["Key"] in read_set]
+    listed_objects = get_watermark_objects(
+        s3_objects if args.stream else listed_objects, files_for_transform, read_files)
+
+    # Confirms files loaded in chunks, and records files that had no clean rows,
+    # replacing any transactions loaded from an earlier version of them
+    cursor = connection.cursor()
+    replace_unloaded_files(cursor, read_files, loaded_ids)
+    record_uploaded_files(cursor, extracted_objects)
+    connection.commit()
+    cursor.close()
+    update_watermark(connection, listed_objects)
+    if args.lease:
+        release_files(connection, args.worker_id)
+
+    if loaded:
+        print("Loaded")
+    else:
+        print("No new files")
+
+    # Deletes the csvs to save space, along with a worker's own folder
+    if (loaded or args.lease) and path.isdir(data_folder):
+        rmtree(data_folder)
+        if not args.lease:
+            mkdir(data_folder)
+
+    return len(extracted_objects)
 
 
 if __name__ == "__main__":
     # Load environment variables
     load_dotenv()
-    all_files = initialise_args()
+    args = initialise_args()
+    start = perf_counter()
+    profiler = start_profiler() if args.profile else None
     connection = pymysql.connect(host=ENV["DB_HOST"],
         user=ENV["DB_USER"],
         password=ENV["DB_PASSWORD"],
         database=ENV["DB_NAME"],
         charset='utf8mb4',
+        local_infile=args.load_method == "infile",
         cursorclass=pymysql.cursors.DictCursor)
 
-    # Extract
-    extract_main(all_files, connection)
-    print("Extracted")
-
-    # Transform
-    trucks_df = transform_main()
-    if trucks_df is not None:
-        print("Transformed")
-
-        # Load
-        conn = create_engine(f"mysql+pymysql://{ENV["DB_USER"]}:{ENV["DB_PASSWORD"]}@{ENV["DB_HOST"]}:{ENV["DB_PORT"]}/{ENV["DB_NAME"]}")
-        trucks_df.to_sql('Transaction', conn, if_exists='append', index=False)
-        print("Loaded")
+    if args.from_archive:
+        loaded_rows = backfill(connection, args.from_archive, args.start, args.end,
+                               args.load_method, args.batch_size)
+        print(f"Loaded {loaded_rows} rows from the archive")
+    elif args.daemon:
+        # The s3 client, connection, payment mapping and process pool stay warm between batches
+        with get_process_pool(args.processes) if args.processes else nullcontext() as executor:
+            run_daemon(partial(run, args, connection, get_s3_client(),
+                               get_payment_mapping(connection), executor),
+                       connection, args.batch_files, args.min_poll, args.max_poll, args.metrics,
+                       args.rescan_hours * 3600,
+                       stream=args.stream, chunk_size=args.chunk_size,
+                       processes=args.processes, engine=args.engine,
+                       load_method=args.load_method)
+    else:
+        run(args, connection)
 
-        # Deletes the csvs to save space
-        if path.isdir('truck_data/data'):
-            rmtree('truck_data/data')
-            mkdir('truck_data/data')
+    connection.close()
 
-    else:
-        print("No new files")
+    if profiler:
+        stop_profiler(profiler, args.profile)
+    # The daemon emits a record for each batch instead
+    if not args.daemon:
+        emit_metrics(get_metrics_record(
+            total_seconds=round(perf_counter() - start, 4), stream=args.stream,
+            chunk_size=args.chunk_size, processes=args.processes, engine=args.engine,
+            load_method=args.load_method), args.metrics)
@@ -0,0 +1,134 @@
+"""Food trucks data pipeline: rollup.
+Keeps the hourly and daily totals per truck and payment method up to date,
+so the dashboard and report don't have to aggregate every transaction."""
+# Standard library imports
+from argparse import ArgumentParser
+from os import environ as ENV
+
+# Third-party imports
+from dotenv import load_dotenv
+import pandas as pd
+import pymysql
+
+# Local imports
+from extract import REGISTRY_BATCH_SIZE
+
+
+# Table, time bucket column and the SQL to get the bucket of a transaction
+ROLLUPS = {
+    "Transaction_Hourly": ("hour_start", "TIMESTAMP(DATE(at), MAKETIME(HOUR(at), 0, 0))"),
+    "Transaction_Daily": ("day", "DATE(at)")
+}
+
+
+def initialise_args() -> bool:
+    """Gets the cli arguments"""
+    parser = ArgumentParser()
+    parser.add_argument("--rebuild", action='store_true',
+        help="--rebuild recalculates the rollup tables from every transaction.")
+    args = parser.parse_args()
+    return args.rebuild
+
+
+def get_rollup_deltas(trucks_df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """Totals and counts the new transactions by hour and by day, per truck and payment method."""
+    # Totals are stored as FLOAT, so round them the same way to match a rebuild
+    total = trucks_df["total"].astype("float32").astype("float64")
+    buckets = {"Transaction_Hourly": trucks_df["at"].dt.floor("h"),
+               "Transaction_Daily": trucks_df["at"].dt.normalize()}
+    deltas = {}
+    for table, bucket in buckets.items():
+        deltas[table] = total.groupby(
+            [bucket, trucks_df["truck_id"], trucks_df["payment_method_id"]]
+        ).agg(["sum", "count"]).reset_index()
+    return deltas
+
+
+def upsert_rollups(cur: pymysql.cursors.Cursor, trucks_df: pd.DataFrame) -> None:
+    """Adds the new transactions to the rollup tables."""
+    for table, delta in get_rollup_deltas(trucks_df).items():
+        bucket_column, _ = ROLLUPS[table]
+        if table == "Transaction_Daily":
+            delta["at"] = delta["at"].dt.date
+        cur.executemany(f"""
+            INSERT INTO {table}
+                ({bucket_column}, truck_id, payment_method_id, total, transaction_count)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                total = total + VALUES(total),
+                transaction_count = transaction_count + VALUES(transaction_count);
+            """, list(delta.itertuples(index=False, name=None)))
+
+
+def subtract_file_rollups(cur: pymysql.cursors.Cursor, filename_ids: list[int]) -> None:
+    """Takes the transactions loaded from the given files off the rollup tables,
+    before they are deleted to be replaced. Buckets left without transactions are
+    deleted, only looking between the first and last of the files' transactions."""
+    first_at, last_at = None, None
+    for start in range(0, len(filename_ids), REGISTRY_BATCH_SIZE):
+        batch = filename_ids[start:start + REGISTRY_BATCH_SIZE]
+        placeholders = ", ".join(["%s"] * len(batch))
+        cur.execute(f"""SELECT MIN(at) AS first_at, MAX(at) AS last_at FROM Transaction
+            WHERE filename_id IN ({placeholders});""", batch)
+        span = cur.fetchone()
+        if span["first_at"] is not None:
+            first_at = min(first_at or span["first_at"], span["first_at"])
+            last_at = max(last_at or span["last_at"], span["last_at"])
+        for table, (bucket_column, bucket_sql) in ROLLUPS.items():
+            cur.execute(f"""
+                INSERT INTO {table}
+                    ({bucket_column}, truck_id, payment_method_id, total, transaction_count)
+                SELECT {bucket_sql} AS bucket, truck_id, payment_method_id,
+                    -SUM(total), -COUNT(*)
+                FROM Transaction
+                WHERE filename_id IN ({placeholders})
+                GROUP BY bucket, truck_id, payment_method_id
+                ON DUPLICATE KEY UPDATE
+                    total = total + VALUES(total),
+                    transaction_count = transaction_count + VALUES(transaction_count);
+                """, batch)
+    if first_at is not None:
+        for table, (bucket_column, _) in ROLLUPS.items():
+            cur.execute(f"""DELETE FROM {table}
+                WHERE {bucket_column} >= %s AND {bucket_column} <= %s
+                AND transaction_count = 0;""", (first_at.date(), last_at))
+
+
+def rebuild_rollups(conn: pymysql.Connection) -> None:
+    """Recalculates the rollup tables from every transaction."""
+    cur = conn.cursor()
+    try:
+        for table, (bucket_column, bucket_sql) in ROLLUPS.items():
+            cur.execute(f"DELETE FROM {table};")
+            cur.execute(f"""
+                INSERT INTO {table}
+                    ({bucket_column}, truck_id, payment_method_id, total, transaction_count)
+                SELECT {bucket_sql} AS bucket, truck_id, payment_method_id,
+                    SUM(total), COUNT(*)
+                FROM Transaction
+                GROUP BY bucket, truck_id, payment_method_id;
+                """)
+        # So the dashboard's cached results are cleared
+        cur.execute("""UPDATE transaction_deletes SET load_version = load_version + 1
+            WHERE delete_id = 1;""")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    rebuild = initialise_args()
+    if rebuild:
+        connection = pymysql.connect(host=ENV["DB_HOST"],
+            user=ENV["DB_USER"],
+            password=ENV["DB_PASSWORD"],
+            database=ENV["DB_NAME"],
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor)
+        rebuild_rollups(connection)
+        connection.close()
+        print("Rebuilt rollups")
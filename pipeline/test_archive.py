@@ -0,0 +1,118 @@
+"""Testing archive.py functions"""
+# Native imports
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+# Third-party imports
+import pandas as pd
+
+# Local imports
+from archive import write_archive, read_archive, list_archive, backfill
+
+
+def make_trucks_df() -> pd.DataFrame:
+    """Creates a cleaned truck DataFrame over two days."""
+    return pd.DataFrame({
+        "at": pd.to_datetime(["2025-01-01 12:00:00", "2025-01-01 12:05:00",
+                              "2025-01-02 09:00:00", "2025-01-01 13:00:00"]),
+        "payment_method_id": [2, 1, 2, 1],
+        "total": [3.5, 4.5, 12.34, 6.0],
+        "truck_id": pd.Series([1, 1, 1, 2], dtype="int16"),
+        "filename": pd.Categorical(["trucks/a_T1_1.csv", "trucks/a_T1_1.csv",
+                                    "trucks/a_T1_1.csv", "trucks/a_T2_1.csv"])
+    })
+
+
+S3_OBJECTS = {
+    "trucks/a_T1_1.csv": {"Key": "trucks/a_T1_1.csv", "ETag": '"abc"', "Size": 10},
+    "trucks/a_T2_1.csv": {"Key": "trucks/a_T2_1.csv", "ETag": '"def"', "Size": 20}
+}
+
+
+def test_write_archive_writes_a_file_per_partition(tmp_path):
+    write_archive(make_trucks_df(), S3_OBJECTS, str(tmp_path))
+
+    assert len(list(tmp_path.glob("date=2025-01-01/truck_id=1/*.parquet"))) == 1
+    assert len(list(tmp_path.glob("date=2025-01-02/truck_id=1/*.parquet"))) == 1
+    assert len(list(tmp_path.glob("date=2025-01-01/truck_id=2/*.parquet"))) == 1
+    archived = sorted(list_archive(str(tmp_path)), key=lambda obj: (obj["day"], obj["truck_id"]))
+    assert archived[0] == {"day": date(2025, 1, 1), "truck_id": 1, "Key": "trucks/a_T1_1.csv",
+                           "ETag": "abc", "Size": 10}
+
+
+def test_write_archive_puts_source_files_in_the_same_partition_together(tmp_path):
+    trucks_df = make_trucks_df()
+    trucks_df["filename"] = pd.Categorical(["trucks/a_T1_1.csv", "trucks/b_T1_1.csv",
+                                            "trucks/a_T1_1.csv", "trucks/a_T2_1.csv"])
+    s3_objects = {**S3_OBJECTS, "trucks/b_T1_1.csv": {
+        "Key": "trucks/b_T1_1.csv", "ETag": '"ghi"', "Size": 30}}
+    write_archive(trucks_df, s3_objects, str(tmp_path))
+
+    assert len(list(tmp_path.glob("date=2025-01-01/truck_id=1/*.parquet"))) == 1
+    assert sorted(obj["Key"] for obj in list_archive(str(tmp_path))) == [
+        "trucks/a_T1_1.csv", "trucks/a_T1_1.csv", "trucks/a_T2_1.csv", "trucks/b_T1_1.csv"]
+
+
+def test_read_archive_matches_transform_types(tmp_path):
+    write_archive(make_trucks_df(), S3_OBJECTS, str(tmp_path))
+
+    trucks_df = read_archive(str(tmp_path)).sort_values("at", ignore_index=True)
+
+    assert list(trucks_df.columns) == ["at", "payment_method_id", "total", "truck_id", "filename"]
+    assert trucks_df["payment_method_id"].dtype == "int64"
+    assert trucks_df["truck_id"].dtype == "int16"
+    assert isinstance(trucks_df["filename"].dtype, pd.CategoricalDtype)
+    assert trucks_df["total"].tolist() == [3.5, 4.5, 6.0, 12.34]
+
+
+def test_read_archive_filters_partitions(tmp_path):
+    write_archive(make_trucks_df(), S3_OBJECTS, str(tmp_path))
+
+    trucks_df = read_archive(str(tmp_path), date(2025, 1, 1), date(2025, 1, 2), truck_ids=[1])
+
+    assert sorted(trucks_df["total"].tolist()) == [3.5, 4.5]
+
+
+def test_write_archive_replaces_file_unless_written_this_run(tmp_path):
+    write_archive(make_trucks_df(), S3_OBJECTS, str(tmp_path))
+    write_archive(make_trucks_df(), S3_OBJECTS, str(tmp_path))
+    assert len(read_archive(str(tmp_path))) == 4
+    assert len(list(tmp_path.glob("**/*.parquet"))) == 3
+
+    written = set()
+    write_archive(make_trucks_df(), S3_OBJECTS, str(tmp_path), written)
+    write_archive(make_trucks_df(), S3_OBJECTS, str(tmp_path), written)
+    assert len(read_archive(str(tmp_path))) == 8
+
+
+def test_write_archive_removes_days_no_longer_in_a_replaced_file(tmp_path):
+    write_archive(make_trucks_df(), S3_OBJECTS, str(tmp_path))
+    # a_T1_1 is uploaded again without its transaction on the 2nd
+    trucks_df = make_trucks_df().iloc[[0, 1]]
+    s3_objects = {**S3_OBJECTS, "trucks/a_T1_1.csv": {
+        "Key": "trucks/a_T1_1.csv", "ETag": '"new"', "Size": 11}}
+    write_archive(trucks_df, s3_objects, str(tmp_path))
+
+    trucks_df = read_archive(str(tmp_path))
+    assert sorted(trucks_df["total"].tolist()) == [3.5, 4.5, 6.0]
+    assert not list(tmp_path.glob("date=2025-01-02/truck_id=1/*.parquet"))
+    archived = {(obj["Key"], obj["day"], obj["ETag"]) for obj in list_archive(str(tmp_path))}
+    assert archived == {("trucks/a_T1_1.csv", date(2025, 1, 1), "new"),
+                        ("trucks/a_T2_1.csv", date(2025, 1, 1), "def")}
+
+
+def test_backfill_loads_whole_files_a_day_at_a_time(tmp_path):
+    write_archive(make_trucks_df(), S3_OBJECTS, str(tmp_path))
+    conn = MagicMock()
+
+    with patch("archive.load") as mock_load, \
+            patch("archive.record_uploaded_files") as mock_record:
+        rows = backfill(conn, str(tmp_path), start=date(2025, 1, 2), end=date(2025, 1, 3))
+
+    # Only a_T1_1 has transactions on the 2nd, but all of its days are loaded
+    assert rows == 3
+    assert mock_load.call_count == 2
+    assert all(call.kwargs["confirmed"] is False for call in mock_load.call_args_list)
+    recorded = mock_record.call_args.args[1]
+    assert [obj["Key"] for obj in recorded] == ["trucks/a_T1_1.csv"]
+    conn.commit.assert_called_once()
@@ -0,0 +1,78 @@
+"""Testing daemon.py functions"""
+# Native imports
+from unittest.mock import MagicMock, patch
+
+# Third-party imports
+import pymysql
+
+# Local imports
+from daemon import get_poll_interval, run_daemon, STOP
+
+
+def test_get_poll_interval_adapts_to_arriving_files():
+    assert get_poll_interval(5, files=10, batch_files=10) == 0
+    assert get_poll_interval(80, files=3, batch_files=10) == 5
+    assert get_poll_interval(5, files=0, batch_files=10) == 10
+    assert get_poll_interval(200, files=0, batch_files=10) == 300
+    assert get_poll_interval(0, files=0, batch_files=10) == 10
+
+
+def make_run_batch(results: list) -> MagicMock:
+    """Creates a batch that gives each result in turn, then asks the daemon to stop."""
+    def run_batch(rescan=False):
+        result = results.pop(0)
+        if not results:
+            STOP.set()
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return MagicMock(side_effect=run_batch)
+
+
+@patch('daemon.emit_metrics')
+def test_run_daemon_runs_batches_until_stopped(mock_emit):
+    conn = MagicMock()
+    run_batch = make_run_batch([2, 0, 3])
+
+    batches = run_daemon(run_batch, conn, batch_files=10, min_seconds=0, max_seconds=0)
+
+    assert batches == 2
+    assert run_batch.call_count == 3
+    assert mock_emit.call_count == 2
+    assert mock_emit.call_args.args[0]["files"] == 3
+    conn.ping.assert_called_with(reconnect=True)
+
+
+@patch('daemon.emit_metrics')
+def test_run_daemon_retries_after_dropped_connection(mock_emit):
+    run_batch = make_run_batch([pymysql.err.OperationalError(2013, "Lost connection"), 1])
+
+    batches = run_daemon(run_batch, MagicMock(), batch_files=10, min_seconds=0, max_seconds=0)
+
+    assert batches == 1
+    assert run_batch.call_count == 2
+
+
+@patch('daemon.perf_counter')
+@patch('daemon.emit_metrics')
+def test_run_daemon_rescans_periodically_until_a_batch_is_not_full(mock_emit, mock_clock):
+    # The rescan carries on while its batches are full, then waits rescan_seconds
+    mock_clock.side_effect = [0, 0, 0, 1, 1, 50, 60, 101, 101, 102, 102]
+    run_batch = make_run_batch([10, 3, 0, 0, 2, 1])
+
+    run_daemon(run_batch, MagicMock(), batch_files=10, min_seconds=0, max_seconds=0,
+               rescan_seconds=100)
+
+    assert [call.kwargs["rescan"] for call in run_batch.call_args_list] == [
+        True, True, False, False, True, False]
+    assert mock_emit.call_args.args[0]["rescan"] is False
+
+
+@patch('daemon.emit_metrics')
+def test_run_daemon_never_rescans_without_rescan_seconds(mock_emit):
+    run_batch = make_run_batch([1, 0])
+
+    run_daemon(run_batch, MagicMock(), batch_files=10, min_seconds=0, max_seconds=0,
+               rescan_seconds=0)
+
+    assert [call.kwargs["rescan"] for call in run_batch.call_args_list] == [False, False]
@@ -0,0 +1,40 @@
+"""Testing db.py functions"""
+# Native imports
+from unittest.mock import MagicMock
+
+# Third-party imports
+import pymysql
+
+# Local imports
+from db import stream_rows, read_frame
+
+
+def make_connection(batches: list[list[tuple]], columns: list[str]) -> MagicMock:
+    """Creates a mock connection whose cursor returns the given batches."""
+    conn = MagicMock()
+    cur = conn.cursor.return_value
+    cur.fetchmany.side_effect = batches + [[]]
+    cur.description = [(column,) for column in columns]
+    return conn
+
+
+def test_stream_rows_uses_an_unbuffered_cursor():
+    conn = make_connection([[("cash", 1)], [("card", 2)]], ["payment_method", "id"])
+    assert list(stream_rows(conn, "SELECT 1;", batch_size=1)) == [[("cash", 1)], [("card", 2)]]
+    conn.cursor.assert_called_with(pymysql.cursors.SSCursor)
+    conn.cursor.return_value.close.assert_called_once()
+
+
+def test_read_frame_builds_typed_columns_from_batches():
+    conn = make_connection([[(1, 2.5), (2, 3.0)], [(1, 4.0)]], ["truck_id", "total"])
+    df = read_frame(conn, "SELECT 1;", dtypes={"truck_id": "int16", "total": "float64"})
+    assert df["truck_id"].tolist() == [1, 2, 1]
+    assert df["total"].tolist() == [2.5, 3.0, 4.0]
+    assert str(df["truck_id"].dtype) == "int16"
+
+
+def test_read_frame_without_rows():
+    conn = make_connection([], ["truck_id", "total"])
+    df = read_frame(conn, "SELECT 1;", dtypes={"truck_id": "int16", "total": "float64"})
+    assert list(df.columns) == ["truck_id", "total"]
+    assert df.empty
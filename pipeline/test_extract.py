@@ -0,0 +1,196 @@
+"""Testing extract.py functions"""
+# Native imports
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+# Third-party imports
+from botocore.exceptions import ClientError
+
+# Local imports
+from extract import (list_s3_objects, get_s3_files, download_file, download_truck_data_files,
+                     stream_truck_data_files, get_watermark_objects, get_files_for_transform,
+                     find_new_files, extract, is_after_watermark)
+
+
+def make_s3_client(pages: list[dict]) -> MagicMock:
+    """Creates a mock s3 client that returns the given pages."""
+    s3_client = MagicMock()
+    s3_client.get_paginator.return_value.paginate.return_value = pages
+    return s3_client
+
+
+@patch.dict('extract.ENV', {"BUCKET": "bucket"})
+def test_list_s3_objects_reads_every_page():
+    s3_client = make_s3_client([
+        {"Contents": [{"Key": "trucks/a_T1_1.csv"}, {"Key": "trucks/a_T2_1.csv"}]},
+        {"Contents": [{"Key": "trucks/b_T1_2.csv"}]},
+        {}
+    ])
+    assert get_s3_files(s3_client) == ["trucks/a_T1_1.csv", "trucks/a_T2_1.csv",
+                                       "trucks/b_T1_2.csv"]
+    s3_client.get_paginator.assert_called_with("list_objects_v2")
+    s3_client.get_paginator.return_value.paginate.assert_called_with(
+        Bucket="bucket", Prefix="trucks/")
+
+
+@patch.dict('extract.ENV', {"BUCKET": "bucket"})
+def test_list_s3_objects_starts_after_watermark():
+    s3_client = make_s3_client([{"Contents": [{"Key": "trucks/b_T1_2.csv"}]}])
+    watermark = {"last_key": "trucks/a_T2_1.csv", "last_modified": datetime(2025, 1, 1)}
+    assert list_s3_objects(s3_client, watermark) == [{"Key": "trucks/b_T1_2.csv"}]
+    s3_client.get_paginator.return_value.paginate.assert_called_with(
+        Bucket="bucket", Prefix="trucks/", StartAfter="trucks/a_T2_1.csv")
+
+
+@patch.dict('extract.ENV', {"BUCKET": "bucket"})
+def test_list_s3_objects_finds_late_lower_keys():
+    loaded_at = datetime(2025, 1, 1, 9, 30, tzinfo=timezone.utc)
+    late_at = datetime(2025, 1, 1, 9, 45, tzinfo=timezone.utc)
+    s3_client = make_s3_client([{"Contents": [
+        {"Key": "trucks/2025-01-01/08/truck_T1_2025010108.csv", "LastModified": loaded_at},
+        {"Key": "trucks/2025-01-01/09/truck_T1_2025010109.csv", "LastModified": late_at},
+        {"Key": "trucks/2025-01-01/09/truck_T3_2025010109.csv", "LastModified": loaded_at}]}])
+    # The T3 file was loaded before the T1 file for the same hour landed
+    watermark = {"last_key": "trucks/2025-01-01/09/truck_T3_2025010109.csv",
+                 "last_modified": datetime(2025, 1, 1, 9, 30)}
+
+    assert get_s3_files(s3_client, watermark) == [
+        "trucks/2025-01-01/08/truck_T1_2025010108.csv",
+        "trucks/2025-01-01/09/truck_T1_2025010109.csv",
+        "trucks/2025-01-01/09/truck_T3_2025010109.csv"]
+    s3_client.get_paginator.return_value.paginate.assert_called_with(
+        Bucket="bucket", Prefix="trucks/", StartAfter="trucks/2025-01-01/08/")
+
+
+@patch.dict('extract.ENV', {"BUCKET": "bucket"})
+def test_list_s3_objects_starts_the_lookback_before_the_watermark():
+    s3_client = make_s3_client([{}])
+    watermark = {"last_key": "trucks/2025-01-02/03/truck_T3_2025010203.csv",
+                 "last_modified": datetime(2025, 1, 2, 3, 30)}
+
+    list_s3_objects(s3_client, watermark, lookback=timedelta(hours=6))
+
+    s3_client.get_paginator.return_value.paginate.assert_called_with(
+        Bucket="bucket", Prefix="trucks/", StartAfter="trucks/2025-01-01/21/")
+
+
+def test_is_after_watermark_drops_older_objects():
+    watermark = {"last_key": "trucks/2025-01-01/09/truck_T3_2025010109.csv",
+                 "last_modified": datetime(2025, 1, 1, 9, 30)}
+    old_object = {"Key": "trucks/2025-01-01/08/truck_T1_2025010108.csv",
+                  "LastModified": datetime(2025, 1, 1, 8, 30, tzinfo=timezone.utc)}
+    assert not is_after_watermark(old_object, watermark)
+
+
+@patch('extract.sleep')
+@patch.dict('extract.ENV', {"BUCKET": "bucket"})
+def test_download_file_retries_then_succeeds(mock_sleep):
+    s3_client = MagicMock()
+    s3_client.download_file.side_effect = [ClientError({}, "GetObject"), None]
+    assert download_file(s3_client, "trucks/a_T1_1.csv")
+    assert s3_client.download_file.call_count == 2
+    mock_sleep.assert_called_once()
+
+
+@patch('extract.makedirs')
+@patch('extract.sleep')
+@patch.dict('extract.ENV', {"BUCKET": "bucket"})
+def test_download_truck_data_files_returns_only_downloaded(mock_sleep, mock_makedirs):
+    s3_client = MagicMock()
+
+    def download(bucket, key, filename):
+        if "T2" in key:
+            raise ClientError({}, "GetObject")
+    s3_client.download_file.side_effect = download
+    files = ["trucks/a_T1_1.csv", "trucks/a_T2_1.csv", "trucks/a_T3_1.csv"]
+
+    downloaded = download_truck_data_files(s3_client, files, workers=2)
+
+    assert downloaded == ["trucks/a_T1_1.csv", "trucks/a_T3_1.csv"]
+    s3_client.download_file.assert_any_call("bucket", "trucks/a_T1_1.csv",
+                                            "truck_data/data/trucks/a_T1_1.csv")
+
+
+def test_get_files_for_transform_finds_new_and_changed():
+    uploaded_files = {"trucks/a_T1_1.csv": ("abc", 10), "trucks/a_T2_1.csv": ("def", 20)}
+    s3_objects = [
+        {"Key": "trucks/a_T1_1.csv", "ETag": '"abc"', "Size": 10},
+        {"Key": "trucks/a_T2_1.csv", "ETag": '"xyz"', "Size": 25},
+        {"Key": "trucks/a_T3_1.csv", "ETag": '"ghi"', "Size": 30}
+    ]
+    assert get_files_for_transform(uploaded_files, s3_objects) == [
+        "trucks/a_T2_1.csv", "trucks/a_T3_1.csv"]
+
+
+def test_get_files_for_transform_leaves_legacy_files():
+    uploaded_files = {"trucks/a_T1_1.csv": ("legacy", None), "trucks/a_T2_1.csv": (None, None)}
+    s3_objects = [{"Key": "trucks/a_T1_1.csv", "ETag": '"abc"', "Size": 10},
+                  {"Key": "trucks/a_T2_1.csv", "ETag": '"def"', "Size": 20}]
+    assert get_files_for_transform(uploaded_files, s3_objects) == ["trucks/a_T2_1.csv"]
+
+
+@patch('extract.sleep')
+@patch.dict('extract.ENV', {"BUCKET": "bucket"})
+def test_stream_truck_data_files_skips_failed(mock_sleep):
+    s3_client = MagicMock()
+
+    def get_object(Bucket, Key):
+        if "T2" in Key:
+            raise ClientError({}, "GetObject")
+        body = MagicMock()
+        body.read.return_value = Key.encode()
+        return {"Body": body}
+    s3_client.get_object.side_effect = get_object
+    files = ["trucks/a_T1_1.csv", "trucks/a_T2_1.csv"]
+
+    assert list(stream_truck_data_files(s3_client, files)) == [
+        ("trucks/a_T1_1.csv", b"trucks/a_T1_1.csv")]
+
+
+@patch('extract.fetch_file')
+def test_stream_truck_data_files_bounds_files_in_flight(mock_fetch):
+    mock_fetch.side_effect = lambda s3_client, file: file.encode()
+    files = [f"trucks/{n}" for n in range(50)]
+
+    streamed = 0
+    for _ in stream_truck_data_files(MagicMock(), files, workers=2):
+        streamed += 1
+        # Only the files in flight, at most twice the workers, have been fetched
+        assert mock_fetch.call_count <= streamed + 4
+    assert streamed == 50
+
+
+def test_get_watermark_objects_stops_before_first_failure():
+    s3_objects = [{"Key": "trucks/a"}, {"Key": "trucks/b"}, {"Key": "trucks/c"}]
+    files = ["trucks/b", "trucks/c"]
+    assert get_watermark_objects(s3_objects, files, ["trucks/b", "trucks/c"]) == s3_objects
+    assert get_watermark_objects(s3_objects, files, ["trucks/c"]) == [{"Key": "trucks/a"}]
+
+
+@patch('extract.get_uploaded_files', return_value={"trucks/a": ("abc", 1)})
+@patch('extract.get_watermark', return_value=None)
+@patch.dict('extract.ENV', {"BUCKET": "bucket"})
+def test_find_new_files_stops_at_max_files(mock_watermark, mock_uploaded):
+    s3_client = make_s3_client([{"Contents": [
+        {"Key": f"trucks/{key}", "ETag": '"abc"', "Size": 1} for key in "abcd"]}])
+
+    s3_objects, files = find_new_files(s3_client, False, MagicMock(), max_files=2)
+
+    assert files == ["trucks/b", "trucks/c"]
+    # The watermark can't move past files that weren't taken
+    assert [obj["Key"] for obj in s3_objects] == ["trucks/a", "trucks/b", "trucks/c"]
+
+
+@patch('extract.download_truck_data_files', side_effect=lambda s3, files, workers, data_folder: files)
+@patch('extract.initialise_folders')
+@patch('extract.find_new_files')
+def test_extract_only_downloads_claimed_files(mock_find, mock_folders, mock_download):
+    s3_objects = [{"Key": f"trucks/{key}", "Size": 1} for key in "abc"]
+    mock_find.return_value = (s3_objects, ["trucks/a", "trucks/b", "trucks/c"])
+
+    downloaded, listed = extract(False, MagicMock(), s3_client=MagicMock(),
+                                 claim=lambda objects, files: ["trucks/a", "trucks/c"])
+
+    assert [obj["Key"] for obj in downloaded] == ["trucks/a", "trucks/c"]
+    # The watermark stops before the file left to another worker
+    assert listed == [{"Key": "trucks/a", "Size": 1}]
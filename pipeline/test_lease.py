@@ -0,0 +1,62 @@
+"""Testing lease.py functions"""
+# Native imports
+from unittest.mock import MagicMock, patch
+
+# Third-party imports
+import pytest
+
+# Local imports
+from lease import parse_shard, filter_shard, claim_files, release_files
+
+
+FILES = ["trucks/2025-01-01/09/truck_T1_2025010109.csv",
+         "trucks/2025-01-01/09/truck_T2_2025010109.csv",
+         "trucks/2025-01-01/09/truck_T3_2025010109.csv"]
+S3_OBJECTS = [{"Key": file, "ETag": '"abc"', "Size": 10} for file in FILES]
+
+
+def test_parse_shard():
+    assert parse_shard("1/4") == (1, 4)
+    with pytest.raises(ValueError):
+        parse_shard("4/4")
+
+
+def test_filter_shard_splits_by_truck():
+    assert filter_shard(FILES, (1, 2)) == [FILES[0], FILES[2]]
+    assert filter_shard(FILES, (0, 2)) == [FILES[1]]
+
+
+@patch('lease.get_uploaded_files', return_value={})
+@patch('lease.stream_rows')
+def test_claim_files_returns_only_leased_files(mock_stream_rows, mock_uploaded):
+    conn = MagicMock()
+    # Another worker holds the lease on the T2 file
+    mock_stream_rows.return_value = [[(FILES[0],), (FILES[2],)]]
+
+    claimed = claim_files(conn, "worker-1", S3_OBJECTS, FILES, lease_seconds=60)
+
+    assert claimed == [FILES[0], FILES[2]]
+    cur = conn.cursor.return_value
+    assert cur.executemany.call_args.args[1] == [(file, "worker-1", 60) for file in FILES]
+    conn.commit.assert_called_once()
+    mock_stream_rows.assert_called_once()
+    assert mock_stream_rows.call_args.args[2] == ("worker-1",)
+
+
+@patch('lease.get_uploaded_files', return_value={FILES[0]: ("abc", 10)})
+@patch('lease.stream_rows', return_value=[[(FILES[0],), (FILES[2],)]])
+def test_claim_files_skips_files_loaded_since_listing(mock_stream_rows, mock_uploaded):
+    claimed = claim_files(MagicMock(), "worker-1", S3_OBJECTS, FILES, shard=(1, 2))
+
+    assert claimed == [FILES[2]]
+    assert mock_uploaded.call_args.args[1] == [FILES[0], FILES[2]]
+
+
+def test_release_files_deletes_workers_leases():
+    conn = MagicMock()
+
+    release_files(conn, "worker-1")
+
+    cur = conn.cursor.return_value
+    assert cur.execute.call_args.args[1] == ("worker-1",)
+    conn.commit.assert_called_once()
@@ -0,0 +1,91 @@
+"""Testing load.py functions"""
+# Native imports
+from unittest.mock import MagicMock
+
+# Third-party imports
+import pandas as pd
+import pytest
+
+# Local imports
+from load import insert_batches, load, record_uploaded_files
+
+
+def make_trucks_df() -> pd.DataFrame:
+    """Creates a cleaned truck DataFrame."""
+    return pd.DataFrame({
+        "at": pd.to_datetime(["2025-01-01 12:00:00", "2025-01-01 12:05:00",
+                              "2025-01-01 12:10:00"]),
+        "payment_method_id": [2, 1, 2],
+        "total": [3.5, 4.5, 12.34],
+        "truck_id": pd.Series([1, 1, 2], dtype="int16"),
+        "filename": pd.Categorical(["trucks/a_T1_1.csv", "trucks/a_T1_1.csv",
+                                    "trucks/a_T2_1.csv"])
+    })
+
+
+S3_OBJECTS = {
+    "trucks/a_T1_1.csv": {"Key": "trucks/a_T1_1.csv", "ETag": '"abc"', "Size": 10},
+    "trucks/a_T2_1.csv": {"Key": "trucks/a_T2_1.csv", "ETag": '"def"', "Size": 20}
+}
+
+
+def test_insert_batches_splits_rows():
+    cur = MagicMock()
+    trucks_df = make_trucks_df()
+    trucks_df["filename_id"] = trucks_df.pop("filename").map(
+        {"trucks/a_T1_1.csv": 7, "trucks/a_T2_1.csv": 8}).astype("int64")
+
+    insert_batches(cur, trucks_df, batch_size=2)
+
+    assert cur.executemany.call_count == 2
+    first_batch = cur.executemany.call_args_list[0][0][1]
+    assert first_batch[0][:3] == (1, 2, 3.5)
+    assert first_batch[0][4] == 7
+    assert len(cur.executemany.call_args_list[1][0][1]) == 1
+
+
+def test_record_uploaded_files_unconfirmed_has_no_etag():
+    cur = MagicMock()
+    record_uploaded_files(cur, list(S3_OBJECTS.values()), confirmed=False)
+    assert cur.executemany.call_args[0][1] == [("trucks/a_T1_1.csv", None, None),
+                                               ("trucks/a_T2_1.csv", None, None)]
+
+
+def test_load_commits_rows_and_files_together():
+    conn = MagicMock()
+    cur = conn.cursor.return_value
+    cur.fetchall.return_value = [{"filename": "trucks/a_T1_1.csv", "filename_id": 7},
+                                 {"filename": "trucks/a_T2_1.csv", "filename_id": 8}]
+    cur.fetchone.return_value = {"first_at": None, "last_at": None, "first_id": 101}
+    replaced_ids = {8}
+
+    load(conn, make_trucks_df(), S3_OBJECTS, replaced_ids)
+
+    deletes = [call for call in cur.execute.call_args_list
+               if "DELETE FROM Transaction WHERE" in call[0][0]]
+    assert [call[0][1] for call in deletes] == [[7]]
+    assert any("UPDATE transaction_deletes" in call[0][0] for call in cur.execute.call_args_list)
+    # The load logs its first id before committing, for the dashboard's snapshot
+    statements = [call[0] for call in cur.execute.call_args_list]
+    assert statements[-1][1] == (101,)
+    assert "INSERT INTO transaction_load" in statements[-1][0]
+    conn.commit.assert_called_once()
+    conn.rollback.assert_not_called()
+    assert replaced_ids == {7, 8}
+
+
+def test_load_rolls_back_on_error():
+    conn = MagicMock()
+    cur = conn.cursor.return_value
+    cur.fetchall.return_value = [{"filename": "trucks/a_T1_1.csv", "filename_id": 7},
+                                 {"filename": "trucks/a_T2_1.csv", "filename_id": 8}]
+    cur.executemany.side_effect = [None, Exception("Lost connection")]
+    replaced_ids = set()
+
+    with pytest.raises(Exception):
+        load(conn, make_trucks_df(), S3_OBJECTS, replaced_ids)
+
+    conn.rollback.assert_called_once()
+    conn.commit.assert_not_called()
+    assert not replaced_ids
+
@@ -0,0 +1,35 @@
+"""Testing metrics.py functions"""
+# Native imports
+from json import loads
+
+# Local imports
+from metrics import reset_metrics, add_count, timed, get_metrics_record, emit_metrics
+
+
+def test_metrics_record_adds_up_stages_and_counts(capsys):
+    reset_metrics()
+    with timed("parse"):
+        add_count("rows_in", 5)
+    with timed("parse"):
+        add_count("rows_in", 3)
+
+    record = get_metrics_record(engine="c")
+    emit_metrics(record)
+
+    assert loads(capsys.readouterr().out) == record
+    assert record["engine"] == "c"
+    assert record["counts"] == {"rows_in": 8}
+    assert list(record["seconds"]) == ["parse"]
+    assert record["peak_rss_bytes"] > 0
+
+
+def test_timed_as_a_decorator():
+    reset_metrics()
+
+    @timed("clean")
+    def clean():
+        return "cleaned"
+
+    assert clean() == "cleaned"
+    assert clean() == "cleaned"
+    assert "clean" in get_metrics_record()["seconds"]
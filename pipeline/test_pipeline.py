@@ -0,0 +1,139 @@
+"""Testing pipeline.py functions"""
+# Native imports
+from argparse import Namespace
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+# Local imports
+from pipeline import run
+
+
+PAYMENT_MAPPING = {"cash": 1, "card": 2}
+CSV = b"timestamp,type,total\n2025-01-01 09:00:00,card,3.5\n"
+
+
+def make_args(**kwargs) -> Namespace:
+    """Creates the cli arguments for a default run."""
+    args = {"all_files": False, "workers": 1, "stream": False, "rescan": False,
+            "chunk_size": None, "engine": "c", "processes": None, "load_method": "batch",
+            "batch_size": 5000, "archive": None, "batch_files": None, "lease": False,
+            "lease_seconds": 600, "shard": None, "worker_id": None,
+            "lookback": timedelta(hours=1)}
+    args.update(kwargs)
+    return Namespace(**args)
+
+
+def make_s3_object(key: str) -> dict:
+    """Creates a listed s3 object."""
+    return {"Key": key, "ETag": '"abc"', "Size": len(CSV), "LastModified": datetime(2025, 1, 1)}
+
+
+@patch('pipeline.update_watermark')
+@patch('pipeline.record_uploaded_files')
+@patch('pipeline.load')
+@patch('pipeline.extract_main')
+def test_run_only_confirms_files_transform_read(mock_extract, mock_load, mock_record,
+                                                mock_watermark, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    keys = ["trucks/2025-01-01/09/truck_T1_2025010109.csv",
+            "trucks/2025-01-01/09/truck_T2_2025010109.csv"]
+    s3_objects = [make_s3_object(key) for key in keys]
+    mock_extract.return_value = (s3_objects, s3_objects)
+    # Only the first file is in the data folder when transform reads it
+    (tmp_path / "truck_data/data/trucks/2025-01-01/09").mkdir(parents=True)
+    (tmp_path / "truck_data/data" / keys[0]).write_bytes(CSV)
+
+    files = run(make_args(), MagicMock(), MagicMock(), PAYMENT_MAPPING)
+
+    assert files == 1
+    assert mock_record.call_args.args[1] == [s3_objects[0]]
+    assert mock_watermark.call_args.args[1] == [s3_objects[0]]
+
+
+@patch('pipeline.release_files')
+@patch('pipeline.renew_leases')
+@patch('pipeline.update_watermark')
+@patch('pipeline.record_uploaded_files')
+@patch('pipeline.load')
+@patch('pipeline.extract_main')
+def test_overlapping_lease_runs_only_read_their_own_files(mock_extract, mock_load, mock_record,
+                                                          mock_watermark, mock_renew,
+                                                          mock_release, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    keys = {"worker-a": "trucks/2025-01-01/09/truck_T1_2025010109.csv",
+            "worker-b": "trucks/2025-01-01/09/truck_T2_2025010109.csv"}
+
+    def extract(*args, data_folder=None):
+        """Downloads the worker's file to the data folder it was given."""
+        data_folder = data_folder or args[7]
+        key = keys[data_folder.split("/")[-1]]
+        (tmp_path / data_folder / key).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / data_folder / key).write_bytes(CSV)
+        return [make_s3_object(key)], [make_s3_object(key)]
+    mock_extract.side_effect = extract
+    # Worker b is part way through its run when worker a starts
+    extract(data_folder="truck_data/worker-b")
+
+    files = run(make_args(lease=True, worker_id="worker-a"), MagicMock(), MagicMock(),
+                PAYMENT_MAPPING)
+
+    assert files == 1
+    assert mock_load.call_args.args[1]["filename"].tolist() == [keys["worker-a"]]
+    assert [obj["Key"] for obj in mock_record.call_args.args[1]] == [keys["worker-a"]]
+    assert (tmp_path / "truck_data/worker-b" / keys["worker-b"]).exists()
+    assert not (tmp_path / "truck_data/worker-a").exists()
+
+    files = run(make_args(lease=True, worker_id="worker-b"), MagicMock(), MagicMock(),
+                PAYMENT_MAPPING)
+
+    assert files == 1
+    assert [obj["Key"] for obj in mock_record.call_args.args[1]] == [keys["worker-b"]]
+    assert not (tmp_path / "truck_data/worker-b").exists()
+
+
+@patch('pipeline.update_watermark')
+@patch('pipeline.load')
+@patch('pipeline.extract_main')
+def test_run_replaces_a_file_uploaded_again_without_clean_rows(mock_extract, mock_load,
+                                                              mock_watermark, tmp_path,
+                                                              monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    key = "trucks/2025-01-01/09/truck_T1_2025010109.csv"
+    s3_objects = [make_s3_object(key)]
+    mock_extract.return_value = (s3_objects, s3_objects)
+    (tmp_path / "truck_data/data/trucks/2025-01-01/09").mkdir(parents=True)
+    (tmp_path / "truck_data/data" / key).write_bytes(
+        b"timestamp,type,total\n2025-01-01 09:00:00,card,VOID\n")
+    connection = MagicMock()
+    cursor = connection.cursor.return_value
+    cursor.fetchall.return_value = [{"filename": key, "filename_id": 7}]
+    cursor.fetchone.return_value = {"first_at": datetime(2025, 1, 1, 9),
+                                    "last_at": datetime(2025, 1, 1, 9), "first_id": None}
+
+    files = run(make_args(), connection, MagicMock(), PAYMENT_MAPPING)
+
+    # load was only given an empty DataFrame, which has no files to replace
+    assert not len(mock_load.call_args.args[1])
+    assert files == 1
+    statements = [call.args for call in cursor.execute.call_args_list]
+    assert ("DELETE FROM Transaction WHERE filename_id IN (%s);", [7]) in statements
+    assert any("-SUM(total)" in sql for sql, *_ in statements)
+    assert any("load_version = load_version + 1" in sql for sql, *_ in statements)
+    # The old transactions are deleted in the same transaction as the new version is confirmed
+    confirmed = cursor.executemany.call_args.args[1]
+    assert confirmed == [(key, "abc", len(CSV))]
+    connection.commit.assert_called_once()
+
+
+@patch('pipeline.extract_main', return_value=([], []))
+def test_run_passes_the_daemons_rescan_and_the_lookback_to_extract(mock_extract, tmp_path,
+                                                                   monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = make_args(lookback=timedelta(hours=6))
+
+    files = run(args, MagicMock(), MagicMock(), PAYMENT_MAPPING, rescan=True)
+
+    assert files == 0
+    assert mock_extract.call_args.args[3] is True
+    assert mock_extract.call_args.args[-1] == timedelta(hours=6)
+    assert args.rescan is False
@@ -0,0 +1,42 @@
+"""Testing rollup.py functions"""
+# Standard library imports
+from datetime import date, datetime
+from unittest.mock import MagicMock
+
+# Third-party imports
+import pandas as pd
+
+# Local imports
+from rollup import get_rollup_deltas, subtract_file_rollups
+from test_load import make_trucks_df
+
+
+def test_get_rollup_deltas():
+    deltas = get_rollup_deltas(make_trucks_df())
+    daily = deltas["Transaction_Daily"]
+    assert daily[["truck_id", "payment_method_id", "count"]].values.tolist() == [
+        [1, 1, 1], [1, 2, 1], [2, 2, 1]]
+    hourly = deltas["Transaction_Hourly"]
+    assert (hourly["at"] == pd.Timestamp("2025-01-01 12:00:00")).all()
+    assert hourly["sum"].round(2).tolist() == [4.5, 3.5, 12.34]
+
+
+def test_subtract_file_rollups_only_deletes_empty_buckets_in_range():
+    cur = MagicMock()
+    cur.fetchone.return_value = {"first_at": datetime(2025, 1, 1, 12, 30),
+                                 "last_at": datetime(2025, 1, 2, 9, 15)}
+    subtract_file_rollups(cur, [1, 2])
+    deletes = [call.args for call in cur.execute.call_args_list
+               if call.args[0].startswith("DELETE")]
+    assert len(deletes) == 2
+    for sql, params in deletes:
+        assert "transaction_count = 0" in sql
+        assert params == (date(2025, 1, 1), datetime(2025, 1, 2, 9, 15))
+
+
+def test_subtract_file_rollups_without_transactions_deletes_nothing():
+    cur = MagicMock()
+    cur.fetchone.return_value = {"first_at": None, "last_at": None}
+    subtract_file_rollups(cur, [1])
+    assert not [call for call in cur.execute.call_args_list
+                if call.args[0].startswith("DELETE")]
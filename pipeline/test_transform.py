@@ -0,0 +1,208 @@
+"""Testing transform.py functions"""
+# Native imports
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+# Third-party imports
+import pandas as pd
+
+# Local imports
+from metrics import COUNTS, reset_metrics, get_stage_metrics
+from transform import (get_truck_id, combine_streamed_files, clean_at_column,
+                       clean_truck_id_column, clean_total_column, clean_type_column,
+                       apply_mapping, clean_transactions, transform, transform_chunks,
+                       read_truck_file, categorical_to_numeric, transform_parallel,
+                       parse_timestamps, get_process_pool)
+
+
+def test_get_truck_id():
+    assert get_truck_id("trucks/2025-01/01/12/Hist_T3_20250101.csv") == 3
+    assert get_truck_id("trucks_2025-01_01_12_Hist_T12_20250101.csv") == 12
+
+
+def test_combine_streamed_files():
+    stream = [
+        ("trucks/Hist_T1_1.csv", b"timestamp,type,total\n2025-01-01 12:00:00,card,3.5\n"),
+        ("trucks/Hist_T2_1.csv", b"timestamp,type,total\n2025-01-01 13:00:00,cash,4.0\n")
+    ]
+    df = combine_streamed_files(iter(stream))
+    assert list(df["truck_id"]) == [1, 2]
+    assert list(df["total"]) == [3.5, 4.0]
+
+
+def test_combine_streamed_files_empty():
+    assert combine_streamed_files(iter([])) is None
+
+
+def make_messy_df() -> pd.DataFrame:
+    """Creates truck data with the kinds of values the cleaners handle."""
+    df = pd.DataFrame({
+        "timestamp": ["2025-01-01 12:00:00", "2025-01-01 12:05:00", "2025-01-01 12:10:00",
+                      "2025-01-01 12:15:00", None, "2025-01-01 12:25:00",
+                      "2025-01-01 12:30:00"],
+        "type": ["Card", "cash", "crypto", "CASH", "card", None, "card"],
+        "total": ["3.5", "-450", "2", "VOID", "4", "5", "1234"],
+        "truck_id": [1, 1, 2, 2, 3, 3, 3],
+        "filename": ["trucks/a_T1_1.csv"] * 7
+    })
+    # Files are concatenated, so the index has repeats
+    df.index = [0, 1, 0, 1, 0, 1, 2]
+    return df
+
+
+def test_clean_transactions_matches_each_clean_function():
+    payment_mapping = {"cash": 1, "card": 2}
+    expected = make_messy_df()
+    expected = clean_at_column(expected)
+    expected = clean_truck_id_column(expected)
+    expected = clean_total_column(expected)
+    expected = clean_type_column(expected)
+    expected = apply_mapping(expected, payment_mapping).reset_index(drop=True)
+
+    result = clean_transactions(make_messy_df(), payment_mapping)
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert list(result["total"]) == [3.5, 4.5, 12.34]
+    assert list(result["payment_method_id"]) == [2, 1, 2]
+
+
+@patch.dict('metrics.COUNTS', clear=True)
+def test_clean_transactions_counts_dropped_rows():
+    clean_transactions(make_messy_df(), {"cash": 1, "card": 2})
+    assert dict(COUNTS) == {
+        "rows_in": 7, "rows_out": 3, "rows_dropped_missing_values": 2,
+        "rows_dropped_invalid_truck_id": 0, "rows_dropped_invalid_total": 1,
+        "rows_dropped_payment_type_not_accepted": 2}
+
+
+@patch('transform.get_payment_mapping', return_value={"cash": 1, "card": 2})
+@patch('transform.get_connection')
+def test_transform_chunks_matches_transform(mock_connection, mock_mapping):
+    body = ("timestamp,type,total\n" + "2025-01-01 12:00:00,card,3.5\n" * 3
+            + "2025-01-01 12:05:00,crypto,4\n" + "2025-01-01 12:10:00,Cash,450\n" * 2).encode()
+    stream = [("trucks/Hist_T1_1.csv", body), ("trucks/Hist_T2_1.csv", body)]
+
+    chunks = list(transform_chunks(2, iter(stream)))
+    expected = transform(iter(stream))
+
+    assert all(len(chunk) >= 2 for chunk in chunks)
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True).astype({"filename": str}),
+                                  expected.astype({"filename": str}))
+
+
+def test_transform_notes_the_files_read():
+    body = b"timestamp,type,total\n2025-01-01 12:00:00,crypto,3.5\n"
+    stream = [("trucks/Hist_T1_1.csv", body), ("trucks/Hist_T2_1.csv", body)]
+
+    for run in (lambda keys: transform(iter(stream), payment_mapping={}, read_keys=keys),
+                lambda keys: list(transform_chunks(2, iter(stream), {}, keys))):
+        read_keys = []
+        run(read_keys)
+        # Files with no clean rows were still read
+        assert read_keys == ["trucks/Hist_T1_1.csv", "trucks/Hist_T2_1.csv"]
+
+
+def test_read_truck_file_applies_schema():
+    body = b"timestamp,type,total\n2025-01-01 12:00:00,Card,3.5\n2025-01-01 12:05:00,cash,VOID\n"
+    df = read_truck_file(BytesIO(body), "trucks/Hist_T4_1.csv")
+    assert df["truck_id"].dtype == "int16"
+    assert df["filename"].tolist() == ["trucks/Hist_T4_1.csv"] * 2
+
+
+def test_parse_timestamps_falls_back_to_other_formats():
+    timestamps = pd.Series(["2025-01-01 12:00:00", "2025-01-01T12:05:00", "not a time", None],
+                           dtype=object)
+    parsed = parse_timestamps(timestamps)
+    assert parsed[:2].tolist() == [pd.Timestamp("2025-01-01 12:00:00"),
+                                   pd.Timestamp("2025-01-01 12:05:00")]
+    assert parsed[2:].isna().all()
+
+
+def test_combine_streamed_files_types_columns_once_combined():
+    stream = [("trucks/Hist_T4_1.csv", b"timestamp,type,total\n2025-01-01 12:00:00,Card,3.5\n"),
+              ("trucks/Hist_T5_1.csv", b"timestamp,type,total\n2025-01-01 12:05:00,cash,VOID\n")]
+    df = combine_streamed_files(stream)
+    assert pd.api.types.is_datetime64_any_dtype(df["timestamp"])
+    assert isinstance(df["type"].dtype, pd.CategoricalDtype)
+    assert df["total"].tolist()[0] == 3.5
+    assert df["total"].isna().tolist() == [False, True]
+
+
+def test_categorical_to_numeric():
+    values = pd.Series(["3.5", "VOID", None, "3.5", "450"], dtype="category")
+    result = categorical_to_numeric(values)
+    assert result[[0, 3, 4]].tolist() == [3.5, 3.5, 450.0]
+    assert pd.isna(result[[1, 2]]).all()
+
+
+@patch('transform.get_payment_mapping', return_value={"cash": 1, "card": 2})
+@patch('transform.get_connection')
+def test_transform_parallel_matches_transform(mock_connection, mock_mapping):
+    body = ("timestamp,type,total\n" + "2025-01-01 12:00:00,card,3.5\n" * 3
+            + "2025-01-01 12:05:00,crypto,4\n" + "2025-01-01 12:10:00,Cash,450\n" * 2).encode()
+    stream = [(f"trucks/Hist_T{truck}_1.csv", body) for truck in range(1, 6)]
+    stream.append(("trucks/Hist_T6_1.csv", b"timestamp,type,total\n2025-01-01 12:00:00,crypto,1\n"))
+
+    result = transform_parallel(2, iter(stream))
+    expected = transform(iter(stream))
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@patch('transform.get_connection')
+def test_transform_parallel_records_worker_metrics(mock_connection):
+    body = ("timestamp,type,total\n" + "2025-01-01 12:00:00,card,3.5\n" * 3
+            + "2025-01-01 12:05:00,crypto,4\n").encode()
+    stream = [(f"trucks/Hist_T{truck}_1.csv", body) for truck in range(1, 5)]
+    reset_metrics()
+
+    transform_parallel(2, iter(stream), payment_mapping={"cash": 1, "card": 2})
+
+    seconds, counts = get_stage_metrics()
+    assert counts["rows_in"] == 16
+    assert counts["rows_out"] == 12
+    assert counts["rows_dropped_payment_type_not_accepted"] == 4
+    assert {"parse", "clean", "transform_parallel"} <= set(seconds)
+    mock_connection.assert_not_called()
+
+
+def test_transform_parallel_reuses_the_given_pool():
+    stream = [(f"trucks/Hist_T{truck}_1.csv",
+               b"timestamp,type,total\n2025-01-01 12:00:00,card,3.5\n") for truck in range(1, 4)]
+    with get_process_pool(2) as executor:
+        with patch("transform.get_process_pool") as mock_pool:
+            first = transform_parallel(2, iter(stream), payment_mapping={"card": 2},
+                                       executor=executor)
+            second = transform_parallel(2, iter(stream), payment_mapping={"card": 2},
+                                        executor=executor)
+        mock_pool.assert_not_called()
+    pd.testing.assert_frame_equal(first, second)
+    assert len(first) == 3
+
+
+def test_transform_parallel_reads_the_stream_as_workers_finish():
+    body = b"timestamp,type,total\n2025-01-01 12:00:00,card,3.5\n"
+    read = []
+
+    def stream():
+        for truck in range(1, 11):
+            read.append(truck)
+            yield f"trucks/Hist_T{truck}_1.csv", body
+
+    executor = MagicMock()
+    executor.submit.side_effect = lambda function, *args: MagicMock(
+        result=MagicMock(return_value=function(*args)))
+    in_flight = []
+
+    def wait_first(futures, return_when):
+        in_flight.append(len(read))
+        return {next(iter(futures))}, set()
+
+    with patch("transform.wait", side_effect=wait_first):
+        result = transform_parallel(2, stream(), payment_mapping={"card": 2},
+                                    executor=executor)
+
+    assert in_flight == [5, 6, 7, 8, 9, 10]
+    assert result["filename"].cat.categories.tolist() == [
+        f"trucks/Hist_T{truck}_1.csv" for truck in range(1, 11)]
+    assert result["truck_id"].tolist() == list(range(1, 11))
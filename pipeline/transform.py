@@ -1,99 +1,388 @@
 """Food trucks data pipeline: transform"""
 # Standard library imports
-from os import listdir, environ as ENV
+from os import walk, path, environ as ENV
+from io import BytesIO
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+from multiprocessing import get_context
 
 # Third-party imports
+from pandas.api.types import union_categoricals
+import numpy as np
 import pandas as pd
 import pymysql
 
+# Local imports
+from db import stream_rows
+from extract import DATA_FOLDER
+from metrics import timed, add_count, reset_metrics, get_stage_metrics, merge_metrics
 
-def get_files() -> list[str]:
-    """Gets the files to be transformed."""
-    return listdir("truck_data/data")
 
+ACCEPTED_PAYMENT_TYPES = ("cash", "card")
 
-def combine_transaction_data_files(files: list[str]) -> pd.DataFrame:
+# Read as plain text, as typing each small file costs more than parsing it.
+# The columns are typed once the files are combined, see apply_column_types.
+TRUCK_CSV_DTYPES = {"timestamp": object, "type": object, "total": object}
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+CSV_ENGINES = ("c", "pyarrow")
+CSV_ENGINE = "c"
+
+
+def get_files(data_folder: str = DATA_FOLDER) -> list[str]:
+    """Gets the files to be transformed, as their s3 keys."""
+    return [path.relpath(path.join(folder, file), data_folder)
+            for folder, _, files in walk(data_folder) for file in files]
+
+
+def get_truck_id(filename: str) -> int:
+    """Gets the truck id from a file name or s3 key, eg. trucks/..._T3_..."""
+    return int(filename.split("_")[-2].replace("T", ""))
+
+
+def categorical_to_numeric(values: pd.Series) -> np.ndarray:
+    """Converts categorical text to numbers, once per category rather than once per row.
+    Anything that isn't a number becomes NaN."""
+    categories = pd.to_numeric(values.cat.categories, errors="coerce")
+    numbers = np.append(np.asarray(categories, dtype=np.float64), np.nan)
+    # Missing values have a code of -1, which picks the NaN on the end
+    return numbers[values.cat.codes.to_numpy()]
+
+
+def apply_truck_file_schema(df: pd.DataFrame, filename: str) -> pd.DataFrame:
+    """Adds the truck id and the file it came from to a truck csv."""
+    df["truck_id"] = np.int16(get_truck_id(filename))
+    df["filename"] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), [filename])
+    return df
+
+
+def parse_timestamps(timestamps: pd.Series) -> pd.Series:
+    """Parses timestamps in TIMESTAMP_FORMAT, falling back to working out the
+    format of any that aren't. Anything that isn't a timestamp becomes NaT."""
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        return timestamps
+    parsed = pd.to_datetime(timestamps, format=TIMESTAMP_FORMAT, errors="coerce")
+    unparsed = (parsed.isna() & timestamps.notna()).to_numpy()
+    if unparsed.any():
+        parsed[unparsed] = pd.to_datetime(timestamps[unparsed], format="mixed", errors="coerce")
+    return parsed
+
+
+def apply_column_types(trucks_df: pd.DataFrame) -> pd.DataFrame:
+    """Parses the timestamps, makes the payment types categorical and the totals
+    numeric, once for the combined files. Totals have values like VOID and the same
+    prices come up again and again, so they are converted once per distinct value."""
+    trucks_df["timestamp"] = parse_timestamps(trucks_df["timestamp"])
+    trucks_df["type"] = trucks_df["type"].astype("category")
+    trucks_df["total"] = categorical_to_numeric(trucks_df["total"].astype("category"))
+    return trucks_df
+
+
+def read_truck_csv(source, engine: str = CSV_ENGINE) -> pd.DataFrame:
+    """Reads a truck csv from a path or file-like object as text."""
+    if engine == "pyarrow":
+        # pyarrow works out the types itself far faster than it converts them to text
+        return pd.read_csv(source, engine=engine)
+    return pd.read_csv(source, dtype=TRUCK_CSV_DTYPES, engine=engine)
+
+
+def read_truck_file(source, filename: str, engine: str = CSV_ENGINE) -> pd.DataFrame:
+    """Reads a truck csv from a path or file-like object,
+    adds the truck id and the file it came from."""
+    return apply_truck_file_schema(read_truck_csv(source, engine), filename)
+
+
+def read_truck_file_chunks(source, filename: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Reads a truck csv chunk_size rows at a time,
+    adding the truck id and the file it came from to each chunk.
+    Only the c engine can read in chunks."""
+    with pd.read_csv(source, dtype=TRUCK_CSV_DTYPES, chunksize=chunk_size) as reader:
+        for df in reader:
+            yield apply_column_types(apply_truck_file_schema(df, filename))
+
+
+def concat_truck_files(trucks_dfs: list[pd.DataFrame], ignore_index: bool = False) -> pd.DataFrame:
+    """Combines the truck DataFrames, keeping the categorical columns categorical
+    rather than letting pandas fall back to strings when the categories differ."""
+    for column in trucks_dfs[0].select_dtypes("category").columns:
+        categories = union_categoricals([df[column] for df in trucks_dfs]).categories
+        for df in trucks_dfs:
+            df[column] = df[column].cat.set_categories(categories)
+    return pd.concat(trucks_dfs, ignore_index=ignore_index)
+
+
+def combine_truck_csvs(trucks_dfs: list[pd.DataFrame], filenames: list[str]) -> pd.DataFrame:
+    """Combines truck csvs read as text, adding the truck id and the file each row
+    came from for every file at once rather than to each small file, then types
+    the columns."""
+    lengths = [len(df) for df in trucks_dfs]
+    truck_ids = np.array([get_truck_id(filename) for filename in filenames], dtype=np.int16)
+    trucks_df = pd.concat(trucks_dfs)
+    trucks_df["truck_id"] = np.repeat(truck_ids, lengths)
+    trucks_df["filename"] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(filenames)), lengths), filenames)
+    return apply_column_types(trucks_df)
+
+
+def track_keys(stream: Iterable[tuple[str, bytes]], keys: list[str]) -> Iterator:
+    """Passes the stream on, keeping a note of each key that was streamed."""
+    for key, body in stream:
+        keys.append(key)
+        yield key, body
+
+
+def get_sources(stream: Iterable[tuple[str, bytes]] | None = None,
+                read_keys: list[str] | None = None,
+                data_folder: str = DATA_FOLDER) -> Iterator[tuple]:
+    """Gets (source, filename) for each file in the data/ folder,
+    or for each (key, body) in the stream when given one.
+    Each filename is added to read_keys when given, as it is read."""
+    if stream is not None:
+        for key, body in stream:
+            yield BytesIO(body), key
+            if read_keys is not None:
+                read_keys.append(key)
+    else:
+        for file in get_files(data_folder):
+            yield f'{data_folder}/{file}', file
+            if read_keys is not None:
+                read_keys.append(file)
+
+
+@timed("parse")
+def combine_transaction_data_files(files: list[str], engine: str = CSV_ENGINE,
+                                   data_folder: str = DATA_FOLDER) -> pd.DataFrame:
     """Loads and combines relevant files from the data/ folder.
     Produces a single pandas DataFrame."""
-    trucks_dfs = []
-    for file in files:
-        df = pd.read_csv(f'truck_data/data/{file}')
-        truck_id = int(file.split("_")[-2].replace("T", ""))
-        df["truck_id"] = truck_id
-        trucks_dfs.append(df)
+    trucks_dfs = [read_truck_csv(f'{data_folder}/{file}', engine) for file in files]
+    return combine_truck_csvs(trucks_dfs, files)
 
-    return pd.concat(trucks_dfs)
+
+@timed("stream_and_parse")
+def combine_streamed_files(stream: Iterable[tuple[str, bytes]],
+                           engine: str = CSV_ENGINE) -> pd.DataFrame | None:
+    """Parses each (key, body) in memory as it arrives and combines them.
+    Produces a single pandas DataFrame, or None if nothing was streamed.
+    The time recorded includes waiting for the files to download."""
+    trucks_dfs, keys = [], []
+    for key, body in stream:
+        trucks_dfs.append(read_truck_csv(BytesIO(body), engine))
+        keys.append(key)
+    if not trucks_dfs:
+        return None
+    return combine_truck_csvs(trucks_dfs, keys)
 
 
 def clean_at_column(df: pd.DataFrame) -> pd.DataFrame:
     """Rename timestamp to at."""
-    df = df.rename(columns={"timestamp": "at"})
+    df.rename(columns={"timestamp": "at"}, inplace=True)
     return df
 
 
 def clean_truck_id_column(df: pd.DataFrame) -> pd.DataFrame:
     """Change truck_id to int"""
     df['truck_id'] = pd.to_numeric(df['truck_id'])
-    df = df[df['truck_id'].notna()]
-    return df
+    return df[df['truck_id'].notna().to_numpy()]
+
+
+def normalise_total(total: pd.Series) -> pd.Series:
+    """Makes each total positive, totals of 100 or more were recorded in pence."""
+    total = total.abs()
+    return total.where(total < 100, (total / 100).round(2))
 
 
 def clean_total_column(df: pd.DataFrame) -> pd.DataFrame:
     """Cleans the total column and returns a dataframe with a clean total column."""
     df['total'] = pd.to_numeric(df['total'], errors='coerce')
-    df = df.dropna()
-    df["total"] = df['total'].apply(lambda x: abs(x) if abs(x) < 100 else round(abs(x)/100, 2))
+    df = df[df.notna().all(axis=1).to_numpy()]
+    df["total"] = normalise_total(df['total'])
     return df
 
 
+def lower_payment_types(payment_type: pd.Series) -> pd.Series:
+    """Lowercases the payment types, only once per category when categorical."""
+    if isinstance(payment_type.dtype, pd.CategoricalDtype):
+        return payment_type.map(str.lower, na_action="ignore")
+    return payment_type.str.lower()
+
+
 def clean_type_column(df: pd.DataFrame) -> pd.DataFrame:
     """Cleans the type column, 
     removes any type that isn't cash or card (crypto not accepted)."""
-    df = df[(df['type'].str.lower() == 'cash') | (df['type'].str.lower() == 'card')]
-    df['type'] = df['type'].str.lower()
-    df = df.rename(columns={"type": "payment_method_id"})
+    payment_type = lower_payment_types(df['type'])
+    accepted = payment_type.isin(ACCEPTED_PAYMENT_TYPES).to_numpy()
+    df = df[accepted]
+    df['type'] = payment_type.to_numpy()[accepted]
+    df.rename(columns={"type": "payment_method_id"}, inplace=True)
     return df
 
 
 def get_payment_mapping(conn: object) -> dict:
     """Reads mapping data from a file and returns it as a dictionary."""
-    sql = """SELECT * FROM Payment_Method"""
-    cur = conn.cursor()
-    cur.execute(sql)
-    result = cur.fetchall()
-    cur.close()
-    return {row['payment_method']: row['payment_method_id'] for row in result}
+    sql = """SELECT payment_method, payment_method_id FROM Payment_Method"""
+    return {payment_method: payment_method_id
+            for rows in stream_rows(conn, sql)
+            for payment_method, payment_method_id in rows}
 
 
 def apply_mapping(df: pd.DataFrame, payment_mapping: dict) -> pd.DataFrame:
     """Maps the payment type to payment_id"""
-    df['payment_method_id'] = df['payment_method_id'].apply(lambda x: payment_mapping[x])
+    df['payment_method_id'] = df['payment_method_id'].map(payment_mapping)
     return df
 
 
-def transform() -> pd.DataFrame:
-    """Main function to transform files form csv to DataFrame."""
-    files = get_files()
-    if len(files) != 0:
-        trucks_df = combine_transaction_data_files(files)
-        trucks_df = clean_at_column(trucks_df)
-        trucks_df = clean_truck_id_column(trucks_df)
-        trucks_df = clean_total_column(trucks_df)
-        trucks_df = clean_type_column(trucks_df)
-
-        conn = pymysql.connect(host=ENV["DB_HOST"],
-                user=ENV["DB_USER"],
-                password=ENV["DB_PASSWORD"],
-                database=ENV["DB_NAME"],
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor)
-
-        trucks_df = apply_mapping(trucks_df, get_payment_mapping(conn))
-        conn.close()
-        trucks_df.reset_index(drop=True)
-
-        return trucks_df
-    return None
+def get_connection() -> pymysql.Connection:
+    """Gets the connection to the database."""
+    return pymysql.connect(host=ENV["DB_HOST"],
+            user=ENV["DB_USER"],
+            password=ENV["DB_PASSWORD"],
+            database=ENV["DB_NAME"],
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor)
+
+
+def read_payment_mapping() -> dict:
+    """Reads the payment mapping on a connection of its own."""
+    conn = get_connection()
+    payment_mapping = get_payment_mapping(conn)
+    conn.close()
+    return payment_mapping
+
+
+@timed("clean")
+def clean_transactions(trucks_df: pd.DataFrame, payment_mapping: dict) -> pd.DataFrame:
+    """Cleans the combined truck data and maps the payment types in a single pass,
+    giving the same result as each of the clean functions followed by apply_mapping.
+    Every filter is combined into one mask so the rows are only copied once.
+    The rows failing each filter are counted, a row can fail more than one."""
+    trucks_df.rename(columns={"timestamp": "at", "type": "payment_method_id"}, inplace=True)
+    truck_id = pd.to_numeric(trucks_df['truck_id'])
+    total = pd.to_numeric(trucks_df['total'], errors='coerce')
+    payment_type = lower_payment_types(trucks_df['payment_method_id'])
+
+    filters = {"missing_values": trucks_df.notna().all(axis=1).to_numpy(),
+               "invalid_truck_id": truck_id.notna().to_numpy(),
+               "invalid_total": total.notna().to_numpy(),
+               "payment_type_not_accepted": payment_type.isin(ACCEPTED_PAYMENT_TYPES).to_numpy()}
+    keep = np.logical_and.reduce(list(filters.values()))
+    add_count("rows_in", len(keep))
+    add_count("rows_out", int(keep.sum()))
+    for name, passed in filters.items():
+        add_count(f"rows_dropped_{name}", int(len(passed) - passed.sum()))
+    trucks_df = trucks_df[keep].reset_index(drop=True)
+    trucks_df['truck_id'] = truck_id.to_numpy()[keep]
+    trucks_df['total'] = normalise_total(pd.Series(total.to_numpy()[keep]))
+    trucks_df['payment_method_id'] = pd.Series(
+        payment_type.to_numpy()[keep]).map(payment_mapping)
+    return trucks_df
+
+
+def transform(stream: Iterable[tuple[str, bytes]] | None = None,
+              engine: str = CSV_ENGINE, payment_mapping: dict | None = None,
+              read_keys: list[str] | None = None,
+              data_folder: str = DATA_FOLDER) -> pd.DataFrame:
+    """Main function to transform files form csv to DataFrame.
+    Reads from the data/ folder, or from a stream of (key, body) when given one.
+    The payment mapping is read from the database unless one is given.
+    The files read are added to read_keys when given, so only those are confirmed."""
+    if read_keys is None:
+        read_keys = []
+    if stream is not None:
+        trucks_df = combine_streamed_files(track_keys(stream, read_keys), engine)
+    else:
+        files = get_files(data_folder)
+        trucks_df = (combine_transaction_data_files(files, engine, data_folder)
+                     if len(files) != 0 else None)
+        read_keys.extend(files)
+
+    if trucks_df is None:
+        return None
+    if payment_mapping is None:
+        payment_mapping = read_payment_mapping()
+    return clean_transactions(trucks_df, payment_mapping)
+
+
+def transform_file(source, filename: str, payment_mapping: dict,
+                   engine: str = CSV_ENGINE) -> tuple[pd.DataFrame, dict, dict]:
+    """Reads and cleans a single truck file, run in a worker process by transform_parallel.
+    The parent can't see the metrics recorded in the worker, so the seconds and
+    counts of the file are returned with it."""
+    reset_metrics()
+    with timed("parse"):
+        trucks_df = apply_column_types(read_truck_file(source, filename, engine))
+    trucks_df = clean_transactions(trucks_df, payment_mapping)
+    return trucks_df, *get_stage_metrics()
+
+
+def get_process_pool(processes: int) -> ProcessPoolExecutor:
+    """Creates a pool of worker processes for transform_parallel."""
+    # Spawn rather than fork, as the download threads may still be running
+    return ProcessPoolExecutor(max_workers=processes, mp_context=get_context("spawn"))
+
+
+@timed("transform_parallel")
+def transform_parallel(processes: int, stream: Iterable[tuple[str, bytes]] | None = None,
+                       engine: str = CSV_ENGINE, payment_mapping: dict | None = None,
+                       read_keys: list[str] | None = None,
+                       executor: ProcessPoolExecutor | None = None,
+                       data_folder: str = DATA_FOLDER) -> pd.DataFrame | None:
+    """Transforms each file in a pool of worker processes and merges the results
+    in file order, giving the same DataFrame as transform. The parse and clean
+    seconds and the row counts of every worker are added to this run's metrics.
+    Files are handed to the pool as they are read, with at most 2 * processes
+    waiting, so a stream is never read far ahead of the workers.
+    A pool is created for the call unless given one, eg. by the daemon."""
+    filenames, results, futures = [], {}, {}
+    with get_process_pool(processes) if executor is None else nullcontext(executor) as executor:
+        for source, filename in get_sources(stream, read_keys, data_folder):
+            if payment_mapping is None:
+                payment_mapping = read_payment_mapping()
+            if len(futures) >= 2 * processes:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[futures.pop(future)] = future.result()
+            futures[executor.submit(transform_file, source, filename,
+                                    payment_mapping, engine)] = len(filenames)
+            filenames.append(filename)
+        for future in futures:
+            results[futures[future]] = future.result()
+    if not filenames:
+        return None
+
+    trucks_dfs = []
+    for index in range(len(filenames)):
+        trucks_df, seconds, counts = results[index]
+        trucks_dfs.append(trucks_df)
+        merge_metrics(seconds, counts)
+    # Files with no clean rows lose their column types, so leave them out of the merge
+    cleaned_dfs = [df for df in trucks_dfs if len(df)] or trucks_dfs[:1]
+    trucks_df = concat_truck_files(cleaned_dfs, ignore_index=True)
+    trucks_df["filename"] = trucks_df["filename"].cat.set_categories(filenames)
+    return trucks_df
+
+
+def transform_chunks(chunk_size: int, stream: Iterable[tuple[str, bytes]] | None = None,
+                     payment_mapping: dict | None = None,
+                     read_keys: list[str] | None = None,
+                     data_folder: str = DATA_FOLDER) -> Iterator[pd.DataFrame]:
+    """Transforms the files chunk_size rows at a time, so memory stays bounded
+    however many files there are. Yields cleaned DataFrames of at least chunk_size
+    rows (apart from the last), ready to be loaded."""
+    cleaned_dfs, cleaned_rows = [], 0
+    for source, filename in get_sources(stream, read_keys, data_folder):
+        for df in read_truck_file_chunks(source, filename, chunk_size):
+            if payment_mapping is None:
+                payment_mapping = read_payment_mapping()
+            df = clean_transactions(df, payment_mapping)
+            cleaned_dfs.append(df)
+            cleaned_rows += len(df)
+            if cleaned_rows >= chunk_size:
+                yield concat_truck_files(cleaned_dfs, ignore_index=True)
+                cleaned_dfs, cleaned_rows = [], 0
+
+    if cleaned_rows:
+        yield concat_truck_files(cleaned_dfs, ignore_index=True)
+
 
 if __name__ == "__main__":
     data_frame = transform()
@@ -1,11 +1,23 @@
-"""A script to generate a html report of the previous days financial data."""
+"""A script to generate a html report of the previous days financial data.
+The report only has a few rows per day, so it is built without pandas to keep
+the Lambda's cold start short."""
 # Native imports
+from argparse import ArgumentParser
+from datetime import date, timedelta
+from html import escape
 from os import environ as ENV, path, remove
 
 # Third-party imports
 import pymysql
-import pandas as pd
-from dotenv import load_dotenv
+
+# Local imports
+from db import stream_rows
+
+
+REPORT_DAYS_AGO = 2
+
+# Reused across warm invocations of the Lambda
+CONNECTION = None
 
 
 # CSS
@@ -74,21 +86,68 @@ H3_STYLE = """
 
 
 # Functions
-def get_data(conn: pymysql.Connection):
-    """Gets yesterdays data from the database."""
+def initialise_args() -> tuple[date, date]:
+    """Gets the cli arguments"""
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--start", type=date.fromisoformat, default=None,
+        help="-s or --start the first day to generate a report for, eg. 2025-01-31.")
+    parser.add_argument("-e", "--end", type=date.fromisoformat, default=None,
+        help="-e or --end the last day to generate a report for, defaults to --start.")
+    args = parser.parse_args()
+    if args.end and not args.start:
+        parser.error("--end can only be used with --start.")
+    if args.start and args.end and args.end < args.start:
+        parser.error("--end can't be before --start.")
+    return args.start, args.end or args.start
+
+
+def get_report_day() -> date:
+    """Gets the day the daily report is for."""
+    return date.today() - timedelta(days=REPORT_DAYS_AGO)
+
+
+def get_data(conn: pymysql.Connection, start: date, end: date) -> list[tuple]:
+    """Gets the day, truck_id, total sales and number of transactions of each truck,
+    for each day from start up to but not including end."""
     sql = """
-        SELECT * FROM Transaction
-        WHERE DATE(at) = DATE(DATE(NOW()) - 2);
+        SELECT day, truck_id, SUM(total) AS total, SUM(transaction_count) AS transactions
+        FROM Transaction_Daily
+        WHERE day >= %s AND day < %s
+        GROUP BY day, truck_id
+        ORDER BY day, truck_id;
     """
-    cur = conn.cursor()
-    cur.execute(sql)
-    result = cur.fetchall()
-    cur.close()
-    return result
+    return [row for rows in stream_rows(conn, sql, (start, end)) for row in rows]
+
+
+def generate_table(columns: list[str], rows: list[tuple]) -> str:
+    """Generates a html table with the given column names and rows."""
+    header = "".join(f"<th>{escape(column)}</th>" for column in columns)
+    body = "".join("<tr>" + "".join(f"<td>{escape(str(value))}</td>" for value in row) + "</tr>"
+                   for row in rows)
+    return f"<table><thead><tr>{header}</tr></thead><tbody>{body}</tbody></table>"
+
+
+def generate_report(rows: list[tuple]) -> str:
+    """Generates the html for one day's report from its rows of get_data."""
+    value_total_transaction = f'£{round(sum(row[2] for row in rows), 2)}'
+    per_truck_transaction_value = generate_table(
+        ["truck_id", "total - £"], [(row[1], round(row[2], 2)) for row in rows])
+    per_truck_transactions = generate_table(
+        ["truck_id", "total"], [(row[1], int(row[3])) for row in rows])
+    return generate_html(value_total_transaction,
+                        per_truck_transaction_value, per_truck_transactions)
+
+
+def generate_reports(conn: pymysql.Connection, start: date, end: date) -> dict[date, str]:
+    """Generates the html for every day from start to end, with one query."""
+    rows_by_day = {start + timedelta(days=n): [] for n in range((end - start).days + 1)}
+    for row in get_data(conn, start, end + timedelta(days=1)):
+        rows_by_day[row[0]].append(row)
+    return {day: generate_report(rows) for day, rows in rows_by_day.items()}
 
 
 def generate_html(total_transaction_value: str,
-    transaction_value_per_truck: pd.DataFrame, transactions_per_truck: pd.DataFrame) -> str:
+    transaction_value_per_truck: str, transactions_per_truck: str) -> str:
     """Generates the html for the report"""
     return f"""
     {TABLE_STYLE}
@@ -98,52 +157,62 @@ def generate_html(total_transaction_value: str,
     <h1>Daily Trucks Data Report<h1/>
     <h2> Total transaction value: {total_transaction_value} <h2/>
     <h3> Total transaction value per Truck:<h3/>
-    {transaction_value_per_truck.to_html()}
+    {transaction_value_per_truck}
     <h3> Total transactions per Truck:<h3/>
-    {transactions_per_truck.to_html()}
+    {transactions_per_truck}
     """
 
 
-def create_html_file(html: str) -> None:
+def create_html_file(html: str, filename: str = 'report.html') -> None:
     """Generates the html file."""
-    if path.exists('report.html'):
-        remove('report.html')
-    with open('report.html', 'x', encoding='UTF-8') as file:
+    if path.exists(filename):
+        remove(filename)
+    with open(filename, 'x', encoding='UTF-8') as file:
         file.write(html)
 
 
 def lambda_handler(event=None, context=None):
     """Lambda function."""
-    html = main()
+    report_day = get_report_day()
+    html = main(report_day)[report_day]
     return {"message": html}
 
 
-def main():
-    """Function to run the script."""
-    # Initialise
-    load_dotenv()
-    conn = pymysql.connect(host=ENV["DB_HOST"],
+def get_connection() -> pymysql.Connection:
+    """Gets the connection to the database, reusing the last one if it is still alive."""
+    global CONNECTION
+    if CONNECTION is not None:
+        try:
+            CONNECTION.ping(reconnect=True)
+            return CONNECTION
+        except pymysql.Error:
+            CONNECTION = None
+    CONNECTION = pymysql.connect(host=ENV["DB_HOST"],
             user=ENV["DB_USER"],
             password=ENV["DB_PASSWORD"],
             database=ENV["DB_NAME"],
             charset='utf8mb4',
+            autocommit=True,
             cursorclass=pymysql.cursors.DictCursor)
+    return CONNECTION
 
-    # Get the data
-    data = get_data(conn)
 
-    # Create data frame and get relevant data
-    df = pd.DataFrame(data)
-    value_total_transaction = f'£{round(df['total'].round(2).sum(), 2)}'
-    per_truck_transaction_value = df[['total', 'truck_id']].groupby('truck_id'
-                            ).sum().reset_index().rename(columns = {"total": "total - £"})
-    per_truck_transactions = df[['total', 'truck_id']].groupby('truck_id').count().reset_index()
-
-    # Generate html
-    return generate_html(value_total_transaction,
-                        per_truck_transaction_value, per_truck_transactions)
+def main(start: date = None, end: date = None) -> dict[date, str]:
+    """Function to run the script.
+    Generates the report for each day from start to end, by default the report day."""
+    start = start or get_report_day()
+    end = end or start
+    return generate_reports(get_connection(), start, end)
 
 
 if __name__ == "__main__":
-    report_html = main()
-    create_html_file(report_html)
+    # The Lambda gets its environment variables from its configuration instead
+    from dotenv import load_dotenv
+    load_dotenv()
+    start_day, end_day = initialise_args()
+    if start_day:
+        for report_day, report_html in main(start_day, end_day).items():
+            create_html_file(report_html, f'report_{report_day}.html')
+    else:
+        report_day = get_report_day()
+        create_html_file(main(report_day)[report_day])
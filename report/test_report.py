@@ -0,0 +1,60 @@
+"""Testing report.py functions"""
+# Native imports
+import subprocess
+import sys
+from datetime import date
+from unittest.mock import patch, MagicMock
+
+# Third-party imports
+import pymysql
+
+# Local imports
+import report
+from report import generate_reports, get_connection
+
+
+# The most importing report may take on a cold start, in seconds
+IMPORT_BUDGET = 0.5
+
+
+def test_import_is_within_budget_without_pandas():
+    output = subprocess.run([sys.executable, "-c", """
+from time import perf_counter
+import sys
+start = perf_counter()
+import report
+print(perf_counter() - start, "pandas" in sys.modules)
+"""], capture_output=True, text=True, check=True).stdout.split()
+    assert float(output[0]) < IMPORT_BUDGET
+    assert output[1] == "False"
+
+
+@patch('report.get_data')
+def test_generate_reports_one_query_for_every_day(mock_get_data):
+    mock_get_data.return_value = [
+        (date(2025, 1, 1), 1, 10.126, 3),
+        (date(2025, 1, 1), 2, 5.0, 2),
+        (date(2025, 1, 3), 1, 3.0, 1)
+    ]
+    reports = generate_reports(None, date(2025, 1, 1), date(2025, 1, 3))
+
+    mock_get_data.assert_called_once_with(None, date(2025, 1, 1), date(2025, 1, 4))
+    assert list(reports) == [date(2025, 1, 1), date(2025, 1, 2), date(2025, 1, 3)]
+    assert "Total transaction value: £15.13" in reports[date(2025, 1, 1)]
+    assert "<td>1</td><td>10.13</td>" in reports[date(2025, 1, 1)]
+    assert "Total transaction value: £0" in reports[date(2025, 1, 2)]
+
+
+@patch.dict('report.ENV', {"DB_HOST": "host", "DB_USER": "user",
+                           "DB_PASSWORD": "password", "DB_NAME": "name"})
+@patch('report.pymysql.connect')
+def test_get_connection_reused_while_alive(mock_connect):
+    mock_connect.side_effect = lambda **kwargs: MagicMock()
+    with patch('report.CONNECTION', None):
+        first = get_connection()
+        assert get_connection() is first
+        first.ping.assert_called_with(reconnect=True)
+
+        first.ping.side_effect = pymysql.OperationalError
+        assert get_connection() is not first
+        assert report.CONNECTION is not first